@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_calendar_features.py
+Compare load_data.establish_relevant_columns against per-row strftime formatting of the same calendar labels.
+
+    usage: bench_calendar_features.py [-h] [-n ROWS [ROWS ...]] [-r REPEAT]
+"""
+import os
+import sys
+import argparse
+import timeit
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'pov_mileage_stats'))
+import load_data  # noqa: E402
+
+
+def strftime_relevant_columns(df):
+    """The row-by-row strftime version of establish_relevant_columns, kept here as the baseline."""
+    df.dropna(axis=0, how='any', subset=['Miles'], inplace=True)
+    df['DayOfWeek'] = df['Date'].dt.strftime(load_data.DAY_OF_WEEK_FORMAT)
+    df['Month'] = df['Date'].dt.strftime(load_data.MONTH_FORMAT)
+    df['Year'] = df['Date'].dt.year
+    return df
+
+
+def make_mileage_log(rows, seed=0):
+    """Build a synthetic mileage log with the given number of rows, a few per day."""
+    rng = np.random.RandomState(seed)
+    return pd.DataFrame({
+        'Date': pd.Timestamp('1990-01-01') + pd.to_timedelta(rng.randint(0, 365 * 30, size=rows), unit='D'),
+        'Miles': np.round(rng.gamma(2.0, 20.0, size=rows), 1),
+    }, columns=['Date', 'Miles'])
+
+
+def time_function(func, df, repeat):
+    """Best wall-clock time of func on a fresh copy of df."""
+    return min(timeit.repeat(lambda: func(df.copy()), number=1, repeat=repeat))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time calendar-feature derivation at several input sizes.")
+    parser.add_argument("-n", "--rows", type=int, nargs='+', default=[10000, 1000000, 10000000],
+                        help="Input sizes (number of rows) to time.")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Number of timed runs per size (best is kept).")
+    args = parser.parse_args(argv)
+
+    print("{:>10s} {:>12s} {:>12s} {:>9s}".format("rows", "strftime s", "lookup s", "speedup"))
+    for rows in args.rows:
+        df = make_mileage_log(rows)
+
+        # Check that both versions produce the same labels before timing them.
+        expected = strftime_relevant_columns(df.copy())
+        actual = load_data.establish_relevant_columns(df.copy())
+        for column in ('DayOfWeek', 'Month'):
+            assert (actual[column].astype(object).values == expected[column].values).all()
+
+        baseline = time_function(strftime_relevant_columns, df, args.repeat)
+        vectorized = time_function(load_data.establish_relevant_columns, df, args.repeat)
+        print("{:>10d} {:>12.3f} {:>12.3f} {:>8.1f}x".format(rows, baseline, vectorized, baseline / vectorized))
+
+
+if __name__ == "__main__":
+    main()
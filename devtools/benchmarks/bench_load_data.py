@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_load_data.py
+Compare how long each load_data input backend takes to read the same mileage log.
+
+Writes one synthetic log in every supported format to a temporary directory, then times load_data.import_data on each.
+
+    usage: bench_load_data.py [-h] [-n ROWS] [-r REPEAT]
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import timeit
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'pov_mileage_stats'))
+import load_data  # noqa: E402
+
+# File written for each format
+BENCH_FILES = {
+    'excel': 'mileage.xlsx',
+    'csv': 'mileage.csv',
+    'tsv': 'mileage.tsv',
+    'ndjson': 'mileage.ndjson',
+}
+
+
+def make_mileage_log(rows, seed=0):
+    """Build a synthetic daily mileage log with the given number of rows."""
+    rng = np.random.RandomState(seed)
+    return pd.DataFrame({
+        'Date': pd.date_range('2000-01-01', periods=rows, freq='D'),
+        'Miles': np.round(rng.gamma(2.0, 20.0, size=rows), 1),
+    }, columns=['Date', 'Miles'])
+
+
+def write_mileage_log(df, out_dir):
+    """Write the log in every supported format, returning a dict of {format: path}."""
+    paths = {fmt: os.path.join(out_dir, name) for fmt, name in BENCH_FILES.items()}
+    df.to_excel(paths['excel'], index=False)
+    df.to_csv(paths['csv'], index=False, date_format=load_data.DEFAULT_DATE_FORMAT)
+    df.to_csv(paths['tsv'], index=False, sep='\t', date_format=load_data.DEFAULT_DATE_FORMAT)
+    with open(paths['ndjson'], 'w') as out_file:
+        for date, miles in zip(df['Date'].dt.strftime(load_data.DEFAULT_DATE_FORMAT), df['Miles']):
+            out_file.write(json.dumps({'Date': date, 'Miles': miles}) + '\n')
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time each load_data input backend on the same mileage log.")
+    parser.add_argument("-n", "--rows", type=int, default=50000, help="Number of daily rows in the synthetic log.")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="Number of timed reads per backend (best is kept).")
+    args = parser.parse_args(argv)
+
+    out_dir = tempfile.mkdtemp()
+    try:
+        paths = write_mileage_log(make_mileage_log(args.rows), out_dir)
+
+        timings = {}
+        for fmt, path in paths.items():
+            timings[fmt] = min(timeit.repeat(lambda: load_data.import_data(path, fmt=fmt), number=1,
+                                             repeat=args.repeat))
+
+        print("{:<8s} {:>10s} {:>12s}".format("format", "seconds", "vs. excel"))
+        for fmt, seconds in timings.items():
+            print("{:<8s} {:>10.3f} {:>11.1f}x".format(fmt, seconds, timings['excel'] / seconds))
+    finally:
+        shutil.rmtree(out_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_pivot_kernels.py
+Compare the pivot_engine reports (built on the pivot_kernels NumPy kernels) against DataFrame.pivot_table.
+
+Times every Month x Year and DayOfWeek x Year table of the reports (mean, median, max and min), the way the reports
+were built with one pivot_table call per table.
+
+    usage: bench_pivot_kernels.py [-h] [-n ROWS [ROWS ...]] [-r REPEAT]
+"""
+import os
+import sys
+import argparse
+import timeit
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'pov_mileage_stats'))
+import load_data  # noqa: E402
+import pivot_engine  # noqa: E402
+
+# numpy reduction used with pivot_table for each report statistic
+AGGFUNCS = {'Mean': np.mean, 'Median': np.median, 'Max': np.max, 'Min': np.min}
+PVT_INDEXES = ('Month', 'DayOfWeek')
+
+
+def make_mileage_log(rows, seed=0):
+    """Build a synthetic, enriched mileage log with the given number of rows, a few per day, in date order."""
+    rng = np.random.RandomState(seed)
+    df = pd.DataFrame({
+        'Date': pd.Timestamp('1990-01-01') + pd.to_timedelta(np.sort(rng.randint(0, 365 * 30, size=rows)), unit='D'),
+        'Miles': np.round(rng.gamma(2.0, 20.0, size=rows), 1),
+    }, columns=['Date', 'Miles'])
+    return load_data.establish_relevant_columns(df)
+
+
+def pivot_table_reports(df):
+    """Every report table, one DataFrame.pivot_table call each."""
+    return [df.pivot_table(values='Miles', index=index, columns='Year', aggfunc=aggfunc)
+            for index in PVT_INDEXES for aggfunc in AGGFUNCS.values()]
+
+
+def kernel_reports(df):
+    """Every report table, from pivot_engine without memoization."""
+    pivots = pivot_engine.PivotResults(df)
+    return [pivots.pivot_table(index, aggname) for index in PVT_INDEXES for aggname in AGGFUNCS]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the pivot table reports at several input sizes.")
+    parser.add_argument("-n", "--rows", type=int, nargs='+', default=[100000, 1000000, 5000000],
+                        help="Input sizes (number of rows) to time.")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Number of timed runs per size (best is kept).")
+    args = parser.parse_args(argv)
+
+    print("{:>10s} {:>15s} {:>12s} {:>9s}".format("rows", "pivot_table s", "kernels s", "speedup"))
+    for rows in args.rows:
+        df = make_mileage_log(rows)
+
+        # Check that both versions produce the same tables before timing them.
+        for expected, actual in zip(pivot_table_reports(df), kernel_reports(df)):
+            pd.testing.assert_frame_equal(actual, expected)
+
+        baseline = min(timeit.repeat(lambda: pivot_table_reports(df), number=1, repeat=args.repeat))
+        kernels = min(timeit.repeat(lambda: kernel_reports(df), number=1, repeat=args.repeat))
+        print("{:>10d} {:>15.3f} {:>12.3f} {:>8.1f}x".format(rows, baseline, kernels, baseline / kernels))
+
+
+if __name__ == "__main__":
+    main()
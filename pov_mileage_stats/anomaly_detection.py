@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+anomalyDetection.py
+A small command-line tool to calculate mileage statistics for a personally-owned vehicle.
+
+Handles flagging of implausible mileage entries (eg., a mistyped odometer reading), which would otherwise show up as
+the record high or low.
+
+Each entry is compared with a robust baseline of the entries in the same month of the year and on the same day of the
+week: their median, and their median absolute deviation (MAD) from it. The modified z-score 0.6745 * (miles - median)
+/ MAD (Iglewicz & Hoaglin, 1993) is then large for entries far from what is usual for that kind of day, without the
+outliers themselves dragging the baseline along as a mean and standard deviation would. Both medians are taken over all
+(Month, DayOfWeek) cells at once with the pivot_kernels segment kernels, after a single sort of the entries by cell.
+"""
+
+import numpy as np
+import pandas as pd
+
+import pivot_kernels
+
+# Global Options
+# Modified z-score beyond which an entry is flagged, as recommended by Iglewicz & Hoaglin.
+DEFAULT_THRESHOLD = 3.5
+# Cells with fewer entries than this (or with no spread at all) are scored against the whole log instead.
+MIN_BASELINE_COUNT = 8
+
+# Ratio of the MAD to the standard deviation of normally distributed data
+MAD_SCALE = 0.6745
+# Ratio of the mean absolute deviation to the standard deviation of normally distributed data, used as the spread of
+# data whose MAD is zero (eg., mostly identical commutes).
+MEAN_AD_SCALE = 0.7979
+
+
+def robust_scores(df):
+    """
+    Score every entry of a mileage log against the baseline of its (Month, DayOfWeek) cell.
+    :type df: pd.DataFrame
+    :param df: the mileage data frame, as returned by load_data.establish_relevant_columns
+    :return: a tuple of (modified z-score of each row, baseline median of each row), both float arrays aligned with the
+        rows of df, NaN for rows without a date
+    """
+    miles = np.asarray(df['Miles'].values, dtype=float)
+    n_days = len(df['DayOfWeek'].cat.categories)
+    n_cells = len(df['Month'].cat.categories) * n_days
+    month_codes = df['Month'].cat.codes.values.astype(np.int64)
+    day_codes = df['DayOfWeek'].cat.codes.values.astype(np.int64)
+    # Rows without a date go into one extra cell at the end, which is never scored.
+    ids = np.where((month_codes >= 0) & (day_codes >= 0), month_codes * n_days + day_codes, n_cells)
+
+    # Sort once by cell, so that both passes of the kernels find each cell's values already contiguous. There are only
+    # 85 cells, so the ids are sorted as int16, which is several times faster than sorting int64.
+    order = np.argsort(ids.astype(np.int16))
+    sorted_ids, values = ids[order], miles[order]
+    cells = pivot_kernels.aggregate(sorted_ids, values, n_cells + 1)
+    deviations = pivot_kernels.aggregate(sorted_ids, np.abs(values - cells['median'][sorted_ids]), n_cells + 1)
+    spreads = _spread(deviations['median'], deviations['mean'])
+    spreads[cells['count'] < MIN_BASELINE_COUNT] = np.nan
+
+    # Fall back on the whole log's baseline where a cell is too small or too uniform to have its own.
+    dated = values[:len(values) - cells['count'][n_cells]]
+    if len(dated):
+        overall_median = np.median(dated)
+        overall_deviations = np.abs(dated - overall_median)
+        overall_spread = _spread(np.median(overall_deviations), overall_deviations.mean())
+    else:
+        overall_median, overall_spread = np.nan, np.nan
+    own = np.isfinite(spreads)
+    medians = np.where(own, cells['median'], overall_median)
+    spreads = np.where(own, spreads, overall_spread)
+    medians[n_cells], spreads[n_cells] = np.nan, np.nan
+
+    baselines = medians[ids]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scores = MAD_SCALE * (miles - baselines) / spreads[ids]
+    return scores, baselines
+
+
+def _spread(mad, mean_ad):
+    """
+    Pick the spread that scores are scaled by: the MAD, or the rescaled mean absolute deviation where the MAD is zero.
+    Returns NaN where both are zero (ie., all the values are equal).
+    """
+    with np.errstate(invalid='ignore'):  # Empty cells have NaN spreads.
+        spread = np.where(mad > 0, mad, MAD_SCALE / MEAN_AD_SCALE * mean_ad)
+        return np.where(spread > 0, spread, np.nan)
+
+
+def flag_anomalies(df, threshold=DEFAULT_THRESHOLD):
+    """
+    Flag the entries of a mileage log that are far from the baseline of their month and day of the week.
+    :type df: pd.DataFrame
+    :param df: the mileage data frame, as returned by load_data.establish_relevant_columns
+    :param threshold: the modified z-score beyond which an entry is flagged
+    :return: a pd.DataFrame of the flagged rows, with 'Date', 'Miles', 'Typical Miles' and 'Score' columns, and a
+        boolean array marking them in df
+    """
+    scores, baselines = robust_scores(df)
+    with np.errstate(invalid='ignore'):
+        flags = np.abs(scores) > threshold
+    flagged = pd.DataFrame({'Date': df['Date'].values[flags], 'Miles': df['Miles'].values[flags],
+                            'Typical Miles': baselines[flags], 'Score': scores[flags]},
+                           columns=['Date', 'Miles', 'Typical Miles', 'Score'], index=df.index[flags])
+    return flagged, flags
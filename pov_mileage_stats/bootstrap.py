@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+bootstrap.py
+A small command-line tool to calculate mileage statistics for a personally-owned vehicle.
+
+Handles bootstrap confidence intervals for the mean and median mileage.
+
+Each sample (the whole log, or the rows of one pivot cell) is resampled with replacement n_resamples times, and the
+interval is read off the percentiles of the resampled means and medians. Resamples are drawn as a matrix of row
+indexes, one row per resample, in batches small enough to bound memory. The resamples are split into jobs of a fixed
+size, each with its own seed drawn from the master seed, so the results depend only on the seed and not on how the jobs
+are spread over worker processes. Large runs are spread over a process pool.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Global Options
+DEFAULT_RESAMPLES = 10000
+DEFAULT_CONFIDENCE = 0.95
+# Most resampled values held in memory at once (8 bytes each), per process.
+MAX_BATCH_VALUES = 2 ** 22
+# Resamples per job. Fixed, so that each job (and hence each result) is the same whatever the number of workers.
+JOB_RESAMPLES = 1000
+# Below this many resampled values in total, starting worker processes costs more than it saves.
+MIN_PARALLEL_VALUES = 5 * 10 ** 7
+
+# The statistics that are bootstrapped, named as in calculate_statistics.PVT_TABLES
+STATISTICS = ('Mean', 'Median')
+
+
+def check_options(n_resamples, confidence):
+    """
+    Validate the bootstrap settings.
+    :param n_resamples: number of resamples per sample
+    :param confidence: confidence level of the intervals (eg., 0.95)
+    :return:
+
+    :raises
+    ValueError: if n_resamples is not positive or confidence is not between 0 and 1.
+    """
+    if n_resamples < 1:
+        raise ValueError("The number of bootstrap resamples must be at least 1, not {}.".format(n_resamples))
+    if not 0 < confidence < 1:
+        raise ValueError("The confidence level must be between 0 and 1, not {}.".format(confidence))
+
+
+def resample_statistics(values, n_resamples, seed=None):
+    """
+    Compute the mean and median of bootstrap resamples of one sample.
+    :param values: a 1-D float array with no NaNs
+    :param n_resamples: number of resamples to draw
+    :param seed: seed for the resampling
+    :return: a tuple of (array of resampled means, array of resampled medians), each of length n_resamples
+    """
+    values = np.asarray(values, dtype=float)
+    rng = np.random.RandomState(seed)
+    means, medians = np.empty(n_resamples), np.empty(n_resamples)
+    batch = max(1, MAX_BATCH_VALUES // max(len(values), 1))
+    for start in range(0, n_resamples, batch):
+        stop = min(start + batch, n_resamples)
+        samples = values[rng.randint(0, len(values), size=(stop - start, len(values)))]
+        means[start:stop] = samples.mean(axis=1)
+        medians[start:stop] = np.median(samples, axis=1)
+    return means, medians
+
+
+def _resample_job(job):
+    """Process-pool worker for resample_statistics. job is a tuple of (values, n_resamples, seed)."""
+    return resample_statistics(*job)
+
+
+def confidence_intervals(samples, n_resamples=DEFAULT_RESAMPLES, confidence=DEFAULT_CONFIDENCE, seed=None, jobs=None):
+    """
+    Compute percentile bootstrap confidence intervals for the mean and median of several samples.
+    :param samples: an OrderedDict of {key: 1-D float array of mileage}. Empty samples are skipped.
+    :param n_resamples: number of resamples per sample
+    :param confidence: confidence level of the intervals (eg., 0.95)
+    :param seed: seed for the resampling, or None for a different draw every run
+    :param jobs: number of worker processes for large runs, or None for the number of CPUs. 1 never starts any.
+    :return: an OrderedDict of {key: {'Mean': (low, high), 'Median': (low, high)}}
+    """
+    check_options(n_resamples, confidence)
+    samples = OrderedDict((key, np.asarray(values, dtype=float)) for key, values in samples.items() if len(values))
+
+    # Every sample gets the same split of its resamples into jobs.
+    splits = [JOB_RESAMPLES] * (n_resamples // JOB_RESAMPLES) + ([n_resamples % JOB_RESAMPLES]
+                                                                 if n_resamples % JOB_RESAMPLES else [])
+    seeds = iter(np.random.RandomState(seed).randint(0, 2 ** 31 - 1, size=len(samples) * len(splits)).tolist())
+    work = [(values, size, next(seeds)) for values in samples.values() for size in splits]
+
+    if jobs != 1 and n_resamples * sum(len(values) for values in samples.values()) >= MIN_PARALLEL_VALUES:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(_resample_job, work))
+    else:
+        results = [_resample_job(job) for job in work]
+
+    tails = 100 * (1 - confidence) / 2.0, 100 * (1 + confidence) / 2.0
+    intervals = OrderedDict()
+    for position, key in enumerate(samples):
+        parts = results[position * len(splits):(position + 1) * len(splits)]
+        intervals[key] = {name: tuple(np.percentile(np.concatenate([part[column] for part in parts]), tails))
+                          for column, name in enumerate(STATISTICS)}
+    return intervals
+
+
+def pivot_intervals(df, index, n_resamples=DEFAULT_RESAMPLES, confidence=DEFAULT_CONFIDENCE, seed=None, jobs=None):
+    """
+    Compute bootstrap confidence intervals for the mean and median of every cell of an index x Year pivot table.
+    :type df: pd.DataFrame
+    :param df: the mileage data frame, with 'Miles', 'Year' and categorical index columns
+    :param index: the pivot table's row labels, eg., 'Month'
+    :return: a pd.DataFrame indexed by (index label, year), with 'Mean Low', 'Mean High', 'Median Low' and
+        'Median High' columns
+    """
+    labels = df[index].cat.categories
+    # Group on the categorical codes, so that only the (label, year) pairs present in the log are visited.
+    groups = df['Miles'].dropna().groupby([df[index].cat.codes, df['Year']])
+    samples = OrderedDict(((labels[code], int(year)), values.values) for (code, year), values in groups if code >= 0)
+    intervals = confidence_intervals(samples, n_resamples=n_resamples, confidence=confidence, seed=seed, jobs=jobs)
+
+    columns = OrderedDict()
+    for name in STATISTICS:
+        columns['{} Low'.format(name)] = [interval[name][0] for interval in intervals.values()]
+        columns['{} High'.format(name)] = [interval[name][1] for interval in intervals.values()]
+    cells = pd.MultiIndex.from_tuples(list(intervals), names=[index, 'Year']) if intervals else None
+    return pd.DataFrame(columns, index=cells)
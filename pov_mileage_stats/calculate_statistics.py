@@ -5,13 +5,162 @@ A small command-line tool to calculate mileage statistics for a personally-owned
 
 Handles statistics calculation.
 """
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
 import numpy as np
+import pandas as pd
+
 import gen_mileage_stats
+import load_data
+import pivot_engine
+import rolling_stats
+
+
+# Names, units and formats of the basic statistics, in report order
+BASIC_STATS = OrderedDict([
+    ('mean_mileage', ('Mean Mileage', 'miles', "{:.1f}")),
+    ('med_mileage', ('Median Mileage', 'miles', "{:.1f}")),
+    ('first_day', ('First Day of Recorded Mileage', '', "{:%d %b %Y}")),
+    ('last_day', ('Last Day of Recorded Mileage', '', "{:%d %b %Y}")),
+    ('record_low', ('Record Low Miles Driven', 'miles', "{:.1f}")),
+    ('record_high', ('Record High Miles Driven', 'miles', "{:.1f}")),
+])
+
+
+class LazyStats(MutableMapping):
+    """
+    A dict of statistics, in the form returned by build_basic_stats, whose entries can be computed on demand.
+
+    Entries added with add_lazy are held as functions until they are first read (eg., by print_basic_stats or the HTML
+    template), and the result is then kept. Groups of entries whose IDs aren't known up front (eg., a projection per
+    vehicle) are added with add_lazy_group, and computed the first time any entry is looked up or the entries are
+    listed. Entries that are never read are never computed. Entries set or updated as usual are stored as they are, and
+    updating from another LazyStats keeps its pending entries pending.
+    """
+
+    def __init__(self, entries=None):
+        """
+        :param entries: a dict of already-formatted entries to start with, or None
+        """
+        self._entries = OrderedDict()
+        self._pending = {}
+        self.update(entries or {})
+
+    def add_lazy(self, key, compute):
+        """
+        Add an entry that is computed the first time it is read.
+        :param key: the statistic ID
+        :param compute: a function of no arguments returning the entry, ie., a dict of 'Name', 'units' and 'data'
+        """
+        self._entries[key] = None
+        self._pending[key] = compute
+
+    def add_lazy_group(self, compute):
+        """
+        Add a group of entries that are computed together, the first time any entry is looked up or listed.
+        :param compute: a function of no arguments returning a dict of entries keyed by statistic ID, as returned by
+            build_basic_stats
+        """
+        group = _LazyGroup()
+        self._entries[group] = None
+        self._pending[group] = compute
+
+    def pending(self):
+        """Return the number of entries (counting each group as one) that haven't been computed yet."""
+        return len(self._pending)
+
+    def update(self, other=(), **kwargs):
+        if isinstance(other, LazyStats):
+            for key, value in other._entries.items():
+                if key in other._pending:
+                    self._entries[key] = None
+                    self._pending[key] = other._pending[key]
+                else:
+                    self[key] = value
+            other = ()
+        super(LazyStats, self).update(other, **kwargs)
+
+    def _expand_groups(self):
+        """Compute every pending group, putting its entries where the group was added."""
+        if not any(isinstance(key, _LazyGroup) for key in self._pending):
+            return
+        entries = OrderedDict()
+        for key, value in self._entries.items():
+            if isinstance(key, _LazyGroup):
+                entries.update(self._pending.pop(key)())
+            else:
+                entries[key] = value
+        self._entries = entries
+
+    def __getitem__(self, key):
+        if key not in self._entries:
+            self._expand_groups()
+        if key in self._pending:
+            self._entries[key] = self._pending.pop(key)()
+        return self._entries[key]
+
+    def __setitem__(self, key, value):
+        self._pending.pop(key, None)
+        self._entries[key] = value
+
+    def __delitem__(self, key):
+        self._expand_groups()
+        self._pending.pop(key, None)
+        del self._entries[key]
+
+    def __contains__(self, key):
+        # Checking for an entry doesn't compute it.
+        if key not in self._entries:
+            self._expand_groups()
+        return key in self._entries
+
+    def __iter__(self):
+        self._expand_groups()
+        return iter(list(self._entries))
+
+    def __len__(self):
+        self._expand_groups()
+        return len(self._entries)
+
+    def __repr__(self):
+        return "{}({} entries, {} pending)".format(type(self).__name__, len(self._entries), len(self._pending))
+
+
+class _LazyGroup(object):
+    """Placeholder key of a LazyStats group whose entries haven't been computed yet."""
+
+
+def _once(compute):
+    """Wrap a function of no arguments so that it is only called once, however many entries share its result."""
+    results = []
+
+    def wrapper():
+        if not results:
+            results.append(compute())
+        return results[0]
+    return wrapper
+
+
+def _basic_stat(key, value):
+    """Format one of BASIC_STATS into a basic statistics entry."""
+    name, units, number_format = BASIC_STATS[key]
+    return {'Name': name, 'units': units, 'data': number_format.format(value)}
+
+
+def _window_stats(window, total, average):
+    """Format the total and average of a trailing window into basic statistics entries, keyed by statistic ID."""
+    return OrderedDict([
+        ('total_{}d'.format(window), {'Name': 'Miles Driven in the Last {} Days'.format(window), 'units': 'miles',
+                                      'data': "{:.1f}".format(total)}),
+        ('average_{}d'.format(window), {'Name': 'Average Daily Miles over the Last {} Days'.format(window),
+                                        'units': 'miles/day', 'data': "{:.1f}".format(average)}),
+    ])
 
 
 def calculate_basic_stats(df):
     """
-    Performs basic statistics calculations for car data.
+    Performs basic statistics calculations for car data, on demand.
 
     Arguments:
     ----------
@@ -19,73 +168,329 @@ def calculate_basic_stats(df):
 
     Returns:
     -------=
-    results: a dict containing some basic statistics:
+    results: a LazyStats of some basic statistics, each computed only when it is first read:
                 mean miles driven
                 median miles driven
+                total and average miles driven in each trailing window (see rolling_stats.WINDOWS), if any
+                entry has a date
 
     """
-    # First, drop records with mileage = NA.
-    df.dropna(axis=0, how='any', subset=['Miles'])  # Look only in the Miles column for NA values.
-
-    # Now, we can calculate basic statistics
-    basic_stats = {
-        'mean_mileage': {'Name': 'Mean Mileage', 'units': 'miles', 'data': "{:.1f}".format(df['Miles'].mean(axis=0))},
-        'med_mileage': {'Name': 'Median Mileage', 'units': 'miles',
-                        'data': "{:.1f}".format(df['Miles'].median(axis=0))},
-        'first_day': {'Name': 'First Day of Recorded Mileage', 'units': '',
-                      'data': df['Date'].min().strftime("%d %b %Y")},
-        'last_day': {'Name': 'Last Day of Recorded Mileage', 'units': '',
-                     'data': df['Date'].max().strftime("%d %b %Y")},
-        'record_low': {'Name': 'Record Low Miles Driven', 'units': 'miles',
-                       'data': "{:.1f}".format(df['Miles'].min(axis=0))},
-        'record_high': {'Name': 'Record High Miles Driven', 'units': 'miles',
-                        'data': "{:.1f}".format(df['Miles'].max(axis=0))},
-    }
+    # Records with mileage = NA are skipped by each statistic, so the frame is used as it is rather than copied.
+    miles, dates = df['Miles'], df['Date']
+    computations = {'mean_mileage': miles.mean, 'med_mileage': miles.median, 'first_day': dates.min,
+                    'last_day': dates.max, 'record_low': miles.min, 'record_high': miles.max}
+    basic_stats = LazyStats()
+    for key, (name, units, number_format) in BASIC_STATS.items():
+        basic_stats.add_lazy(key, _lazy_entry(name, units, number_format, computations[key]))
+
+    # Every trailing window comes from the same daily calendar, made the first time any of them is read. Windows only
+    # make sense with dated entries to end on.
+    if dates.notnull().any():
+        rolling = _once(lambda: rolling_stats.latest_windows(rolling_stats.daily_totals(dates, miles)[1]))
+        for window in rolling_stats.WINDOWS:
+            for key in ('total_{}d'.format(window), 'average_{}d'.format(window)):
+                basic_stats.add_lazy(
+                    key, lambda window=window, key=key: _window_stats(window, *rolling()[window])[key])
+
+    return basic_stats
+
+
+def build_basic_stats(mean_mileage, med_mileage, first_day, last_day, record_low, record_high, rolling=None):
+    """
+    Format already-computed basic statistics into the dict used for printing and HTML rendering.
+
+    Arguments:
+    ----------
+    mean_mileage, med_mileage, record_low, record_high: floats, in miles
+    first_day, last_day: pd.Timestamp (or datetime) objects
+    rolling: optional dict of {window length in days: (total miles, average miles per day)}, as returned by
+             rolling_stats.latest_windows
 
+    Returns:
+    -------
+    basic_stats: a dict keyed by statistic ID, each entry holding the statistic's name, units and formatted value.
+    """
+    values = {'mean_mileage': mean_mileage, 'med_mileage': med_mileage, 'first_day': first_day,
+              'last_day': last_day, 'record_low': record_low, 'record_high': record_high}
+    basic_stats = {key: _basic_stat(key, values[key]) for key in BASIC_STATS}
+    for window, (total, average) in (rolling or {}).items():
+        basic_stats.update(_window_stats(window, total, average))
     return basic_stats
 
 
-def print_basic_stats(basic_stats):
+def build_period_stats(stats):
+    """
+    Format statistics of a date range into the same form as build_basic_stats.
+
+    Arguments:
+    ----------
+    stats: a dict of 'count', 'total', 'mean', 'median', 'min' and 'max', as returned by range_query.RangeQuery.stats
+
+    Returns:
+    -------
+    period_stats: a dict keyed by statistic ID, each entry holding the statistic's name, units and formatted value.
+    """
+    return {
+        'count': {'Name': 'Mileage Entries', 'units': '', 'data': "{:d}".format(stats['count'])},
+        'total': {'Name': 'Total Miles Driven', 'units': 'miles', 'data': "{:.1f}".format(stats['total'])},
+        'mean_mileage': {'Name': 'Mean Mileage', 'units': 'miles', 'data': "{:.1f}".format(stats['mean'])},
+        'med_mileage': {'Name': 'Median Mileage', 'units': 'miles', 'data': "{:.1f}".format(stats['median'])},
+        'record_low': {'Name': 'Record Low Miles Driven', 'units': 'miles', 'data': "{:.1f}".format(stats['min'])},
+        'record_high': {'Name': 'Record High Miles Driven', 'units': 'miles', 'data': "{:.1f}".format(stats['max'])},
+    }
+
+
+def build_interval_stats(intervals, confidence):
+    """
+    Format bootstrap confidence intervals of the mean and median mileage into the same form as build_basic_stats.
+
+    Arguments:
+    ----------
+    intervals: a dict of {'Mean': (low, high), 'Median': (low, high)}, as returned for one sample by
+               bootstrap.confidence_intervals
+    confidence: the confidence level of the intervals (eg., 0.95)
+
+    Returns:
+    -------
+    interval_stats: a dict keyed by statistic ID, each entry holding the statistic's name, units and formatted value.
+    """
+    return {
+        '{}_ci'.format(key): {'Name': '{} Mileage {:g}% Confidence Interval'.format(name, 100 * confidence),
+                              'units': 'miles', 'data': "{:.1f} to {:.1f}".format(*intervals[name])}
+        for key, name in (('mean_mileage', 'Mean'), ('med_mileage', 'Median'))
+    }
+
+
+def build_coverage_stats(recorded_days, calendar_days):
+    """
+    Format the coverage of a log's daily calendar into the same form as build_basic_stats.
+
+    Arguments:
+    ----------
+    recorded_days, calendar_days: the number of days with entries, and of days in the log's span, as returned by
+                                  daily_calendar.coverage
+
+    Returns:
+    -------
+    coverage_stats: a dict keyed by statistic ID, each entry holding the statistic's name, units and formatted value.
+    """
+    share = 100.0 * recorded_days / calendar_days if calendar_days else 0.0
+    return {'coverage': {'Name': 'Days with Recorded Mileage', 'units': '',
+                         'data': "{:d} of {:d} ({:.1f}%)".format(recorded_days, calendar_days, share)}}
+
+
+def calculate_fuel_stats(df, pivots):
+    """
+    Calculate the overall fuel economy and costs of a log with fuel columns (see load_data.FUEL_COLUMNS), on demand.
+
+    Arguments:
+    ----------
+    df: the mileage data frame
+    pivots: the pivot_engine.PivotResults for df, whose Month x Year 'Spend' table gives the monthly spend
+
+    Returns:
+    -------
+    fuel_stats: a LazyStats keyed by statistic ID, each entry holding the statistic's name, units and formatted value,
+                for each of pivots.fuel_metrics() that df has the columns for. Ratios are NaN where the total they are
+                divided by is zero.
+    """
+    metrics = pivots.fuel_metrics()
+    totals = _once(lambda: {column: df[column].sum() for column in ['Miles'] + pivots.fuel_columns})
+    fuel_stats = LazyStats()
+    if 'Gallons' in pivots.fuel_columns:
+        fuel_stats.add_lazy('total_gallons', _lazy_entry('Total Fuel Bought', 'gallons', "{:.1f}",
+                                                         lambda: totals()['Gallons']))
+    if 'MPG' in metrics:
+        fuel_stats.add_lazy('mpg', _lazy_entry('Fuel Economy', 'miles/gallon', "{:.1f}",
+                                               lambda: _ratio(totals()['Miles'], totals()['Gallons'])))
+    if 'Cost' in pivots.fuel_columns:
+        fuel_stats.add_lazy('total_cost', _lazy_entry('Total Spend', '', "{:.2f}", lambda: totals()['Cost']))
+    if 'Cost per Mile' in metrics:
+        fuel_stats.add_lazy('cost_per_mile', _lazy_entry('Cost per Mile', 'per mile', "{:.3f}",
+                                                         lambda: _ratio(totals()['Cost'], totals()['Miles'])))
+    if 'Spend' in metrics:
+        fuel_stats.add_lazy('monthly_spend', _lazy_entry('Average Monthly Spend', '', "{:.2f}",
+                                                         lambda: pivots.aggregate(PVT_INDEX)['Spend'].mean()))
+    return fuel_stats
+
+
+def calculate_trip_stats(df):
+    """
+    Calculate the number of trips taken per day, in a log collapsed from one row per trip (see trips.trips_to_daily),
+    on demand.
+
+    Arguments:
+    ----------
+    df: the mileage data frame, with a 'Trips' column
+
+    Returns:
+    -------
+    trip_stats: a LazyStats keyed by statistic ID, each entry holding the statistic's name, units and formatted value.
+    """
+    trips = df[load_data.TRIPS_COLUMN]
+    total = _once(trips.sum)
+    trip_stats = LazyStats()
+    trip_stats.add_lazy('trips_total', _lazy_entry('Trips Recorded', 'trips', "{:d}", lambda: int(total())))
+    trip_stats.add_lazy('trips_mean', _lazy_entry('Mean Trips per Day', 'trips', "{:.1f}", trips.mean))
+    trip_stats.add_lazy('trips_median', _lazy_entry('Median Trips per Day', 'trips', "{:.1f}", trips.median))
+    trip_stats.add_lazy('trips_max', _lazy_entry('Record High Trips in a Day', 'trips', "{:d}",
+                                                 lambda: int(trips.max())))
+    trip_stats.add_lazy('trip_miles', _lazy_entry('Mean Miles per Trip', 'miles', "{:.1f}",
+                                                  lambda: _ratio(df['Miles'].sum(), total())))
+    return trip_stats
+
+
+def _lazy_entry(name, units, number_format, compute):
+    """Return a function that computes a value and formats it into a statistics entry, for LazyStats.add_lazy."""
+    return lambda: {'Name': name, 'units': units, 'data': number_format.format(compute())}
+
+
+def _ratio(numerator, denominator):
+    """numerator / denominator, or NaN if the denominator is zero."""
+    return numerator / denominator if denominator else np.nan
+
+
+def build_forecast_stats(forecast, cap=None, vehicle=None):
+    """
+    Format a mileage projection into the same form as build_basic_stats.
+
+    Arguments:
+    ----------
+    forecast: a dict as returned by forecasting.forecast
+    cap: the annual mileage cap the projection was made for, or None
+    vehicle: name of the vehicle the projection is for, in a fleet report, or None
+
+    Returns:
+    -------
+    forecast_stats: a dict keyed by statistic ID, each entry holding the statistic's name, units and formatted value.
+    """
+    suffix, label = ('_{}'.format(vehicle), ' ({})'.format(vehicle)) if vehicle is not None else ('', '')
+    year_end = forecast['year_end'].strftime("%d %b %Y")
+    forecast_stats = {
+        'projected_total' + suffix: {'Name': 'Projected Miles Driven from {} to {}{}'.format(
+            forecast['year_start'].strftime("%d %b %Y"), year_end, label),
+            'units': 'miles', 'data': "{:.1f}".format(forecast['projected'])},
+        'projected_interval' + suffix: {'Name': 'Projected Miles Driven 95% Interval{}'.format(label),
+                                        'units': 'miles',
+                                        'data': "{:.1f} to {:.1f}".format(forecast['low'], forecast['high'])},
+    }
+    if cap is not None:
+        cap_day = forecast['cap_day']
+        forecast_stats['cap_day' + suffix] = {
+            'Name': 'Projected Date of Reaching the {:g}-Mile Cap{}'.format(cap, label), 'units': '',
+            'data': cap_day.strftime("%d %b %Y") if cap_day is not None else "Not by {}".format(year_end)}
+    return forecast_stats
+
+
+def print_basic_stats(basic_stats, title="Basic Statistics"):
     """
     Print basic stats to stdout
     :param basic_stats: a dict containing mean mileage, median mileage,
         the first day, the last day, the record low mileage, and the record high mileage.
+    :param title: heading printed above the statistics
     :return:
     """
     print("""
     
-Basic Statistics
-================
-    """)
+{}
+{}
+    """.format(title, "=" * len(title)))
     for _, data in basic_stats.items():
         print("{0:s}: {1:s} {2:s}".format(data['Name'], str(data['data']), data['units']))
 
 
-# The pivot tables we will retrieve:
-PVT_TABLES = {'Mean': np.mean, 'Median': np.median, 'Max': np.max, 'Min': np.min}
+# The pivot tables we will retrieve (report name -> pandas reduction), and the rows they are broken down by.
+PVT_TABLES = pivot_engine.AGGREGATIONS
+PVT_INDEX = 'Month'
+
+
+# Titles and number formats of the fuel economy and cost tables, keyed by pivot_engine.FUEL_METRICS name.
+FUEL_TABLES = {
+    'MPG': ("Fuel Economy (MPG)", "{:.1f}"),
+    'Cost per Mile': ("Cost per Mile", "{:.3f}"),
+    'Spend': ("Monthly Spend", "{:.2f}"),
+}
+
+
+# Print the mean number of trips per day in each Month x Year cell. `trip_pivots` is the pivot_engine.PivotResults of
+# the 'Trips' column.
+def print_trips_table(trip_pivots):
+    print("==============\nMean Trips per Day\n==============\n")
+    print_pvt_table(trip_pivots.pivot_table(PVT_INDEX, 'Mean', fill_value=0).round(1))
+    print("\n")
+
+
+# Print the share of days with entries in each Month x Year cell, as returned by daily_calendar.coverage.
+def print_coverage(coverage):
+    print("==============\nDays with Recorded Mileage (%)\n==============\n")
+    print_pvt_table((100 * coverage).round(1))
+    print("\n")
+
+
+# Print the peak memory of each stage of the run, as returned by memory_budget.StageTracker.finish.
+def print_memory_report(stages):
+    print("==============\nPeak Memory by Stage\n==============\n")
+    for stage, peak in stages.items():
+        print("{}: {:.1f} MB".format(stage, peak / (1024.0 * 1024.0)))
+    print("\n")
+
+
+# Print the entries flagged by anomaly_detection.flag_anomalies.
+def print_anomalies(flagged):
+    print("==============\nAnomalous Entries\n==============\n")
+    print(flagged.round(1).to_string() if len(flagged) else "No anomalous entries found.")
+    print("\n")
+
+
+# Produce HTML representation of the entries flagged by anomaly_detection.flag_anomalies.
+def anomalies_to_html(flagged):
+    return flagged.style.format({'Date': "{:%d %b %Y}", 'Miles': "{:.1f}", 'Typical Miles': "{:.1f}",
+                                 'Score': "{:.1f}"}).hide_index().render()
+
+
+# Print the bootstrap confidence intervals of each pivot table cell, as returned by bootstrap.pivot_intervals.
+def print_pvt_intervals(intervals, confidence):
+    print("==============\n{:g}% Confidence Intervals\n==============\n".format(100 * confidence))
+    print(intervals)
+    print("\n")
 
 
 # Print string representation of pivot table.
-def print_pvt_table(df, aggfunc):
-    return print(
-        df.pivot_table(values='Miles', index='Month', columns='Year', aggfunc=aggfunc, fill_value=0)
-    )
+def print_pvt_table(table):
+    return print(table)
 
 
 # Produce HTML representation of styled pivot table
-def pvt_table_to_html(df, aggfunc):
-    return df.pivot_table(values='Miles', index='Month', columns='Year', aggfunc=aggfunc, fill_value=0).style.format(
-        "{:.1f}").background_gradient(cmap='RdBu_r', low=1, high=1).render()
+def pvt_table_to_html(table, number_format="{:.1f}"):
+    with np.errstate(invalid='ignore'):  # Blank (NaN) cells are left uncoloured.
+        return table.style.format(lambda value: "" if pd.isnull(value) else number_format.format(value)) \
+            .background_gradient(cmap='RdBu_r', low=1, high=1).render()
 
 
-# Produce dictionary of pivot table HTML code for template rendering:
-def gen_pvt_table_html_reports(df, aggfuncdict):
-    return {key: pvt_table_to_html(df, val) for key, val in aggfuncdict.items()}
+# Produce dictionary of pivot table HTML code for template rendering.
+# `pivots` is anything with a pivot_table(index, aggname, fill_value) method, eg., a pivot_engine.PivotResults.
+def gen_pvt_table_html_reports(pivots, aggnames=PVT_TABLES):
+    return {key: pvt_table_to_html(pivots.pivot_table(PVT_INDEX, key, fill_value=0)) for key in aggnames}
 
 
 # Produce stdout representation of pivot tables
-def gen_pvt_table_stdout_reports(df, aggfuncdict):
-    for key, val in aggfuncdict.items():
+def gen_pvt_table_stdout_reports(pivots, aggnames=PVT_TABLES):
+    for key in aggnames:
         print("==============\n{} Mileage\n==============\n".format(key))
-        print(print_pvt_table(df, val))
+        print_pvt_table(pivots.pivot_table(PVT_INDEX, key, fill_value=0))
+        print("\n")
+
+
+# Produce dictionary of fuel economy and cost table HTML code for template rendering, keyed by table title. Months
+# without fuel entries are left blank rather than filled with 0.
+def gen_fuel_table_html_reports(pivots):
+    return {FUEL_TABLES[key][0]: pvt_table_to_html(pivots.pivot_table(PVT_INDEX, key), FUEL_TABLES[key][1])
+            for key in pivots.fuel_metrics()}
+
+
+# Produce stdout representation of fuel economy and cost tables
+def gen_fuel_table_stdout_reports(pivots):
+    for key in pivots.fuel_metrics():
+        print("==============\n{}\n==============\n".format(FUEL_TABLES[key][0]))
+        print_pvt_table(pivots.pivot_table(PVT_INDEX, key).round(3))
         print("\n")
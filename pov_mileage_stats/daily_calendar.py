@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+dailyCalendar.py
+A small command-line tool to calculate mileage statistics for a personally-owned vehicle.
+
+Handles resampling of a mileage log onto a dense daily calendar, so that days the car sat parked (or that were never
+written down) count in the statistics instead of silently vanishing.
+
+Entries are summed into one total per day with np.bincount over their day numbers, which takes linear time and doesn't
+need the log to be sorted. Days without an entry are then filled according to a policy: zero miles, NaN (ie., left out
+of the statistics but counted as gaps), or interpolated from the neighbouring recorded days. A boolean 'Recorded'
+column marks the days that had entries, from which the coverage of each Month x Year cell is computed.
+"""
+
+import numpy as np
+import pandas as pd
+
+import load_data
+
+# Global Options
+POLICIES = ('zero', 'nan', 'interpolate')
+
+# Column marking the days that had entries in the original log
+RECORDED_COLUMN = 'Recorded'
+
+
+def is_dense(df):
+    """
+    Check whether a log already has exactly one entry for every day from its first day to its last, with no gaps.
+    :type df: pd.DataFrame
+    :param df: a DataFrame with 'Date' and 'Miles' columns
+    """
+    if not df['Date'].is_monotonic_increasing or df['Miles'].isnull().any() or df['Date'].isnull().any():
+        return False
+    days = df['Date'].values.astype('datetime64[D]').astype(np.int64)
+    return len(days) < 2 or bool((np.diff(days) == 1).all())
+
+
+def resample_daily(df, policy='zero'):
+    """
+    Resample a mileage log onto a dense daily calendar.
+    :type df: pd.DataFrame
+    :param df: a DataFrame with 'Date' and 'Miles' columns, and optionally fuel and trip columns (see
+        load_data.summed_columns)
+    :param policy: how to fill days without entries; one of POLICIES
+    :return: a pd.DataFrame with one row per day from the first to the last recorded day, and 'Date', 'Miles' and
+        'Recorded' columns, plus the fuel and trip columns of df. Several entries on one day are summed. Fuel and trip
+        columns are zero on the days without entries, whatever the policy. A log that is already dense is returned as
+        it is, without copying.
+
+    :raises
+    ValueError: if policy is not one of POLICIES.
+    """
+    if policy not in POLICIES:
+        raise ValueError("The missing-day policy must be one of {}, not {}.".format(', '.join(POLICIES), policy))
+    if is_dense(df):
+        return df
+
+    summed_columns = load_data.summed_columns(df)
+    columns = ['Date', 'Miles', RECORDED_COLUMN] + summed_columns
+    dates = df['Date'].values
+    miles = np.asarray(df['Miles'].values, dtype=float)
+    usable = ~np.isnat(dates) & ~np.isnan(miles)
+    days = dates[usable].astype('datetime64[D]').astype(np.int64)
+    if not len(days):
+        return pd.DataFrame(dict({'Date': pd.to_datetime([]), RECORDED_COLUMN: np.zeros(0, bool)},
+                                 **{column: np.zeros(0) for column in ['Miles'] + summed_columns}), columns=columns)
+
+    first = days.min()
+    offsets = days - first
+    n_days = offsets.max() + 1
+    totals = np.bincount(offsets, weights=miles[usable], minlength=n_days)
+    recorded = np.bincount(offsets, minlength=n_days) > 0
+
+    missing = ~recorded
+    if policy == 'nan':
+        totals[missing] = np.nan
+    elif policy == 'interpolate' and missing.any():
+        totals[missing] = np.interp(np.flatnonzero(missing), np.flatnonzero(recorded), totals[recorded])
+
+    resampled = {'Date': (first + np.arange(n_days)).astype('datetime64[D]').astype('datetime64[ns]'),
+                 'Miles': totals, RECORDED_COLUMN: recorded}
+    for column in summed_columns:
+        values = np.nan_to_num(np.asarray(df[column].values, dtype=float)[usable])
+        resampled[column] = np.bincount(offsets, weights=values, minlength=n_days).astype(df[column].dtype)
+    return pd.DataFrame(resampled, columns=columns)
+
+
+def _recorded_days(df):
+    """
+    Find the recorded days and the calendar span of a log.
+    :return: a tuple of (int64 day numbers of every day from the first to the last day of the log, and a boolean array
+        marking the ones with entries)
+    """
+    dated = df['Date'].notnull().values
+    if RECORDED_COLUMN in df.columns:
+        recorded_rows = dated & df[RECORDED_COLUMN].values.astype(bool)
+    else:
+        recorded_rows = dated
+    all_days = df['Date'].values[dated].astype('datetime64[D]').astype(np.int64)
+    if not len(all_days):
+        return np.zeros(0, np.int64), np.zeros(0, bool)
+    first = all_days.min()
+    calendar = first + np.arange(all_days.max() - first + 1)
+    days = df['Date'].values[recorded_rows].astype('datetime64[D]').astype(np.int64)
+    return calendar, np.bincount(days - first, minlength=len(calendar)) > 0
+
+
+def coverage(df):
+    """
+    Measure how many days of a log's span have entries. In a fleet log, each vehicle's span is counted separately.
+    :type df: pd.DataFrame
+    :param df: the mileage data frame, optionally with 'Recorded' and 'Vehicle' columns
+    :return: a tuple of (pd.DataFrame of the fraction of days with entries in each Month x Year cell, laid out like the
+        pivot tables, number of days with entries, and number of days in the span)
+    """
+    groups = [group for _, group in df.groupby('Vehicle')] if 'Vehicle' in df.columns else [df]
+    months, recorded = [], []
+    for group in groups:
+        calendar, group_recorded = _recorded_days(group)
+        months.append(calendar.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64))
+        recorded.append(group_recorded)
+    months, recorded = np.concatenate(months), np.concatenate(recorded)
+    if not len(months):
+        return pd.DataFrame(), 0, 0
+
+    first = months.min()
+    calendar_days = np.bincount(months - first)
+    recorded_days = np.bincount(months - first, weights=recorded)
+    spanned = calendar_days.nonzero()[0]
+    cells = first + spanned
+    table = pd.Series(recorded_days[spanned] / calendar_days[spanned], index=pd.MultiIndex.from_arrays(
+        [pd.Categorical.from_codes(cells % 12, load_data.MONTH_LABELS, ordered=True), cells // 12 + 1970],
+        names=['Month', 'Year'])).unstack('Year')
+    return table, int(recorded.sum()), len(recorded)
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+dataCache.py
+A small command-line tool to calculate mileage statistics for a personally-owned vehicle.
+
+Handles a persistent on-disk cache of parsed mileage data, so that repeat runs on an unchanged workbook can skip
+Excel parsing entirely.
+
+Each cache entry is a NumPy .npz archive holding one array per column of the enriched DataFrame, along with any extra
+arrays derived from it (eg., the aggregates of rollup_cube). Entries are keyed by the content hash and modification
+time of the input file, along with the options used to read it. The cache directory is kept below a size limit by
+evicting the least-recently-used entries.
+"""
+
+import os
+import hashlib
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+# Global Options
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.pov_mileage_stats', 'cache')
+CACHE_EXT = '.npz'
+DEFAULT_MAX_CACHE_MB = 256
+HASH_BLOCK_SIZE = 1 << 20
+
+# Bump this whenever the layout of the cached DataFrame changes, so that stale entries are never read back.
+CACHE_VERSION = 3
+
+# Reserved array names inside a cache entry
+_COLUMNS_KEY = '__columns__'
+_INDEX_KEY = '__index__'
+_CODES_SUFFIX = '::codes'
+_CATEGORIES_SUFFIX = '::categories'
+_ORDERED_SUFFIX = '::ordered'
+
+
+def hash_file(path):
+    """
+    Compute the SHA-256 digest of a file's contents, reading it in blocks.
+    :param path: path to the file to hash
+    :return: the hexadecimal digest string
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as in_file:
+        for block in iter(lambda: in_file.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_key(path, **options):
+    """
+    Build the cache key for an input file and the options used to read it.
+    :param path: path to the input file
+    :param options: any reader options (eg., skiprows, usecols) that change the resulting DataFrame
+    :return: a hexadecimal string that uniquely identifies this (file, options) combination
+    """
+    key = hashlib.sha256()
+    key.update(str(CACHE_VERSION).encode('utf-8'))
+    key.update(hash_file(path).encode('utf-8'))
+    key.update(repr(os.path.getmtime(path)).encode('utf-8'))
+    for name, value in sorted(options.items()):
+        key.update("{}={!r};".format(name, value).encode('utf-8'))
+    return key.hexdigest()
+
+
+def entry_path(key, cache_dir=CACHE_DIR):
+    """Return the path of the cache entry for the given key."""
+    return os.path.join(cache_dir, key + CACHE_EXT)
+
+
+def frame_to_arrays(df):
+    """
+    Break a DataFrame down into a dict of plain NumPy arrays that np.savez can store without pickling.
+    Categorical columns are stored as their integer codes plus their categories.
+    :type df: pd.DataFrame
+    :param df: the DataFrame to convert
+    :return: a dict mapping array names to np.ndarray objects
+    """
+    arrays = {
+        _COLUMNS_KEY: np.array([str(col) for col in df.columns]),
+        _INDEX_KEY: df.index.values,
+    }
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_categorical_dtype(series):
+            arrays[col + _CODES_SUFFIX] = series.cat.codes.values
+            categories = np.asarray(series.cat.categories.values)
+            arrays[col + _CATEGORIES_SUFFIX] = categories.astype(str) if categories.dtype == object else categories
+            arrays[col + _ORDERED_SUFFIX] = np.array(series.cat.ordered)
+        elif series.dtype == object:
+            arrays[col] = series.values.astype(str)
+        else:
+            arrays[col] = series.values
+    return arrays
+
+
+def arrays_to_frame(arrays):
+    """
+    Rebuild a DataFrame from the arrays produced by frame_to_arrays.
+    :param arrays: a mapping of array names to np.ndarray objects (eg., an open np.load archive)
+    :return: the reconstructed pd.DataFrame
+    """
+    columns = [str(col) for col in arrays[_COLUMNS_KEY]]
+    data = {}
+    for col in columns:
+        if col + _CODES_SUFFIX in arrays:
+            data[col] = pd.Categorical.from_codes(arrays[col + _CODES_SUFFIX], arrays[col + _CATEGORIES_SUFFIX],
+                                                  ordered=bool(arrays[col + _ORDERED_SUFFIX]))
+        else:
+            data[col] = arrays[col]
+    return pd.DataFrame(data, index=arrays[_INDEX_KEY], columns=columns)
+
+
+def load(key, cache_dir=CACHE_DIR, with_arrays=False):
+    """
+    Look up a cached DataFrame.
+    :param key: a key produced by cache_key
+    :param cache_dir: directory holding the cache entries
+    :param with_arrays: also return every array stored in the entry, including the extras passed to store
+    :return: the cached pd.DataFrame, or None on a cache miss. With with_arrays, a (DataFrame, dict of arrays) pair, or
+        (None, None) on a cache miss.
+    """
+    miss = (None, None) if with_arrays else None
+    path = entry_path(key, cache_dir)
+    if not os.path.isfile(path):
+        return miss
+
+    try:
+        with np.load(path, allow_pickle=False) as archive:
+            df = arrays_to_frame(archive)
+            arrays = {name: archive[name] for name in archive.files} if with_arrays else None
+    except (IOError, OSError, ValueError, KeyError):
+        # Unreadable entry (eg., a partial write from a killed run). Treat it as a miss and let it be rewritten.
+        return miss
+
+    # Mark the entry as recently used so that eviction keeps it. Another process (eg., a fleet worker) may have evicted
+    # it since it was read, which is no loss.
+    try:
+        os.utime(path, None)
+    except FileNotFoundError:
+        pass
+    return (df, arrays) if with_arrays else df
+
+
+def store(key, df, cache_dir=CACHE_DIR, max_bytes=DEFAULT_MAX_CACHE_MB * 1024 * 1024, extras=None):
+    """
+    Write a DataFrame to the cache, then evict old entries until the cache fits within max_bytes.
+    :param key: a key produced by cache_key
+    :type df: pd.DataFrame
+    :param df: the DataFrame to store
+    :param cache_dir: directory holding the cache entries
+    :param max_bytes: size limit for the whole cache directory
+    :param extras: optional dict of further np.ndarray objects to store in the same entry. Their names must not
+        clash with the DataFrame's columns.
+    :return: the path of the new cache entry
+    """
+    arrays = frame_to_arrays(df)
+    arrays.update(extras or {})
+
+    # Fleet workers may all create the directory at once.
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # Write to a temporary file first so that readers never see a partially-written entry.
+    path = entry_path(key, cache_dir)
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+    try:
+        with os.fdopen(fd, 'wb') as out_file:
+            np.savez(out_file, **arrays)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    evict(cache_dir, max_bytes, keep=path)
+    return path
+
+
+def evict(cache_dir=CACHE_DIR, max_bytes=DEFAULT_MAX_CACHE_MB * 1024 * 1024, keep=None):
+    """
+    Remove least-recently-used cache entries until the cache directory fits within max_bytes.
+    :param cache_dir: directory holding the cache entries
+    :param max_bytes: size limit for the whole cache directory
+    :param keep: optional path of an entry that must not be evicted (eg., the one just written)
+    :return: a list of the paths that were removed
+    """
+    if not os.path.isdir(cache_dir):
+        return []
+
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if not name.endswith(CACHE_EXT) or not os.path.isfile(path):
+            continue
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            # Evicted or replaced by another process (eg., a fleet worker) since the directory was listed.
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    removed = []
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Another process got there first; the space is freed either way.
+            pass
+        else:
+            removed.append(path)
+        total -= size
+
+    return removed
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+forecasting.py
+A small command-line tool to calculate mileage statistics for a personally-owned vehicle.
+
+Handles projections of the miles driven by the end of the year, and of the day an annual mileage cap (eg., a lease
+limit) will be reached.
+
+The log is summed into a dense daily calendar (see rolling_stats.daily_totals), and the total of each day is fitted by
+ordinary least squares to a seasonal model: a mean, a linear trend (once there is a year of history to tell it apart
+from the seasons), a day-of-week effect and a month-of-year effect. The effects are coded as deviations from the
+average, so months that the log has never seen are projected at the average. Future days are predicted from the same
+model, and the interval of their total accounts for both the day-to-day scatter and the uncertainty of the fitted
+coefficients.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import rolling_stats
+
+# Global Options
+# Days of history needed before a trend is fitted; with less, a trend can't be told apart from the seasons.
+MIN_TREND_DAYS = 365
+# Two-sided 95% quantile of the normal distribution, for the projection intervals
+Z_95 = 1.959964
+
+
+def _day_codes(days):
+    """Day of the week (0 = Sunday, as in load_data.DAY_OF_WEEK_LABELS) of each day number, counted from 1970-01-01."""
+    # 1970-01-01 was a Thursday.
+    return (days + 4) % 7
+
+
+def _month_codes(days):
+    """Month of the year (0 = January) of each day number."""
+    return days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64) % 12
+
+
+class SeasonalModel(object):
+    """
+    Least-squares fit of daily miles to a mean, a trend, and day-of-week and month-of-year effects.
+    """
+
+    def __init__(self, first_day, daily):
+        """
+        Fit the model to a dense daily calendar.
+        :param first_day: the first day of the calendar, as a np.datetime64 day
+        :param daily: total miles of each day from first_day on, as returned by rolling_stats.daily_totals
+        """
+        days = np.datetime64(first_day, 'D').astype(np.int64) + np.arange(len(daily))
+        self.origin = days[0]
+        self.trend = len(daily) >= MIN_TREND_DAYS
+        # Effect coding needs at least two levels; the first one seen is the reference.
+        self.weekdays = np.unique(_day_codes(days))
+        self.months = np.unique(_month_codes(days))
+
+        design = self.design(days)
+        self.coefficients = np.linalg.lstsq(design, daily, rcond=None)[0]
+        residuals = daily - design.dot(self.coefficients)
+        dof = len(daily) - design.shape[1]
+        self.variance = residuals.dot(residuals) / dof if dof > 0 else 0.0
+        self.covariance = np.linalg.pinv(design.T.dot(design))
+
+    def design(self, days):
+        """
+        Build the design matrix of the model for some days.
+        :param days: an int64 array of day numbers (days since 1970-01-01)
+        :return: a 2-D float array with one row per day
+        """
+        columns = [np.ones((len(days), 1))]
+        if self.trend:
+            columns.append(((days - self.origin) / 365.25)[:, None])
+        for codes, seen, n_levels in ((_day_codes(days), self.weekdays, 7), (_month_codes(days), self.months, 12)):
+            one_hot = np.eye(n_levels)[codes]
+            # Deviation from the reference level; levels never seen have all-zero rows, ie., the average effect.
+            columns.append(one_hot[:, seen[1:]] - one_hot[:, seen[:1]])
+        return np.hstack(columns)
+
+    def predict(self, days):
+        """Predicted miles of each day (never negative)."""
+        return np.maximum(self.design(days).dot(self.coefficients), 0)
+
+    def total_error(self, days):
+        """Standard error of the total miles of a run of future days, including the uncertainty of the fit."""
+        design_sum = self.design(days).sum(axis=0)
+        return np.sqrt(self.variance * (len(days) + design_sum.dot(self.covariance).dot(design_sum)))
+
+
+def cap_year(last_day, year_start=None):
+    """
+    Find the year (eg., of a lease) in progress on a given day.
+    :param last_day: a pd.Timestamp
+    :param year_start: any day on which a year starts (eg., the lease start date), or None for calendar years
+    :return: a tuple of (first day, first day of the next year), as pd.Timestamp objects
+    """
+    year_start = pd.Timestamp(year_start) if year_start is not None else pd.Timestamp(last_day.year, 1, 1)
+    years = max(last_day.year - year_start.year, 0)
+    if years and year_start + pd.DateOffset(years=years) > last_day:
+        years -= 1
+    start = year_start + pd.DateOffset(years=years)
+    return start, start + pd.DateOffset(years=1)
+
+
+def forecast(df, cap=None, year_start=None):
+    """
+    Project the miles driven by the end of the current year, and the day a mileage cap will be reached.
+    :type df: pd.DataFrame
+    :param df: the mileage data frame, with 'Date' and 'Miles' columns
+    :param cap: the number of miles allowed per year, or None
+    :param year_start: any day on which a capped year starts (eg., the lease start date), or None for calendar years
+    :return: an OrderedDict of 'year_start' and 'year_end' (the last day of the year), 'driven' (miles driven so far in
+        the year), 'projected', 'low' and 'high' (the projected total for the year and its 95% interval) and
+        'cap_day' (the day the cap is projected to be reached, or None if it won't be within the year)
+    """
+    dated = df['Date'].notnull().values
+    first_day, daily = rolling_stats.daily_totals(df['Date'].values[dated], df['Miles'].values[dated])
+    model = SeasonalModel(first_day, daily)
+
+    last_day = pd.Timestamp(first_day + len(daily) - 1)
+    start, end = cap_year(last_day, year_start)
+    first = np.datetime64(first_day, 'D').astype(np.int64)
+    start_day, end_day, last = (np.datetime64(day, 'D').astype(np.int64) for day in (start, end, last_day))
+
+    history = daily[max(start_day - first, 0):]
+    future = np.arange(max(last + 1, start_day), end_day)
+    predicted = model.predict(future)
+    driven = history.sum()
+    error = Z_95 * model.total_error(future) if len(future) else 0.0
+
+    results = OrderedDict([
+        ('year_start', start),
+        ('year_end', end - pd.Timedelta(days=1)),
+        ('driven', driven),
+        ('projected', driven + predicted.sum()),
+        ('low', driven + max(predicted.sum() - error, 0)),
+        ('high', driven + predicted.sum() + error),
+        ('cap_day', None),
+    ])
+    if cap is not None:
+        # Miles driven in the year by the end of each day, first the recorded days and then the projected ones.
+        cumulative = np.concatenate([np.cumsum(history), driven + np.cumsum(predicted)])
+        reached = np.searchsorted(cumulative, cap)
+        if reached < len(cumulative):
+            results['cap_day'] = pd.Timestamp(np.int64(max(start_day, first) + reached).astype('datetime64[D]'))
+    return results
@@ -10,16 +10,34 @@ Handles the primary functions
 import os
 import sys
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stderr
 from datetime import datetime
+from io import StringIO
 
-from xlrd import open_workbook
 import zlib
 import webbrowser
 
+import pandas as pd
+
+import anomaly_detection
+import bootstrap
 import calculate_statistics
+import daily_calendar
+import data_cache
+import forecasting
 import load_data
 import make_plots
+import memory_budget
 import html_template_render
+import incremental_stats
+import odometer
+import pivot_engine
+import quantile_sketch
+import range_query
+import rollup_cube
+import stream_stats
+import trips
 
 
 # Global return statuses
@@ -54,11 +72,45 @@ def parse_cmdline(argv):
     # initialize the parser object:
     parser = argparse.ArgumentParser()
 
-    parser.add_argument("-i", "--input-file", required=True, help="Path to the Excel workbook containing mileage data.",
+    parser.add_argument("-i", "--input-file", required=True, nargs='+',
+                        help="Path to the Excel workbook (or CSV, TSV or NDJSON file) containing mileage data. "
+                             "Several files, directories or glob patterns may be given to report on a fleet, with "
+                             "one file per vehicle.",
                         type=str)
+    parser.add_argument("-j", "--jobs", type=int, required=False, default=None,
+                        help="Number of worker processes used to load a fleet of input files and to run large "
+                             "--bootstrap jobs. Defaults to the number of CPUs.")
+    parser.add_argument("-f", "--format", choices=sorted(load_data.FORMATS), required=False, default=None,
+                        help="Format of the input file. By default this is picked from the file extension.")
+    parser.add_argument("--date-format", help="strftime-style format of the dates in CSV, TSV and NDJSON input.",
+                        default=load_data.DEFAULT_DATE_FORMAT, required=False)
     parser.add_argument("-s", "--skiprows", help="Number of header rows to skip before reading your table.",
                         required=False, default=0)
-    parser.add_argument("-c", "--usecols", help="A:B-style range of columns to include.", default="A:B", required=False)
+    parser.add_argument("-c", "--usecols", help="A:B-style range of columns to include. Include optional 'Gallons' "
+                                                "and 'Cost' columns (eg., A:D) to report fuel economy and spending.",
+                        default="A:B", required=False)
+
+    parser.add_argument("-a", "--all-sheets", action="store_const", const=True, required=False, default=False,
+                        help="Read every worksheet of an Excel workbook (eg., one sheet per year) and combine them in "
+                             "date order. By default only the first worksheet is read.")
+
+    parser.add_argument("--odometer", action="store_const", const=True, required=False, default=False,
+                        help="The input holds odometer readings (in an 'Odometer' or 'Miles' column) taken at any "
+                             "time, rather than the miles driven each day. Rollovers are corrected for, and resets "
+                             "are skipped.")
+
+    parser.add_argument("--odometer-spread", choices=odometer.SPREADS, default=odometer.DEFAULT_SPREAD, required=False,
+                        help="How --odometer spreads the miles between readings several days apart over those days: "
+                             "evenly, or in proportion to the usual miles of each day of the week.")
+
+    parser.add_argument("--trips", action="store_const", const=True, required=False, default=False,
+                        help="The input holds one row per trip (eg., a telematics export) rather than per day. Trips "
+                             "are totalled per day, and the number of trips per day is reported too.")
+
+    parser.add_argument("--missing-days", choices=daily_calendar.POLICIES, default=None, required=False,
+                        help="Resample the log onto a dense daily calendar, so that days without an entry count as "
+                             "zero miles, as gaps (nan), or as interpolated from the neighbouring days, and report "
+                             "how many days of each month have entries. By default only the recorded days are used.")
 
     parser.add_argument("-b", "--basic-statistics", action="store_const", const=True, required=False,
                         help="Print some basic statistics about the mileage log.")
@@ -74,6 +126,89 @@ def parse_cmdline(argv):
     parser.add_argument("-H", "--no-html", action="store_const", const=True, required=False, default=False,
                         help="Do not generate any HTML output file.")
 
+    parser.add_argument("--no-cache", action="store_const", const=True, required=False, default=False,
+                        help="Neither read nor write the cache of parsed mileage data.")
+
+    parser.add_argument("--rebuild-cache", action="store_const", const=True, required=False, default=False,
+                        help="Ignore any cached copy of the input file and re-parse it, refreshing the cache.")
+
+    parser.add_argument("--cache-dir", help="Directory holding the cache of parsed mileage data.",
+                        default=data_cache.CACHE_DIR, required=False)
+
+    parser.add_argument("--cache-size", help="Maximum size of the cache in MB. Least-recently-used entries are "
+                                             "evicted beyond this.",
+                        type=float, default=data_cache.DEFAULT_MAX_CACHE_MB, required=False)
+
+    parser.add_argument("--since", help="Also print statistics of the mileage driven from this date (eg., 2018-01-01) "
+                                        "onwards.", default=None, required=False)
+
+    parser.add_argument("--until", help="Also print statistics of the mileage driven up to and including this date.",
+                        default=None, required=False)
+
+    parser.add_argument("--stream", action="store_const", const=True, required=False, default=False,
+                        help="Read the input in chunks of rows and aggregate as it goes, so that memory use does "
+                             "not grow with the length of the log. Only text reports are produced, so this option "
+                             "requires -P and -H.")
+
+    parser.add_argument("--chunksize", help="Number of rows per chunk in --stream mode.", type=int,
+                        default=stream_stats.DEFAULT_CHUNKSIZE, required=False)
+
+    parser.add_argument("--memory-budget", help="Peak memory, in MB, that the run may use. If loading the whole log "
+                                                "is projected to need more, the input is streamed in chunks that fit "
+                                                "instead (if the input and options allow it), and only the text "
+                                                "reports are produced.",
+                        type=float, default=None, required=False, metavar="MB")
+
+    parser.add_argument("--memory-report", action="store_const", const=True, required=False, default=False,
+                        help="Measure the peak memory of each stage of the run with tracemalloc, and print it at the "
+                             "end. Input files of a fleet are loaded in worker processes, which aren't measured.")
+
+    parser.add_argument("--incremental", action="store_const", const=True, required=False, default=False,
+                        help="Keep the basic statistics up to date in a file next to the input (INPUT_FILE{}), "
+                             "folding in only the rows dated after the previous run. The median is then "
+                             "sketched.".format(incremental_stats.STATE_SUFFIX))
+
+    parser.add_argument("--approx-median", help="In --stream or --incremental mode, report medians from mergeable "
+                                                "quantile sketches whose rank error is within this fraction (eg., "
+                                                "0.01), instead of exact medians. Memory per pivot cell then stays "
+                                                "fixed.",
+                        type=float, default=None, required=False, metavar="ERROR")
+
+    parser.add_argument("--bootstrap", help="Also report bootstrap confidence intervals of the mean and median "
+                                            "mileage, and of each pivot table cell with -v, from this many resamples "
+                                            "(eg., {}).".format(bootstrap.DEFAULT_RESAMPLES),
+                        type=int, default=None, required=False, metavar="RESAMPLES")
+
+    parser.add_argument("--confidence", help="Confidence level of the --bootstrap intervals.", type=float,
+                        default=bootstrap.DEFAULT_CONFIDENCE, required=False)
+
+    parser.add_argument("--seed", help="Seed for the --bootstrap resampling, so that repeat runs report the same "
+                                       "intervals.", type=int, default=None, required=False)
+
+    parser.add_argument("--anomalies", action="store_const", const=True, required=False, default=False,
+                        help="Report the entries whose mileage is far from the usual mileage for the same month and "
+                             "day of the week (eg., data-entry errors).")
+
+    parser.add_argument("--exclude-anomalies", action="store_const", const=True, required=False, default=False,
+                        help="Leave the entries that --anomalies would report out of every statistic, plot and pivot "
+                             "table.")
+
+    parser.add_argument("--anomaly-threshold", help="Robust z-score (from the median and the median absolute "
+                                                    "deviation) beyond which an entry is anomalous.",
+                        type=float, default=anomaly_detection.DEFAULT_THRESHOLD, required=False)
+
+    parser.add_argument("--forecast", action="store_const", const=True, required=False, default=False,
+                        help="Add a projection of the miles driven by the end of the year to the basic statistics, "
+                             "from a fit of the trend and of the day-of-week and month effects in the log.")
+
+    parser.add_argument("--mileage-cap", help="Annual mileage cap (eg., of a lease). Implies --forecast, and adds the "
+                                              "projected date the cap will be reached.",
+                        type=float, default=None, required=False, metavar="MILES")
+
+    parser.add_argument("--lease-start", help="Start date of the lease, so that projections run to the end of the "
+                                              "lease year rather than the calendar year.",
+                        default=None, required=False)
+
     args = None
 
     # If user doesn't specify any arguments, print the help.
@@ -87,82 +222,491 @@ def parse_cmdline(argv):
     return args, RETVAL.SUCCESS
 
 
-def main(argv=None):
-    args, ret = parse_cmdline(argv)
-    if ret != RETVAL.SUCCESS:
-        return ret
-
-    # If the user specified -P, but not -H, fail and warn that they must allow plots to get HTML
-    if args.no_plots and not args.no_html:
-        warning("You must allow plots in order to generate HTML content. Please run the program without the -P switch.")
-        return args, RETVAL.FAILURE
-
-    # Load data
+def _load_and_prepare(args, path, cache_key=None, register_cube=True):
+    """
+    Parse an input workbook, add the pivoting columns, and store the result in the cache.
+    :param args: the parsed command-line arguments
+    :param path: path to the input file
+    :param cache_key: key under which to cache the prepared data, or None to skip caching
+    :param register_cube: answer this process's pivot tables from the cached rollup cube
+    :return: the prepared pd.DataFrame (or None on failure) and a RETVAL status
+    """
     try:
-        # First try to locate the file. If this fails, quit the program.
-        if not os.path.isfile(args.input_file):
-            warning("Cannot find the input file. Please check the path you specified.")
-            return args, RETVAL.FAILURE
-
-        # Manually check for broken Excel file (because apparently pd.read_excel won't raise an Exception for it)
-        # Thanks to https://stackoverflow.com/a/28645601
-        workbook = open_workbook(args.input_file)
-        workbook.release_resources()
-
-        data, ret = load_data.import_excel_data(
-            args.input_file,
+        # The loader opens an Excel workbook only once, and raises zlib.error if it turns out to be corrupt.
+        data, ret = load_data.import_data(
+            path,
+            fmt=args.format,
             skiprows=args.skiprows,
             usecols=args.usecols,
-            sheets=1,
+            date_format=args.date_format,
+            all_sheets=args.all_sheets,
         )
 
-    except AttributeError as e:
+    except AttributeError:
         warning("You did not specify an Excel input file. Please specify one.")
-        return args, RETVAL.FAILURE
+        return None, RETVAL.FAILURE
     except zlib.error as e:
         warning("Excel file appears to be corrupt. Please try using a different file.", e)
-        return RETVAL.FAILURE
+        return None, RETVAL.FAILURE
+    except ValueError as e:
+        # Text-based formats fail to parse outright when a date or mileage value is malformed.
+        warning(
+            "Workbook contains invalid data. Please check your column formatting and data range and try again.", e)
+        return None, RETVAL.FAILURE
+
+    if args.odometer:
+        try:
+            data, info = odometer.readings_to_daily(data, spread=args.odometer_spread)
+        except KeyError as e:
+            warning("Workbook has no odometer readings. Please give them in an 'Odometer' or 'Miles' column.", e)
+            return None, RETVAL.FAILURE
+        if info['resets']:
+            warning("The odometer readings drop {} time(s) without rolling over. The miles driven across these "
+                    "resets are left out.".format(info['resets']))
+
+    if args.trips:
+        data = trips.trips_to_daily(data)
 
-    # Perform calculations
     try:
+        if args.missing_days:
+            data = daily_calendar.resample_daily(data, policy=args.missing_days)
         data = load_data.establish_relevant_columns(data)
-        basic_stats = calculate_statistics.calculate_basic_stats(data)
     except AttributeError as e:
         warning(
             "Workbook contains invalid data. Please check your column formatting and data range and try again.", e)
+        return None, RETVAL.FAILURE
+
+    if cache_key is not None:
+        # The rollup cube only pays for itself once it is cached, so that later runs can answer reports from it.
+        cube = rollup_cube.RollupCube.build(data)
+        if register_cube:
+            pivot_engine.register_pivots(rollup_cube.CubePivots(data, cube))
+        data_cache.store(cache_key, data, cache_dir=args.cache_dir, max_bytes=int(args.cache_size * 1024 * 1024),
+                         extras=cube.to_arrays())
+
+    return data, RETVAL.SUCCESS
+
+
+def _load_input(args, path, register_cube=True):
+    """
+    Load a single input file, reusing the already-parsed data if this exact file has been read before with the same
+    options.
+    :param args: the parsed command-line arguments
+    :param path: path to the input file
+    :param register_cube: answer this process's pivot tables from the cached rollup cube
+    :return: the prepared pd.DataFrame (or None on failure) and a RETVAL status
+    """
+    data = None
+    cache_key = None
+    if not args.no_cache:
+        cache_key = data_cache.cache_key(path, fmt=load_data.detect_format(path, args.format),
+                                         skiprows=args.skiprows, usecols=args.usecols,
+                                         date_format=args.date_format, all_sheets=args.all_sheets,
+                                         odometer=args.odometer_spread if args.odometer else None, trips=args.trips,
+                                         missing_days=args.missing_days)
+        if not args.rebuild_cache:
+            data, arrays = data_cache.load(cache_key, cache_dir=args.cache_dir, with_arrays=True)
+
+    if data is None:
+        return _load_and_prepare(args, path, cache_key, register_cube=register_cube)
+
+    cube = rollup_cube.RollupCube.from_arrays(arrays) if register_cube else None
+    if cube is not None:
+        pivot_engine.register_pivots(rollup_cube.CubePivots(data, cube))
+    return data, RETVAL.SUCCESS
+
+
+def _load_vehicle(job):
+    """
+    Process-pool worker that loads one vehicle's input file and tags it with a 'Vehicle' column.
+    Warnings are captured and handed back rather than printed, so that the parent process can report them in order.
+    The rollup cubes of the vehicles are still cached, but not registered: the fleet's reports are run on the combined
+    frame in the parent process, which no single vehicle's cube covers.
+    :param job: a tuple of (parsed command-line arguments, path to the input file)
+    :return: a tuple of (pd.DataFrame or None, RETVAL status, captured warning text)
+    """
+    args, path = job
+    messages = StringIO()
+    with redirect_stderr(messages):
+        try:
+            if not os.path.isfile(path):
+                warning("Cannot find the input file. Please check the path you specified.")
+                return None, RETVAL.FAILURE, messages.getvalue()
+            data, ret = _load_input(args, path, register_cube=False)
+        except Exception as e:
+            # One bad file must not take down the rest of the batch.
+            warning("Could not load the input file.", e)
+            return None, RETVAL.FAILURE, messages.getvalue()
+
+    if ret == RETVAL.SUCCESS:
+        data['Vehicle'] = load_data.vehicle_name(path)
+    return data, ret, messages.getvalue()
+
+
+def _load_fleet(args, paths):
+    """
+    Load one input file per vehicle concurrently in a process pool and combine them into a single DataFrame.
+    Files that fail to load are reported and skipped.
+    :param args: the parsed command-line arguments
+    :param paths: list of paths to the input files
+    :return: the combined pd.DataFrame (or None if no file could be loaded) and a RETVAL status
+    """
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        results = list(pool.map(_load_vehicle, [(args, path) for path in paths]))
+
+    frames = []
+    for path, (data, ret, messages) in zip(paths, results):
+        if ret == RETVAL.SUCCESS:
+            frames.append(data)
+        else:
+            sys.stderr.write(messages)
+            warning("Skipping {}.".format(path))
+
+    if not frames:
+        warning("None of the input files could be loaded.")
+        return None, RETVAL.FAILURE
+
+    data = pd.concat(frames, ignore_index=True)
+    data['Vehicle'] = data['Vehicle'].astype('category')
+    return data, RETVAL.SUCCESS
+
+
+def _refresh_incremental_stats(args, path, data):
+    """
+    Update the saved basic statistics of an input file with its new rows.
+    :param args: the parsed command-line arguments
+    :param path: path to the input file
+    :param data: the file's prepared pd.DataFrame
+    :return: the basic statistics dict, or None if the saved statistics couldn't be written
+    """
+    median_error = args.approx_median or incremental_stats.DEFAULT_MEDIAN_ERROR
+    try:
+        stats, _ = incremental_stats.refresh(path, data, median_error=median_error)
+    except (IOError, OSError) as e:
+        warning("Could not save incremental statistics next to the input file. Computing them in full instead.", e)
+        return None
+    return stats.basic_stats()
+
+
+def _stream_blockers(args, input_files):
+    """
+    List what keeps a run from being streamed (see _run_streaming), for switching to it to fit a memory budget.
+    :param args: the parsed command-line arguments
+    :param input_files: the input files, as returned by load_data.expand_input_paths
+    :return: a list of descriptions of the inputs and options that streaming mode can't handle, empty if there are none
+    """
+    blockers = []
+    if input_files != args.input_file or len(input_files) > 1:
+        blockers.append("several input files")
+    elif not stream_stats.streamable(input_files[0], fmt=args.format):
+        blockers.append("{} input".format(load_data.detect_format(input_files[0], args.format)))
+    options = [('--all-sheets', args.all_sheets), ('--since', args.since), ('--until', args.until),
+               ('--odometer', args.odometer), ('--trips', args.trips), ('--missing-days', args.missing_days),
+               ('--anomalies', args.anomalies), ('--exclude-anomalies', args.exclude_anomalies),
+               ('--forecast', args.forecast), ('--mileage-cap', args.mileage_cap is not None),
+               ('--lease-start', args.lease_start is not None), ('--bootstrap', args.bootstrap is not None)]
+    blockers.extend(option for option, given in options if given)
+    return blockers
+
+
+def _run_streaming(args):
+    """
+    Produce the text reports by streaming the workbook through running aggregators instead of loading it whole.
+    :param args: the parsed command-line arguments
+    :return: a RETVAL status
+    """
+    try:
+        chunks = stream_stats.iter_chunks(args.input_file[0], fmt=args.format, skiprows=args.skiprows,
+                                          usecols=args.usecols, date_format=args.date_format,
+                                          chunksize=args.chunksize)
+    except ValueError as e:
+        warning(e)
+        return RETVAL.FAILURE
+
+    try:
+        aggregator = stream_stats.aggregate_chunks(chunks, median_error=args.approx_median)
+    except ImportError as e:
+        warning("Streaming mode requires the openpyxl package. Please install it and try again.", e)
+        return RETVAL.FAILURE
+    except zlib.error as e:
+        warning("Excel file appears to be corrupt. Please try using a different file.", e)
+        return RETVAL.FAILURE
+    except (AttributeError, KeyError, ValueError) as e:
+        warning("Workbook contains invalid data. Please check your column formatting and data range and try "
+                "again.", e)
         return RETVAL.FAILURE
 
     if args.basic_statistics:
-        calculate_statistics.print_basic_stats(basic_stats)
+        calculate_statistics.print_basic_stats(aggregator.basic_stats())
 
     if args.pivot_tables:
-        # Print text representation of pivot tables to screen.
-        calculate_statistics.gen_pvt_table_stdout_reports(data, calculate_statistics.PVT_TABLES)
-
-    # Make Plots
-    if not args.no_plots:
-        make_plots.write_all_plots(data, make_plots.plot_info)
-        print("Plots saved to {}".format(make_plots.IMG_DIR))
-
-    # Render HTML report:
-    # First, compile all the data into a huge dictionary:
-    if not args.no_plots and not args.no_html:
-        jinja_data = {
-            'time_stamp': datetime.now().strftime('%c'),
-            'basic_stats': basic_stats,
-            'pvt_tables': calculate_statistics.gen_pvt_table_html_reports(data, calculate_statistics.PVT_TABLES),
-            'plot_info': make_plots.plot_info,
-            'plot_ext': make_plots.OUTPUT_EXT,
-            'plot_dir': make_plots.IMG_DIR + os.sep,
-        }
-
-        # Then, render this template using Jinja
-        html_template_render.render_template(jinja_data, template_path=TEMPLATE_PATH, out_path=HTML_OUT_PATH)
-
-        # Open results in browser
-        webbrowser.open(HTML_OUT_PATH)
-
-    return RETVAL.SUCCESS  # success
+        calculate_statistics.gen_pvt_table_stdout_reports(aggregator)
+
+    return RETVAL.SUCCESS
+
+
+def main(argv=None):
+    args, ret = parse_cmdline(argv)
+    if ret != RETVAL.SUCCESS:
+        return ret
+
+    # If the user specified -P, but not -H, fail and warn that they must allow plots to get HTML
+    if args.no_plots and not args.no_html:
+        warning("You must allow plots in order to generate HTML content. Please run the program without the -P switch.")
+        return args, RETVAL.FAILURE
+
+    # A log projected not to fit in the memory budget is streamed in chunks that do, if the run can be streamed.
+    if args.memory_budget is not None:
+        budget = args.memory_budget * memory_budget.MEGABYTE
+        input_files = load_data.expand_input_paths(args.input_file)
+        projected = memory_budget.projected_peak(input_files, fmt=args.format)
+        if projected > budget and not args.stream:
+            over_budget = ("Loading the input is projected to take {:.0f} MB of memory, more than the budget of {:g} "
+                           "MB.".format(projected / memory_budget.MEGABYTE, args.memory_budget))
+            blockers = _stream_blockers(args, input_files)
+            if blockers:
+                warning(over_budget + " It can't be streamed with {}, so it is loaded whole "
+                                      "anyway.".format(', '.join(blockers)))
+            else:
+                warning(over_budget + " Streaming it instead; only the text reports are produced.")
+                args.stream, args.no_plots, args.no_html = True, True, True
+        if args.stream:
+            args.chunksize = memory_budget.fitting_chunksize(budget, args.chunksize)
+
+    # Streaming mode only keeps running aggregates, so it can't feed the plots (and hence the HTML report).
+    if args.stream and not (args.no_plots and args.no_html):
+        warning("Streaming mode only produces text reports. Please run the program with the -P and -H switches.")
+        return RETVAL.FAILURE
+
+    # Date ranges are looked up in the loaded log, which streaming mode never holds.
+    if args.since or args.until:
+        if args.stream:
+            warning("Streaming mode can't report on a date range. Please run the program without --since and --until.")
+            return RETVAL.FAILURE
+        try:
+            period = [pd.Timestamp(day) if day else None for day in (args.since, args.until)]
+        except ValueError as e:
+            warning("Could not read the --since or --until date. Please give dates like 2018-01-31.", e)
+            return RETVAL.FAILURE
+
+    # Approximate medians come from running aggregators, which only exist in streaming and incremental modes.
+    if args.approx_median is not None:
+        if not (args.stream or args.incremental):
+            warning("Approximate medians are only available in streaming or incremental mode. Please add the --stream "
+                    "or --incremental switch.")
+            return RETVAL.FAILURE
+        try:
+            quantile_sketch.k_for_error(args.approx_median)
+        except ValueError as e:
+            warning(e)
+            return RETVAL.FAILURE
+
+    # Odometer readings are differenced, and missing days found, across the whole log, so neither can be streamed.
+    if (args.odometer or args.trips or args.missing_days) and args.stream:
+        warning("Streaming mode reads the recorded daily mileage only. Please run the program without --odometer, "
+                "--trips and --missing-days.")
+        return RETVAL.FAILURE
+
+    if args.odometer and args.trips:
+        warning("Odometer readings can't be read as trips. Please run the program with only one of --odometer and "
+                "--trips.")
+        return RETVAL.FAILURE
+
+    # Anomalies are found by comparing each row with the rest of the log, so streaming mode can't flag them.
+    if (args.anomalies or args.exclude_anomalies) and args.stream:
+        warning("Streaming mode can't flag anomalous entries. Please run the program without --anomalies and "
+                "--exclude-anomalies.")
+        return RETVAL.FAILURE
+
+    # Projections are fitted to the daily history, which streaming mode never holds.
+    forecast = args.forecast or args.mileage_cap is not None or args.lease_start is not None
+    if forecast:
+        if args.stream:
+            warning("Streaming mode can't project the mileage. Please run the program without --forecast, "
+                    "--mileage-cap and --lease-start.")
+            return RETVAL.FAILURE
+        try:
+            lease_start = pd.Timestamp(args.lease_start) if args.lease_start else None
+        except ValueError as e:
+            warning("Could not read the --lease-start date. Please give a date like 2018-01-31.", e)
+            return RETVAL.FAILURE
+
+    # Resampling needs the rows themselves, which streaming mode never holds.
+    if args.bootstrap is not None:
+        if args.stream:
+            warning("Streaming mode can't resample the log. Please run the program without --bootstrap.")
+            return RETVAL.FAILURE
+        try:
+            bootstrap.check_options(args.bootstrap, args.confidence)
+        except ValueError as e:
+            warning(e)
+            return RETVAL.FAILURE
+
+    tracker = memory_budget.StageTracker(enabled=args.memory_report)
+    # The tracker is stopped on every way out, including the early returns and errors below.
+    try:
+        # Load data
+        try:
+            input_files = load_data.expand_input_paths(args.input_file)
+
+            # Several files, a directory or a glob pattern make up a fleet report. Missing files in a fleet are
+            # skipped.
+            fleet = input_files != args.input_file or len(input_files) > 1
+
+            # First try to locate the file. If this fails, quit the program.
+            if not input_files or (not fleet and not os.path.isfile(input_files[0])):
+                warning("Cannot find the input file. Please check the path you specified.")
+                return args, RETVAL.FAILURE
+
+            if args.stream:
+                if fleet:
+                    warning("Streaming mode reads a single input file. Please specify only one.")
+                    return RETVAL.FAILURE
+                if args.all_sheets:
+                    warning("Streaming mode reads only the first worksheet. Please run the program without the -a "
+                            "switch.")
+                    return RETVAL.FAILURE
+                tracker.start_stage("Stream")
+                ret = _run_streaming(args)
+                if args.memory_report:
+                    calculate_statistics.print_memory_report(tracker.finish())
+                return ret
+
+            if args.incremental and fleet:
+                warning("Incremental statistics are kept per input file. Please specify only one.")
+                return RETVAL.FAILURE
+
+        except AttributeError:
+            warning("You did not specify an Excel input file. Please specify one.")
+            return args, RETVAL.FAILURE
+
+        tracker.start_stage("Load")
+        if fleet:
+            data, ret = _load_fleet(args, input_files)
+        else:
+            data, ret = _load_input(args, input_files[0])
+        if ret != RETVAL.SUCCESS:
+            return ret
+
+        tracker.start_stage("Statistics")
+        if args.missing_days:
+            coverage, recorded_days, calendar_days = daily_calendar.coverage(data)
+
+        flagged = None
+        if args.anomalies or args.exclude_anomalies:
+            flagged, flags = anomaly_detection.flag_anomalies(data, threshold=args.anomaly_threshold)
+            if args.exclude_anomalies:
+                data = data[~flags]
+
+        # Perform calculations. The basic statistics are only computed as they are printed or rendered, so lining them
+        # (and the optional statistics below) up costs next to nothing when neither -b nor the HTML report needs them.
+        try:
+            basic_stats = None
+            if args.incremental:
+                basic_stats = _refresh_incremental_stats(args, input_files[0], data)
+            if basic_stats is None:
+                basic_stats = calculate_statistics.calculate_basic_stats(data)
+            else:
+                basic_stats = calculate_statistics.LazyStats(basic_stats)
+        except AttributeError as e:
+            warning(
+                "Workbook contains invalid data. Please check your column formatting and data range and try again.", e)
+            return RETVAL.FAILURE
+
+        if args.missing_days:
+            basic_stats.add_lazy_group(lambda: calculate_statistics.build_coverage_stats(recorded_days, calendar_days))
+
+        if args.trips:
+            basic_stats.update(calculate_statistics.calculate_trip_stats(data))
+
+        if args.bootstrap:
+            def interval_stats():
+                intervals = bootstrap.confidence_intervals({'all': data['Miles'].dropna().values},
+                                                           n_resamples=args.bootstrap, confidence=args.confidence,
+                                                           seed=args.seed, jobs=args.jobs)
+                return calculate_statistics.build_interval_stats(intervals['all'], args.confidence)
+            basic_stats.add_lazy_group(interval_stats)
+
+        if forecast:
+            def forecast_stats():
+                # Each vehicle of a fleet has its own history (and cap), so each gets its own projection.
+                stats = {}
+                vehicles = data.groupby('Vehicle') if fleet else [(None, data)]
+                for vehicle, vehicle_data in vehicles:
+                    if len(vehicle_data):
+                        stats.update(calculate_statistics.build_forecast_stats(
+                            forecasting.forecast(vehicle_data, cap=args.mileage_cap, year_start=lease_start),
+                            cap=args.mileage_cap, vehicle=vehicle))
+                return stats
+            basic_stats.add_lazy_group(forecast_stats)
+
+        # Every pivot table below (stdout, plots and HTML) is read from this one object, so each grouping is made once.
+        pivots = pivot_engine.get_pivots(data)
+        if pivots.fuel_metrics():
+            basic_stats.update(calculate_statistics.calculate_fuel_stats(data, pivots))
+
+        tracker.start_stage("Text Reports")
+        if args.basic_statistics:
+            calculate_statistics.print_basic_stats(basic_stats)
+
+        if args.since or args.until:
+            since, until = (day or default for day, default in zip(period, (data['Date'].min(), data['Date'].max())))
+            period_stats = range_query.RangeQuery(data).stats(since, until)
+            calculate_statistics.print_basic_stats(
+                calculate_statistics.build_period_stats(period_stats),
+                title="Statistics from {} to {}".format(since.strftime("%d %b %Y"), until.strftime("%d %b %Y")))
+
+        if args.anomalies:
+            calculate_statistics.print_anomalies(flagged)
+
+        if args.pivot_tables:
+            # Print text representation of pivot tables to screen.
+            calculate_statistics.gen_pvt_table_stdout_reports(pivots)
+            calculate_statistics.gen_fuel_table_stdout_reports(pivots)
+            if args.trips:
+                calculate_statistics.print_trips_table(pivot_engine.get_pivots(data, values=load_data.TRIPS_COLUMN))
+            if args.missing_days:
+                calculate_statistics.print_coverage(coverage)
+            if args.bootstrap:
+                calculate_statistics.print_pvt_intervals(
+                    bootstrap.pivot_intervals(data, calculate_statistics.PVT_INDEX, n_resamples=args.bootstrap,
+                                              confidence=args.confidence, seed=args.seed, jobs=args.jobs),
+                    args.confidence)
+
+        # Make Plots
+        plot_config = make_plots.plots_for(pivots)
+        if not args.no_plots:
+            tracker.start_stage("Plots")
+            make_plots.write_all_plots(data, plot_config, pivots=pivots)
+            print("Plots saved to {}".format(make_plots.IMG_DIR))
+
+        # Render HTML report:
+        # First, compile all the data into a huge dictionary:
+        if not args.no_plots and not args.no_html:
+            tracker.start_stage("HTML Report")
+            jinja_data = {
+                'time_stamp': datetime.now().strftime('%c'),
+                'basic_stats': basic_stats,
+                'pvt_tables': calculate_statistics.gen_pvt_table_html_reports(pivots),
+                'fuel_tables': calculate_statistics.gen_fuel_table_html_reports(pivots),
+                'anomalies': calculate_statistics.anomalies_to_html(flagged) if args.anomalies else None,
+                'plot_info': plot_config,
+                'plot_ext': make_plots.OUTPUT_EXT,
+                'plot_dir': make_plots.IMG_DIR + os.sep,
+            }
+
+            # Then, render this template using Jinja
+            html_template_render.render_template(jinja_data, template_path=TEMPLATE_PATH, out_path=HTML_OUT_PATH)
+
+            # Open results in browser
+            webbrowser.open(HTML_OUT_PATH)
+
+        if args.memory_report:
+            calculate_statistics.print_memory_report(tracker.finish())
+
+        return RETVAL.SUCCESS  # success
+    finally:
+        tracker.stop()
 
 
 if __name__ == "__main__":
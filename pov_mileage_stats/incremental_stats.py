@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+incrementalStats.py
+A small command-line tool to calculate mileage statistics for a personally-owned vehicle.
+
+Handles basic statistics that are kept up to date between runs instead of being recomputed over the whole log.
+
+The running state (a Welford mean and variance, the running minimum and maximum, the first and last day, a quantile
+sketch for the median, and the daily totals of the longest trailing window) is saved next to the input file as a NumPy
+.npz archive. The last day folded in acts as a watermark: the next run only folds in the rows dated after it. If
+the rows up to the watermark no longer match the saved state (eg., because an old entry was edited or deleted), the
+state is rebuilt from the whole log. The rows are matched against a cheap checkpoint rather than rehashed in full:
+their number, the total of their mileage, and a hash of the first and last CHECKPOINT_ROWS of them, which is where a
+log is usually edited. An edit in the middle of a long history that keeps its mileage total goes unnoticed; delete
+the state file to rebuild it by hand.
+"""
+
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import calculate_statistics
+import quantile_sketch
+import rolling_stats
+
+# Global Options
+STATE_SUFFIX = '.stats.npz'
+# Rank error of the sketched median. Small enough that the median of a typical personal log is exact.
+DEFAULT_MEDIAN_ERROR = 0.001
+
+# Number of rows at each end of the history that the checkpoint hashes
+CHECKPOINT_ROWS = 1024
+
+# Bump this whenever the layout of the saved state changes, so that stale state files are rebuilt.
+STATE_VERSION = 4
+
+# Reserved array names inside a state file
+_SCALARS = ('count', 'mean', 'm2', 'min', 'max')
+_LEVEL_PREFIX = 'level::'
+
+
+class IncrementalStats(object):
+    """
+    Running basic statistics of a mileage log, updated one batch of new rows at a time.
+    """
+
+    def __init__(self, median_error=DEFAULT_MEDIAN_ERROR):
+        """
+        :param median_error: normalized rank error tolerated in the median (eg., 0.001)
+        """
+        self.median_error = median_error
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.first_day = None
+        self.last_day = None
+        self.sketch = quantile_sketch.KLLSketch(k=quantile_sketch.k_for_error(median_error))
+        # Total miles of each of the last max(rolling_stats.WINDOWS) days, ending on last_day
+        self.recent = np.zeros(0)
+        # Checkpoint of the rows folded in so far, as returned by checkpoint
+        self.checkpoint = (np.uint64(0), 0.0)
+
+    def update(self, df):
+        """
+        Fold new rows of the mileage log into the running statistics.
+        :type df: pd.DataFrame
+        :param df: a DataFrame with 'Date' and 'Miles' columns and no missing mileage
+        :return:
+        """
+        values = np.asarray(df['Miles'].values, dtype=float)
+        if len(values) == 0:
+            return
+
+        # Chan et al.'s pairwise form of Welford's update, so that a whole batch is folded in at once.
+        batch_mean = values.mean()
+        batch_m2 = ((values - batch_mean) ** 2).sum()
+        total = self.count + len(values)
+        delta = batch_mean - self.mean
+        self.mean += delta * len(values) / total
+        self.m2 += batch_m2 + delta ** 2 * self.count * len(values) / total
+        self.count = total
+
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self._update_recent(df['Date'], values)
+        first_day, last_day = df['Date'].min(), df['Date'].max()
+        self.first_day = first_day if self.first_day is None else min(self.first_day, first_day)
+        self.last_day = last_day if self.last_day is None else max(self.last_day, last_day)
+        self.sketch.update(values)
+
+    def _update_recent(self, dates, values):
+        """Add new rows to the daily totals of the last max(rolling_stats.WINDOWS) days."""
+        first, daily = rolling_stats.daily_totals(dates, values)
+        if first is None:
+            return
+        last = first + len(daily) - 1
+        if self.last_day is not None:
+            # Lay the saved days and the new ones out on one calendar covering both.
+            old_last = np.datetime64(self.last_day, 'D')
+            old_first = old_last - len(self.recent) + 1
+            start, end = min(first, old_first), max(last, old_last)
+            combined = np.zeros((end - start).astype(np.int64) + 1)
+            combined[(old_first - start).astype(np.int64):][:len(self.recent)] += self.recent
+            combined[(first - start).astype(np.int64):][:len(daily)] += daily
+            daily = combined
+        self.recent = daily[-max(rolling_stats.WINDOWS):]
+
+    @property
+    def history_days(self):
+        """Number of days from the first to the last day folded in."""
+        return (self.last_day - self.first_day).days + 1 if self.first_day is not None else 0
+
+    @property
+    def variance(self):
+        """Sample variance of the mileage, or NaN with fewer than two rows."""
+        return self.m2 / (self.count - 1) if self.count > 1 else np.nan
+
+    @property
+    def median(self):
+        return self.sketch.median
+
+    def basic_stats(self):
+        """
+        Return the basic statistics in the same form as calculate_statistics.calculate_basic_stats.
+        """
+        return calculate_statistics.build_basic_stats(
+            mean_mileage=self.mean,
+            med_mileage=self.median,
+            first_day=self.first_day,
+            last_day=self.last_day,
+            record_low=self.min,
+            record_high=self.max,
+            rolling=rolling_stats.latest_windows(self.recent, history_days=self.history_days),
+        )
+
+    def to_arrays(self):
+        """
+        Break the state down into a dict of plain NumPy arrays that np.savez can store without pickling.
+        """
+        arrays = {name: np.array(getattr(self, name)) for name in _SCALARS}
+        arrays['version'] = np.array(STATE_VERSION)
+        arrays['median_error'] = np.array(self.median_error)
+        arrays['days'] = np.array([self.first_day, self.last_day], dtype='datetime64[ns]')
+        arrays['sketch'] = np.array([self.sketch.count, self.sketch.min, self.sketch.max])
+        arrays['recent'] = self.recent
+        arrays['checkpoint_hash'] = np.array(self.checkpoint[0], dtype=np.uint64)
+        arrays['checkpoint_total'] = np.array(self.checkpoint[1])
+        for level, items in enumerate(self.sketch.levels):
+            arrays[_LEVEL_PREFIX + str(level)] = items
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        Rebuild the state from the arrays produced by to_arrays.
+        :param arrays: a mapping of array names to np.ndarray objects (eg., an open np.load archive)
+        :return: an IncrementalStats, or None if the arrays were saved by an incompatible version
+        """
+        if int(arrays['version']) != STATE_VERSION:
+            return None
+
+        stats = cls(median_error=float(arrays['median_error']))
+        stats.count = int(arrays['count'])
+        for name in _SCALARS[1:]:
+            setattr(stats, name, float(arrays[name]))
+        days = pd.to_datetime(arrays['days'])
+        stats.first_day, stats.last_day = (None, None) if days.isnull().any() else (days[0], days[1])
+        stats.recent = arrays['recent']
+        stats.checkpoint = (np.uint64(arrays['checkpoint_hash']), float(arrays['checkpoint_total']))
+
+        sketch_count, stats.sketch.min, stats.sketch.max = arrays['sketch'].tolist()
+        stats.sketch.count = int(sketch_count)
+        levels = sorted((name for name in arrays.keys() if name.startswith(_LEVEL_PREFIX)),
+                        key=lambda name: int(name[len(_LEVEL_PREFIX):]))
+        stats.sketch.levels = [arrays[name] for name in levels] or [np.empty(0)]
+        return stats
+
+
+def checkpoint(df, history=None):
+    """
+    Summarize the rows of a mileage log that have been folded in, to tell cheaply whether they changed since.
+    :type df: pd.DataFrame
+    :param df: a DataFrame with 'Date' and 'Miles' columns and no missing mileage
+    :param history: a boolean array marking the rows folded in, or None for every row
+    :return: a tuple of (a np.uint64 hash of the dates and mileage of the first and last CHECKPOINT_ROWS rows, and the
+        total mileage of the rows)
+    """
+    miles = np.asarray(df['Miles'].values, dtype=float)
+    rows = np.arange(len(df)) if history is None else np.flatnonzero(history)
+    # Rows are usually appended in date order, which leaves the history as a prefix of the log that needs no gather.
+    history_miles = miles[:len(rows)] if not len(rows) or rows[-1] == len(rows) - 1 else miles[rows]
+    total = float(history_miles.sum())
+
+    if len(rows) > 2 * CHECKPOINT_ROWS:
+        rows = np.concatenate([rows[:CHECKPOINT_ROWS], rows[-CHECKPOINT_ROWS:]])
+    ends = pd.DataFrame({'Date': df['Date'].values[rows], 'Miles': miles[rows]}, columns=['Date', 'Miles'])
+    with np.errstate(over='ignore'):
+        row_hash = np.uint64(pd.util.hash_pandas_object(ends, index=False).values.sum(dtype=np.uint64))
+    return row_hash, total
+
+
+def state_path(input_path):
+    """Return the path of the saved state for an input file, next to the file itself."""
+    return input_path + STATE_SUFFIX
+
+
+def load_state(path):
+    """
+    Read saved incremental statistics.
+    :param path: path to the state file
+    :return: an IncrementalStats, or None if there is no usable state file
+    """
+    if not os.path.isfile(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as archive:
+            return IncrementalStats.from_arrays(archive)
+    except (IOError, OSError, ValueError, KeyError):
+        # Unreadable state (eg., a partial write from a killed run). Rebuild it.
+        return None
+
+
+def save_state(stats, path):
+    """
+    Write incremental statistics to disk, replacing any earlier state atomically.
+    :type stats: IncrementalStats
+    :param path: path to the state file
+    :return:
+    """
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'wb') as out_file:
+            np.savez(out_file, **stats.to_arrays())
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def refresh(input_path, df, median_error=DEFAULT_MEDIAN_ERROR):
+    """
+    Bring the saved statistics of an input file up to date with its data, folding in only the rows after the watermark.
+    :param input_path: path to the input file; the state is kept in state_path(input_path)
+    :type df: pd.DataFrame
+    :param df: the file's mileage data, with 'Date' and 'Miles' columns and no missing mileage
+    :param median_error: normalized rank error tolerated in the median
+    :return: the up-to-date IncrementalStats, and the number of rows that were folded in
+    """
+    path = state_path(input_path)
+    stats = load_state(path)
+
+    if stats is None or stats.median_error != median_error or stats.last_day is None:
+        stats, new_rows = IncrementalStats(median_error), df
+    else:
+        after_watermark = (df['Date'] > stats.last_day).values
+        if (len(df) - after_watermark.sum() != stats.count
+                or checkpoint(df, ~after_watermark) != stats.checkpoint):
+            # The history itself changed since the state was saved, so it can't be extended.
+            stats, new_rows = IncrementalStats(median_error), df
+        else:
+            new_rows = df[after_watermark]
+
+    stats.update(new_rows)
+    # Every row of df is now folded in.
+    stats.checkpoint = checkpoint(df)
+    save_state(stats, path)
+    return stats, len(new_rows)
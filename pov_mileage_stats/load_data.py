@@ -7,10 +7,240 @@ Handles data conversion into a pandas DataFrame.
 """
 
 import os
-import pathlib2 as pathlib
+import glob
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import pandas as pd
+import xlrd
 import gen_mileage_stats as main
 
+# Workbook formats that are stored as zip archives
+ZIPPED_EXCEL_EXTS = ('.xlsx', '.xlsm')
+
+# pandas reads zipped workbooks with openpyxl from version 0.25 on (and xlrd 2 no longer reads them at all). Older
+# versions only read them with xlrd.
+PANDAS_READS_OPENPYXL = tuple(int(part) for part in pd.__version__.split('.')[:2]) >= (0, 25)
+
+# Input formats, and the file extensions that select them
+FORMATS = {
+    'excel': ('.xlsx', '.xlsm', '.xls'),
+    'csv': ('.csv',),
+    'tsv': ('.tsv', '.tab'),
+    'ndjson': ('.ndjson', '.jsonl'),
+}
+DEFAULT_FORMAT = 'excel'
+
+# Date format used by the text-based formats. Giving it explicitly lets pandas skip format inference.
+DEFAULT_DATE_FORMAT = '%Y-%m-%d'
+
+# Column types of the mileage log
+MILES_DTYPE = np.float64
+YEAR_DTYPE = np.int16
+
+# Optional columns of fuel bought (in gallons) and money spent, eg., on the days the tank was filled. They are picked
+# up by name when the --usecols range includes them.
+FUEL_COLUMNS = ('Gallons', 'Cost')
+
+# Column holding the number of trips taken each day, in logs collapsed from one row per trip (see trips.py)
+TRIPS_COLUMN = 'Trips'
+
+# Labels of the pivoting columns, eg., "(0): Sunday" and "(03): March". The sort order of each label matches its
+# number.
+DAY_OF_WEEK_FORMAT = '(%w): %A'
+MONTH_FORMAT = '(%m): %B'
+DAY_OF_WEEK_LABELS = list(pd.date_range('2017-01-01', periods=7, freq='D').strftime(DAY_OF_WEEK_FORMAT))
+MONTH_LABELS = list(pd.date_range('2017-01-01', periods=12, freq='MS').strftime(MONTH_FORMAT))
+
+
+def detect_format(path, fmt=None):
+    """
+    Work out which input format to read a file as.
+    :param
+    path: The path to the input file.
+    fmt: An explicitly requested format (one of the keys of FORMATS), or None to go by the file extension.
+
+    :return
+    The name of the format. Unrecognised extensions are read as DEFAULT_FORMAT.
+    """
+    if fmt is not None:
+        return fmt
+
+    ext = os.path.splitext(path)[1].lower()
+    for name, exts in FORMATS.items():
+        if ext in exts:
+            return name
+    return DEFAULT_FORMAT
+
+
+def import_data(path, fmt=None, skiprows=0, usecols="A:B", date_format=DEFAULT_DATE_FORMAT, all_sheets=False,
+                **kwargs):
+    """
+    Imports a mileage log in any supported format into a pd.DataFrame object with 'Date' and 'Miles' columns.
+    :param
+    path: The (relative) path to the input file.
+    fmt: The input format (one of the keys of FORMATS), or None to pick it from the file extension.
+    skiprows: Number of header rows to skip before reading the table.
+    usecols: A:B-style range of columns to include.
+    date_format: strftime-style format of the dates in text-based formats.
+    all_sheets: For Excel workbooks, read every worksheet rather than just the first.
+
+    :return
+    df: A pd.DataFrame instance containing the pertinent data in the file.
+    ret: A RETVAL status corresponding to the outcome of the function
+    """
+    fmt = detect_format(path, fmt)
+
+    if fmt == 'excel' and all_sheets:
+        return import_excel_sheets(path, skiprows=skiprows, usecols=usecols, **kwargs)
+    if fmt == 'excel':
+        return import_excel_data(path, skiprows=skiprows, usecols=usecols, **kwargs)
+    if fmt == 'csv':
+        return import_csv_data(path, sep=',', skiprows=skiprows, usecols=usecols, date_format=date_format)
+    if fmt == 'tsv':
+        return import_csv_data(path, sep='\t', skiprows=skiprows, usecols=usecols, date_format=date_format)
+    if fmt == 'ndjson':
+        return import_ndjson_data(path, date_format=date_format)
+
+    raise ValueError("Unknown input format: {}".format(fmt))
+
+
+def expand_input_paths(patterns):
+    """
+    Expand a list of input file arguments into the input files they name.
+    :param
+    patterns: A list of file paths, directory paths and/or glob patterns. A directory stands for every file in it
+        with a recognised extension (see FORMATS).
+
+    :return
+    A de-duplicated list of file paths, in the order given (sorted within each directory or glob). Plain file paths are
+    passed through as-is, even if they don't exist, so that the caller can report them.
+    """
+    known_exts = tuple(ext for exts in FORMATS.values() for ext in exts)
+
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = sorted(os.path.join(pattern, name) for name in os.listdir(pattern)
+                             if name.lower().endswith(known_exts) and os.path.isfile(os.path.join(pattern, name)))
+        elif glob.has_magic(pattern):
+            matches = sorted(path for path in glob.glob(pattern) if os.path.isfile(path))
+        else:
+            matches = [pattern]
+
+        paths.extend(path for path in matches if path not in paths)
+
+    return paths
+
+
+def vehicle_name(path):
+    """Name a vehicle after its input file, eg., "/logs/civic.xlsx" -> "civic"."""
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def usecols_to_positions(usecols):
+    """
+    Convert an Excel-style column specification (eg., "A:B" or "A,C:D") into a list of 0-based column positions.
+    """
+    positions = []
+    for part in str(usecols).split(','):
+        first, _, last = part.partition(':')
+        positions.extend(range(_column_number(first), _column_number(last or first) + 1))
+    return positions
+
+
+def _column_number(letters):
+    """Convert Excel column letters (eg., "A" or "AB") into a 0-based column position."""
+    number = 0
+    for letter in letters.strip().upper():
+        number = number * 26 + ord(letter) - ord('A') + 1
+    return number - 1
+
+
+def check_workbook_archive(path):
+    """
+    Cheap up-front check of a workbook stored as a zip archive: if its archive directory can't even be read, it is
+    corrupt, and there is no point handing it to a parser. Only the directory at the end of the file is read.
+    :param
+    path: The (relative) path to a Microsoft Excel workbook. Workbooks that aren't zip archives (eg., .xls) pass.
+
+    :raises
+    zlib.error: if the workbook is corrupt.
+    """
+    if path.lower().endswith(ZIPPED_EXCEL_EXTS) and not zipfile.is_zipfile(path):
+        raise zlib.error("{} is not a valid zip archive".format(path))
+
+
+def open_zipped_workbook(path, read_only=True):
+    """
+    Opens a zipped (.xlsx or .xlsm) Microsoft Excel workbook with openpyxl, checking its integrity along the way.
+    :param
+    path: The (relative) path to a zipped Microsoft Excel workbook.
+    read_only: Read worksheets lazily, row by row. Pass False to load every worksheet up front (eg., so that they can
+        be read from several threads at once).
+
+    :return
+    workbook: An open openpyxl.Workbook. Call close_workbook on it when done.
+
+    :raises
+    zlib.error: if the workbook is corrupt.
+    """
+    # openpyxl is only needed for zipped workbooks, so don't require it for everything else.
+    import openpyxl
+
+    path = os.path.abspath(path)
+    check_workbook_archive(path)
+    try:
+        return openpyxl.load_workbook(path, read_only=read_only, data_only=True)
+    except (KeyError, zipfile.BadZipFile) as e:
+        # A readable archive missing the workbook's parts (KeyError) or holding damaged ones is corrupt too.
+        raise zlib.error("{} is not a valid workbook: {}".format(path, e))
+
+
+def open_workbook(path, on_demand=True):
+    """
+    Opens a Microsoft Excel workbook exactly once, checking its integrity along the way.
+    :param
+    path: The (relative) path to a Microsoft Excel workbook.
+    on_demand: Load worksheets only as they are accessed, where the file format allows it. Pass False to load every
+        worksheet up front (eg., so that they can be read from several threads at once).
+
+    :return
+    workbook: An open openpyxl.Workbook for zipped workbooks where pandas can read them with openpyxl, and an open
+        xlrd.Book otherwise. Call close_workbook on it when done.
+
+    :raises
+    zlib.error: if the workbook is corrupt (eg., its zip archive can't be decompressed).
+    """
+    path = os.path.abspath(path)
+    if PANDAS_READS_OPENPYXL and path.lower().endswith(ZIPPED_EXCEL_EXTS):
+        return open_zipped_workbook(path, read_only=on_demand)
+
+    check_workbook_archive(path)
+    # xlrd decompresses the archive members while parsing them, so a damaged member surfaces here as a zlib.error.
+    # (pd.read_excel won't raise an Exception for it on its own. Thanks to https://stackoverflow.com/a/28645601)
+    return xlrd.open_workbook(path, on_demand=on_demand)
+
+
+def excel_engine(workbook):
+    """Return the name of the pd.read_excel engine that reads a workbook opened by open_workbook."""
+    return 'xlrd' if isinstance(workbook, xlrd.Book) else 'openpyxl'
+
+
+def workbook_sheet_names(workbook):
+    """Return the names of the worksheets of a workbook opened by open_workbook, in workbook order."""
+    return workbook.sheet_names() if isinstance(workbook, xlrd.Book) else workbook.sheetnames
+
+
+def close_workbook(workbook):
+    """Release the file and memory held by a workbook opened by open_workbook."""
+    if isinstance(workbook, xlrd.Book):
+        workbook.release_resources()
+    else:
+        workbook.close()
+
 
 def import_excel_data(path, **kwargs):
     """
@@ -21,17 +251,149 @@ def import_excel_data(path, **kwargs):
     :return
     df: A pd.DataFrame instance containing the pertinent data in the Excel Workbook.
     ret: A RETVAL status corresponding to the outcome of the function
+
+    :raises
+    zlib.error: if the workbook is corrupt.
     """
 
-    # First, form the file's URI, which pandas needs in order to read the file.
+    # Open the workbook once, then hand the parsed book straight to pandas so that it doesn't read the file again.
+    workbook = open_workbook(path)
+    try:
+        df = pd.read_excel(workbook, engine=excel_engine(workbook), **kwargs)
+    finally:
+        close_workbook(workbook)
 
-    path = os.path.abspath(path)
-    fname = pathlib.Path(path).as_uri()
+    # If the above passes, then we have a valid DataFrame and can return it to the user.
+    return df, main.RETVAL.SUCCESS
 
-    # Now, pass along the file name to pandas, along with any options the user specified:
-    df = pd.read_excel(fname, **kwargs)
 
-    # If the above passes, then we have a valid DataFrame and can return it to the user.
+def import_excel_sheets(path, max_workers=None, **kwargs):
+    """
+    Imports every worksheet of a Microsoft Excel workbook (eg., one sheet per year) into a single pd.DataFrame.
+    The sheets are converted concurrently in a thread pool, checked against the 'Date'/'Miles' layout, and concatenated
+    in date order.
+    :param
+    path: The (relative) path to a Microsoft Excel workbook.
+    max_workers: Number of threads to use. Defaults to one per worksheet, up to ThreadPoolExecutor's limit.
+
+    :return
+    df: A pd.DataFrame instance containing the data from all the worksheets.
+    ret: A RETVAL status corresponding to the outcome of the function
+
+    :raises
+    zlib.error: if the workbook is corrupt.
+    ValueError: if a worksheet doesn't hold a valid mileage table.
+    """
+    kwargs.pop('sheet_name', None)
+
+    # Load every sheet while opening the workbook, so that the threads below only ever read from it.
+    workbook = open_workbook(path, on_demand=False)
+    try:
+        def read_sheet(sheet_name):
+            df = pd.read_excel(workbook, engine=excel_engine(workbook), sheet_name=sheet_name, **kwargs)
+            # Entirely blank sheets (eg., a spare sheet for next year) are skipped rather than rejected.
+            if df.empty and len(df.columns) == 0:
+                return None
+            validate_mileage_data(df, source="Sheet '{}'".format(sheet_name))
+            return df
+
+        sheet_names = workbook_sheet_names(workbook)
+        with ThreadPoolExecutor(max_workers=max_workers or len(sheet_names)) as pool:
+            frames = [df for df in pool.map(read_sheet, sheet_names) if df is not None]
+    finally:
+        close_workbook(workbook)
+
+    if not frames:
+        raise ValueError("Workbook does not contain any mileage data.")
+
+    # Put the sheets in date order before concatenating, so that the combined table only needs sorting (and hence a
+    # second copy) when the sheets' date ranges overlap.
+    frames.sort(key=lambda df: df['Date'].min())
+    df = pd.concat(frames, ignore_index=True, copy=False)
+    if not df['Date'].is_monotonic_increasing:
+        df.sort_values('Date', kind='mergesort', inplace=True)
+        df.reset_index(drop=True, inplace=True)
+
+    return df, main.RETVAL.SUCCESS
+
+
+def validate_mileage_data(df, source="Input"):
+    """
+    Check that a freshly-loaded DataFrame has the 'Date'/'Miles' layout that the rest of the program expects.
+    :param
+    df: The pd.DataFrame to check.
+    source: Description of where the data came from, for the error message.
+
+    :raises
+    ValueError: if a column is missing or has the wrong type.
+    """
+    for column in ('Date', 'Miles'):
+        if column not in df.columns:
+            raise ValueError("{} has no '{}' column.".format(source, column))
+    if not pd.api.types.is_datetime64_any_dtype(df['Date']):
+        raise ValueError("{} has values in its 'Date' column that are not dates.".format(source))
+    if not pd.api.types.is_numeric_dtype(df['Miles']):
+        raise ValueError("{} has values in its 'Miles' column that are not numbers.".format(source))
+    for column in fuel_columns(df):
+        if not pd.api.types.is_numeric_dtype(df[column]):
+            raise ValueError("{} has values in its '{}' column that are not numbers.".format(source, column))
+
+
+def fuel_columns(df):
+    """Return the names of the optional FUEL_COLUMNS that a mileage DataFrame has, in the order of FUEL_COLUMNS."""
+    return [column for column in FUEL_COLUMNS if column in df.columns]
+
+
+def summed_columns(df):
+    """Return the columns of a mileage DataFrame, besides 'Miles', that add up over a day: fuel and the trip count."""
+    return fuel_columns(df) + [column for column in (TRIPS_COLUMN,) if column in df.columns]
+
+
+def import_csv_data(path, sep=',', skiprows=0, usecols="A:B", date_format=DEFAULT_DATE_FORMAT):
+    """
+    Imports a delimited text file (eg., CSV or TSV) into a pd.DataFrame object, using pandas' C parser.
+    :param
+    path: The (relative) path to the delimited text file. Its first row (after skiprows) must be a header.
+    sep: The field delimiter.
+    skiprows: Number of rows to skip before the header row.
+    usecols: A:B-style range of columns to include.
+    date_format: strftime-style format of the 'Date' column.
+
+    :return
+    df: A pd.DataFrame instance containing the pertinent data in the file.
+    ret: A RETVAL status corresponding to the outcome of the function
+
+    :raises
+    ValueError: if a date or mileage value can't be parsed.
+    """
+    dtypes = dict({'Date': str, 'Miles': MILES_DTYPE}, **{column: MILES_DTYPE for column in FUEL_COLUMNS})
+    df = pd.read_csv(os.path.abspath(path), sep=sep, skiprows=int(skiprows), usecols=usecols_to_positions(usecols),
+                     dtype=dtypes, engine='c')
+    df['Date'] = pd.to_datetime(df['Date'], format=date_format)
+    return df, main.RETVAL.SUCCESS
+
+
+def import_ndjson_data(path, date_format=DEFAULT_DATE_FORMAT):
+    """
+    Imports a newline-delimited JSON file, with one {"Date": ..., "Miles": ...} record per line, into a pd.DataFrame.
+    Records may also hold any of the optional FUEL_COLUMNS, eg., {"Date": ..., "Miles": ..., "Gallons": ...}.
+    :param
+    path: The (relative) path to the NDJSON file.
+    date_format: strftime-style format of the "Date" values.
+
+    :return
+    df: A pd.DataFrame instance with 'Date' and 'Miles' columns, and any of the FUEL_COLUMNS found.
+    ret: A RETVAL status corresponding to the outcome of the function
+
+    :raises
+    ValueError: if a date or mileage value can't be parsed.
+    """
+    records = pd.read_json(os.path.abspath(path), lines=True, orient='records', convert_dates=False,
+                           dtype=dict({'Date': str, 'Miles': MILES_DTYPE},
+                                      **{column: MILES_DTYPE for column in FUEL_COLUMNS}))
+    columns = ['Date', 'Miles'] + fuel_columns(records)
+    df = pd.DataFrame(dict({'Date': pd.to_datetime(records['Date'], format=date_format)},
+                           **{column: records[column] for column in columns[1:]}), columns=columns)
     return df, main.RETVAL.SUCCESS
 
 
@@ -41,18 +403,44 @@ def establish_relevant_columns(df):
 
     :type df: pd.DataFrame
     :param
-    df: A pd.DataFrame object that has exactly two columns: 'Date' containing DateTime values, and 'Miles' containing floats.
+    df: A pd.DataFrame object that has two columns: 'Date' containing DateTime values, and 'Miles' containing floats,
+        and optionally any of the FUEL_COLUMNS.
 
     :return
-    A pd.DataFrame instance with 'Date', 'Year', 'Month', 'DayOfWeek', and 'Miles' columns
+    A pd.DataFrame instance with 'Date', 'Year', 'Month', 'DayOfWeek', and 'Miles' columns (and any FUEL_COLUMNS).
+    'DayOfWeek' and 'Month' are ordered categoricals (see DAY_OF_WEEK_LABELS and MONTH_LABELS), so each row holds a
+    small integer code rather than its own copy of the label.
     """
 
-    # First, drop NA values from the Miles column
-    df.dropna(axis=0, how='any', subset=['Miles'], inplace=True)
+    # First, drop NA values from the Miles column. Even in place, dropna copies every column, so only when there are
+    # any.
+    if df['Miles'].hasnans:
+        df.dropna(axis=0, how='any', subset=['Miles'], inplace=True)
 
     # Next, establish year, name-of-month, an name-of-day columns in the dataframe.
-    df['DayOfWeek'] = df['Date'].dt.strftime('(%w): %A')
-    df['Month'] = df['Date'].dt.strftime('(%m): %B')
-    df['Year'] = df['Date'].dt.year
+    # The labels are looked up from the integer calendar fields rather than formatted row by row. pandas numbers the
+    # days of the week from Monday, whereas %w (and hence DAY_OF_WEEK_LABELS) starts on Sunday.
+    dates = df['Date'].dt
+    df['DayOfWeek'] = pd.Categorical.from_codes(_calendar_codes(dates.dayofweek, shift=1, modulus=7),
+                                                DAY_OF_WEEK_LABELS, ordered=True)
+    df['Month'] = pd.Categorical.from_codes(_calendar_codes(dates.month, shift=-1), MONTH_LABELS, ordered=True)
+    years = dates.year
+    df['Year'] = years if years.hasnans else years.astype(YEAR_DTYPE)
 
     return df
+
+
+def _calendar_codes(field, shift=0, modulus=None):
+    """
+    Convert an integer calendar field (eg., Series.dt.month) into int8 categorical codes.
+    :param field: a pd.Series of calendar numbers, with NaN where the date is missing
+    :param shift: amount added to each number
+    :param modulus: if given, the shifted numbers are wrapped around modulo this
+    :return: an np.ndarray of int8 codes, with -1 (ie., a missing category) where the date is missing
+    """
+    missing = field.isnull().values
+    codes = field.fillna(0).values.astype(np.int8) + np.int8(shift)
+    if modulus is not None:
+        codes %= modulus
+    codes[missing] = -1
+    return codes
@@ -8,13 +8,19 @@ Handles data plotting.
 
 import matplotlib.pyplot as plt
 import os
-import numpy as np
 from pandas import DateOffset
 
+import pivot_engine
+import rolling_stats
+
 # Going to make relevant for the mileage charts:
 # (1) Daily mileage usage for the last 30 days.
 # (2) Barchart showing pivot report of median miles by day of week and year
 # (3) Barchart showing pivot report of median miles by month and year
+# (4) Line chart of trailing-window average daily mileage
+# and, for logs with fuel columns (see load_data.FUEL_COLUMNS):
+# (5) Barchart of fuel economy by month and year
+# (6) Barchart of spend by month and year
 
 # Global Options
 CURR_DIR = os.getcwd()
@@ -25,11 +31,12 @@ plt.style.use('seaborn')
 plt.tight_layout()
 
 
-def save_daily_usage_plot(df, outpath):
+def save_daily_usage_plot(df, outpath, pivots=None):
     """
     Save a line chart showing the last 30 days of mileage usage.
     :param df: the data frame containing a datetime column and "mileage" column.
     :param outpath: path (including file extension) where plot should be saved
+    :param pivots: unused; accepted so that every plotter can be called the same way
     :return:
     """
 
@@ -43,36 +50,84 @@ def save_daily_usage_plot(df, outpath):
     plt.savefig(outpath, dpi=OUTPUT_DPI, bbox_inches='tight')
 
 
-def save_median_day_year(df, outpath):
+def save_median_day_year(df, outpath, pivots=None):
     """
     Save a bar chart showing representing a pivot table report of median mileage usage by day of week and year
     :type df: pd.DataFrame
     :param df: the mileage data frame containing Month and Day columns (with each entry prepended with the appropriate month or day number) and "Miles" column.
     :param outpath: path (including file extension) where plot should be saved
+    :param pivots: the pivot_engine.PivotResults for df, if already computed
     :return:
     """
-    pvt_median_month_day = df.pivot_table(values='Miles', index='DayOfWeek', columns='Year', aggfunc=np.median
-                                          )
+    pivots = pivots or pivot_engine.get_pivots(df)
+    pvt_median_month_day = pivots.pivot_table('DayOfWeek', 'Median')
     plot1 = pvt_median_month_day.plot(kind='bar', title='Median Mileage by Month and Day of Week', grid=True)
     plot1.set(xlabel='Day of Week', ylabel='Median Miles Driven')
     plt.savefig(outpath, dpi=OUTPUT_DPI, bbox_inches='tight')
 
 
-def save_median_month_year(df, outpath):
+def save_median_month_year(df, outpath, pivots=None):
     """
     Save a bar chart showing representing a pivot table report of median mileage usage by month and year
     :type df: pd.DataFrame
     :param df: the mileage data frame containing Month and Day columns (with each entry prepended with the appropriate month or day number) and "Miles" column.
     :param outpath: path (including file extension) where plot should be saved
+    :param pivots: the pivot_engine.PivotResults for df, if already computed
     :return:
     """
-    pvt_median_month_year = df.pivot_table(values='Miles', index='Month', columns='Year', aggfunc=np.median
-                                           )
+    pivots = pivots or pivot_engine.get_pivots(df)
+    pvt_median_month_year = pivots.pivot_table('Month', 'Median')
     plot1 = pvt_median_month_year.plot(kind='bar', title='Median Mileage by Month and Year', grid=True)
     plot1.set(xlabel='Day of Week', ylabel='Median Miles Driven')
     plt.savefig(outpath, dpi=OUTPUT_DPI, bbox_inches='tight')
 
 
+def save_rolling_averages(df, outpath, pivots=None):
+    """
+    Save a line chart showing the average daily mileage over each trailing window (eg., the last 30 days) on every day.
+    :type df: pd.DataFrame
+    :param df: the mileage data frame containing a datetime column and "Miles" column.
+    :param outpath: path (including file extension) where plot should be saved
+    :param pivots: unused; accepted so that every plotter can be called the same way
+    :return:
+    """
+    rolling = rolling_stats.rolling_frame(df)
+    averages = rolling[['{}-Day Average'.format(window) for window in rolling_stats.WINDOWS]]
+    plot1 = averages.plot(title='Trailing Average Daily Mileage', grid=True)
+    plot1.set(xlabel='Date', ylabel='Average Miles Driven per Day')
+    plt.savefig(outpath, dpi=OUTPUT_DPI, bbox_inches='tight')
+
+
+def save_mpg_month_year(df, outpath, pivots=None):
+    """
+    Save a bar chart of the fuel economy (miles per gallon) of each month and year
+    :type df: pd.DataFrame
+    :param df: the mileage data frame containing Month, Miles and Gallons columns.
+    :param outpath: path (including file extension) where plot should be saved
+    :param pivots: the pivot_engine.PivotResults for df, if already computed
+    :return:
+    """
+    pivots = pivots or pivot_engine.get_pivots(df)
+    plot1 = pivots.pivot_table('Month', 'MPG').plot(kind='bar', title='Fuel Economy by Month and Year', grid=True)
+    plot1.set(xlabel='Month', ylabel='Miles per Gallon')
+    plt.savefig(outpath, dpi=OUTPUT_DPI, bbox_inches='tight')
+
+
+def save_spend_month_year(df, outpath, pivots=None):
+    """
+    Save a bar chart of the money spent in each month and year
+    :type df: pd.DataFrame
+    :param df: the mileage data frame containing Month and Cost columns.
+    :param outpath: path (including file extension) where plot should be saved
+    :param pivots: the pivot_engine.PivotResults for df, if already computed
+    :return:
+    """
+    pivots = pivots or pivot_engine.get_pivots(df)
+    plot1 = pivots.pivot_table('Month', 'Spend').plot(kind='bar', title='Monthly Spend by Month and Year', grid=True)
+    plot1.set(xlabel='Month', ylabel='Spend')
+    plt.savefig(outpath, dpi=OUTPUT_DPI, bbox_inches='tight')
+
+
 plot_info = {
     'dailyUsage': {
         'Name': 'Daily Mileage Usage',
@@ -92,15 +147,54 @@ plot_info = {
         'filename': 'median_month_year',
         'func': save_median_month_year,
     },
+    'rolling_averages': {
+        'Name': 'Trailing Average Daily Mileage',
+        'Desc': 'Average daily mileage over the last {} days'.format(
+            ', '.join(str(window) for window in rolling_stats.WINDOWS)),
+        'filename': 'rolling_averages',
+        'func': save_rolling_averages,
+    },
 }
 
+# Plots of the fuel columns, made only for logs that have the pivot_engine.FUEL_METRICS table named by 'requires'
+fuel_plot_info = {
+    'mpg_month_year': {
+        'Name': 'Fuel Economy By Month and Year',
+        'Desc': 'Miles driven per gallon of fuel bought, by month and year',
+        'filename': 'mpg_month_year',
+        'func': save_mpg_month_year,
+        'requires': 'MPG',
+    },
+    'spend_month_year': {
+        'Name': 'Monthly Spend By Month and Year',
+        'Desc': 'Money spent in each month and year',
+        'filename': 'spend_month_year',
+        'func': save_spend_month_year,
+        'requires': 'Spend',
+    },
+}
+
+
+def plots_for(pivots):
+    """
+    Pick the plots that can be made for a mileage log.
+    :param pivots: the pivot_engine.PivotResults for the log
+    :return: a dict like plot_info, with the fuel_plot_info entries that the log has the columns for
+    """
+    plot_config = dict(plot_info)
+    metrics = pivots.fuel_metrics()
+    plot_config.update((plot_id, info) for plot_id, info in fuel_plot_info.items() if info['requires'] in metrics)
+    return plot_config
+
 
-def write_all_plots(df, plot_config):
+def write_all_plots(df, plot_config, pivots=None):
     """
     Write out all configured plots to the appropriate place on disk
     :param df: the mileage dataframe containing at least Miles, Month, and Day columns (with each Month and Day value prepended with the appropriate month or day number).
+    :param pivots: the pivot_engine.PivotResults for df, shared by all of the plots. Built here if not given.
     :return:
     """
+    pivots = pivots or pivot_engine.get_pivots(df)
 
     # Make output directory if it doesn't already exist
     if not os.path.isdir(IMG_DIR):
@@ -109,6 +203,7 @@ def write_all_plots(df, plot_config):
     for plotID, singleplot_info in plot_config.items():
         # Write out the plot to the correct location
         out_path = r"".join([os.path.join(IMG_DIR, singleplot_info['filename']), OUTPUT_EXT])
-        singleplot_info['func'](df, out_path)  # Call plotter
+        singleplot_info['func'](df, out_path, pivots=pivots)  # Call plotter
+        plt.close('all')  # Free each figure once saved; pyplot keeps them all open otherwise.
 
         print("""Exported plot "{}" at {}""".format(singleplot_info['Name'], out_path))
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+memoryBudget.py
+A small command-line tool to calculate mileage statistics for a personally-owned vehicle.
+
+Handles the peak-memory budget of a run, and the measurement of the memory each stage of a run takes.
+
+The peak memory of loading a log and reporting on it is projected from the size of the input files, from how many bytes
+of memory each byte of input takes at the peak in each format (measured with tracemalloc over the load, pivot and
+statistics stages). When the projection exceeds the budget, the run is switched to the chunked (streaming) path, with
+chunks small enough to stay within it.
+
+StageTracker measures the peak memory of each stage of a run with tracemalloc. Only memory allocated by this process is
+seen, so a fleet's input files, which are loaded in worker processes, count only once they are combined.
+"""
+
+import os
+import tracemalloc
+from collections import OrderedDict
+
+import load_data
+
+# Global Options
+# Peak bytes of memory per byte of input file, by input format (see load_data.FORMATS). Excel workbooks are compressed,
+# and parsed into Python objects, so they take by far the most.
+PEAK_BYTES_PER_INPUT_BYTE = {
+    'csv': 4.0,
+    'tsv': 4.0,
+    'ndjson': 17.0,
+    'excel': 40.0,
+}
+# Peak bytes of memory per row of a chunk in streaming mode, for the slowest (Excel) reader
+STREAM_BYTES_PER_ROW = 1000
+# Smallest chunk that a budget will shrink streaming mode to; smaller chunks only add overhead.
+MIN_CHUNKSIZE = 1000
+
+MEGABYTE = 1024 * 1024
+
+
+def projected_peak(paths, fmt=None):
+    """
+    Project the peak memory of loading some input files whole and reporting on them.
+    :param paths: paths to the input files. Missing files are skipped.
+    :param fmt: the input format (one of load_data.FORMATS), or None to pick it from each file extension
+    :return: the projected peak, in bytes
+    """
+    return sum(os.path.getsize(path) * PEAK_BYTES_PER_INPUT_BYTE[load_data.detect_format(path, fmt)]
+               for path in paths if os.path.isfile(path))
+
+
+def fitting_chunksize(budget, chunksize):
+    """
+    Shrink a streaming chunk size so that a chunk fits in a memory budget.
+    :param budget: the memory budget, in bytes
+    :param chunksize: the requested number of rows per chunk
+    :return: the number of rows per chunk, no more than chunksize and no less than MIN_CHUNKSIZE
+    """
+    return max(MIN_CHUNKSIZE, min(chunksize, int(budget // STREAM_BYTES_PER_ROW)))
+
+
+class StageTracker(object):
+    """
+    Peak traced memory of each stage of a run, as measured by tracemalloc.
+
+    Each call to start_stage ends the previous stage. On Python 3.9 and later, the peak of each stage is exact. Older
+    versions can only reset the peak by forgetting the traces so far, so the memory held at the start of a stage is
+    carried over by hand; memory freed in a stage but allocated before it is then still counted, which makes the peak
+    an upper bound.
+    """
+
+    def __init__(self, enabled=True):
+        """
+        :param enabled: whether to measure anything. A disabled tracker never starts tracemalloc, which slows down
+            every allocation while it runs.
+        """
+        self.enabled = enabled
+        self.stages = OrderedDict()
+        self._stage = None
+        self._held = 0
+
+    def start_stage(self, name):
+        """
+        End the current stage (if any), and start measuring a new one.
+        :param name: name of the stage, eg., 'Load'
+        """
+        if not self.enabled:
+            return
+        self._end_stage()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        else:
+            self._held += tracemalloc.get_traced_memory()[0]
+            tracemalloc.clear_traces()
+        self._stage = name
+
+    def finish(self):
+        """
+        End the current stage and stop tracing.
+        :return: an OrderedDict of {stage name: peak traced memory in bytes}, in the order the stages ran
+        """
+        if self.enabled and tracemalloc.is_tracing():
+            self._end_stage()
+        self.stop()
+        return self.stages
+
+    def stop(self):
+        """Stop tracing without recording the current stage, eg., when a run fails part way through. Safe to repeat."""
+        if self.enabled and tracemalloc.is_tracing():
+            self._stage = None
+            tracemalloc.stop()
+
+    def _end_stage(self):
+        """Record the peak of the current stage."""
+        if self._stage is not None:
+            self.stages[self._stage] = self._held + tracemalloc.get_traced_memory()[1]
+            self._stage = None
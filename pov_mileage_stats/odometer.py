@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+odometer.py
+A small command-line tool to calculate mileage statistics for a personally-owned vehicle.
+
+Handles logs of cumulative odometer readings taken at irregular times, turning them into the daily 'Date'/'Miles' log
+that the rest of the program expects.
+
+The readings are put in date order and differenced. The distance between two readings is spread over the calendar days
+after the first reading up to and including the day of the second, either evenly ('linear') or in proportion to how far
+the vehicle is usually driven on each day of the week ('proportional', estimated from readings taken on consecutive
+days). The spreading is done with difference arrays and cumulative sums, so the whole conversion runs in linear time
+once the readings are sorted.
+
+A reading lower than the one before is either a rollover (the odometer wrapped around from nearly 10**n back to near
+zero), which is corrected for, or a reset (eg., a replaced instrument cluster or a mistyped reading), across which the
+distance is unknown. Days covered only by resets are left out of the daily log.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Global Options
+SPREADS = ('linear', 'proportional')
+DEFAULT_SPREAD = 'linear'
+# A drop in the readings is a rollover if the reading before it was within this fraction of the next power of ten, and
+# the reading after it is within the same fraction of zero.
+ROLLOVER_FRACTION = 0.1
+
+# Column holding the readings. Logs that name it 'Miles' (like a daily log) are read the same way.
+READING_COLUMN = 'Odometer'
+
+
+def readings_to_daily(df, spread=DEFAULT_SPREAD):
+    """
+    Convert a log of odometer readings into a log of the miles driven each day.
+    :type df: pd.DataFrame
+    :param df: a DataFrame with a 'Date' column and the readings in an 'Odometer' (or 'Miles') column
+    :param spread: how the distance between readings days apart is spread over the days between them; one of SPREADS
+    :return: a tuple of (a pd.DataFrame with one 'Date'/'Miles' row per day covered by the readings, in date order, and
+        an OrderedDict of the number of 'readings', 'rollovers' and 'resets' found)
+
+    :raises
+    ValueError: if spread is not one of SPREADS.
+    """
+    if spread not in SPREADS:
+        raise ValueError("The odometer spread must be one of {}, not {}.".format(', '.join(SPREADS), spread))
+
+    column = READING_COLUMN if READING_COLUMN in df.columns else 'Miles'
+    dates = df['Date'].values
+    readings = np.asarray(df[column].values, dtype=float)
+    usable = ~np.isnat(dates) & ~np.isnan(readings)
+    days = dates[usable].astype('datetime64[D]').astype(np.int64)
+    readings = readings[usable]
+    if len(days) > 1 and (days[1:] < days[:-1]).any():
+        order = np.argsort(days, kind='mergesort')
+        days, readings = days[order], readings[order]
+
+    info = OrderedDict([('readings', len(readings)), ('rollovers', 0), ('resets', 0)])
+    if len(readings) < 2:
+        return pd.DataFrame({'Date': pd.to_datetime([]), 'Miles': np.zeros(0)}, columns=['Date', 'Miles']), info
+
+    distances = np.diff(readings)
+    dropped = distances < 0
+    if dropped.any():
+        before, after = readings[:-1][dropped], readings[1:][dropped]
+        # The power of ten the odometer wraps around at, judging from the reading before the drop.
+        modulus = 10 ** np.ceil(np.log10(np.maximum(before, 1) + 1))
+        rollover = (before >= (1 - ROLLOVER_FRACTION) * modulus) & (after < ROLLOVER_FRACTION * modulus)
+        distances[np.flatnonzero(dropped)[rollover]] += modulus[rollover]
+        distances[np.flatnonzero(dropped)[~rollover]] = np.nan
+        info['rollovers'], info['resets'] = int(rollover.sum()), int((~rollover).sum())
+
+    # Interval i runs from the day of reading i (exclusive) to the day of reading i + 1 (inclusive), or is just that
+    # day if both readings were taken on the same day. Day numbers are counted from the first reading's day.
+    first = days[0]
+    n_days = days[-1] - first + 1
+    starts = days[:-1] - first + 1
+    stops = days[1:] - first + 1
+    gaps = stops - starts
+    starts[gaps == 0] -= 1
+    known = ~np.isnan(distances)
+
+    weights = _day_weights(first, n_days, starts, distances, known & (gaps == 1)) if spread == 'proportional' else \
+        np.ones(n_days)
+    cumulative = np.concatenate([[0.0], np.cumsum(weights)])
+    totals = cumulative[stops] - cumulative[starts]
+    # Intervals whose days all have zero weight (eg., a weekend gap for a weekday-only driver) are spread evenly.
+    even = known & (totals <= 0)
+    rates = np.where(even, distances / np.maximum(stops - starts, 1), distances / np.where(totals > 0, totals, 1))
+
+    uneven = known & ~even
+    miles = weights * _interval_sum(starts[uneven], stops[uneven], rates[uneven], n_days)
+    miles += _interval_sum(starts[even], stops[even], rates[even], n_days)
+    covered = _interval_sum(starts[known], stops[known], np.ones(known.sum()), n_days) > 0
+
+    daily = pd.DataFrame({'Date': (first + np.flatnonzero(covered)).astype('datetime64[D]').astype('datetime64[ns]'),
+                          'Miles': miles[covered]}, columns=['Date', 'Miles'])
+    return daily, info
+
+
+def _interval_sum(starts, stops, rates, n_days):
+    """
+    Add rates[i] to every day from starts[i] up to (but not including) stops[i], by a difference array and a cumulative
+    sum.
+    :return: a float array of length n_days
+    """
+    rises = np.bincount(starts, weights=rates, minlength=n_days + 1)
+    falls = np.bincount(stops, weights=rates, minlength=n_days + 1)
+    return np.cumsum((rises - falls)[:n_days])
+
+
+def _day_weights(first, n_days, starts, distances, single):
+    """
+    Weight each calendar day by the average distance driven on its day of the week, as measured by the intervals that
+    cover exactly one day (readings taken on consecutive days). Without any such interval, every day weighs the same.
+    """
+    weekdays = (first + np.arange(n_days) + 4) % 7  # 1970-01-01 was a Thursday; 0 is Sunday.
+    if not single.any():
+        return np.ones(n_days)
+    single_weekdays = weekdays[starts[single]]
+    counts = np.bincount(single_weekdays, minlength=7)
+    profile = np.bincount(single_weekdays, weights=distances[single], minlength=7) / np.maximum(counts, 1)
+    # Weekdays never measured get the average weight of the measured ones.
+    profile[counts == 0] = profile[counts > 0].mean()
+    return profile[weekdays]
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+pivotEngine.py
+A small command-line tool to calculate mileage statistics for a personally-owned vehicle.
+
+Handles the pivot table reports shared by the stdout report, the HTML report and the plots.
+
+Each (index, 'Year') grouping of the mileage log is made only once, and all of the report statistics are computed from
+it together. Categorical indexes (the month and day-of-week columns) go through the NumPy kernels in pivot_kernels;
+anything else falls back to pandas' built-in groupby reductions. The tables are laid out exactly as
+df.pivot_table(values='Miles', index=index, columns='Year', aggfunc=...) would lay them out.
+
+When the log has any of the optional fuel columns (see load_data.FUEL_COLUMNS), they are totalled per cell in the same
+pass, from the same cell ids, and the fuel economy and cost tables in FUEL_METRICS are derived from those totals.
+
+get_pivots memoizes the results per data frame, so that every part of the program asking for the same pivot table of
+the same data gets the one already computed. cache_info reports how often that happened.
+"""
+
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import pandas as pd
+
+import load_data
+import pivot_kernels
+
+# Statistics computed for every pivot table: report name -> name of the pivot_kernels / pandas groupby reduction
+AGGREGATIONS = OrderedDict([
+    ('Mean', 'mean'),
+    ('Median', 'median'),
+    ('Max', 'max'),
+    ('Min', 'min'),
+])
+
+# Tables derived from the per-cell totals of the mileage and fuel columns: report name -> (numerator, denominator),
+# where a denominator of None gives the plain total. A table is only made when the log has the columns it needs.
+FUEL_METRICS = OrderedDict([
+    ('MPG', ('Miles', 'Gallons')),
+    ('Cost per Mile', ('Cost', 'Miles')),
+    ('Spend', ('Cost', None)),
+])
+
+# Column label of every pivot table
+PVT_COLUMNS = 'Year'
+
+# Number of data frames whose pivot results are kept by get_pivots. Least-recently-used ones are dropped beyond this.
+MAX_CACHED_FRAMES = 8
+
+# Memoization state: (id(df), values, columns) -> (frame version, PivotResults), in least-recently-used order
+_registry = OrderedDict()
+_counters = {'hits': 0, 'misses': 0}
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class PivotResults(object):
+    """
+    Pivot tables of a mileage DataFrame, grouped by an index column (eg., 'Month' or 'DayOfWeek') and by 'Year'.
+
+    The grouping for an index is made the first time one of its tables is asked for, and all of the statistics in
+    AGGREGATIONS are computed from it in the same pass. Later requests for that index are served from the stored
+    result.
+    """
+
+    def __init__(self, df, values='Miles', columns=PVT_COLUMNS):
+        """
+        :type df: pd.DataFrame
+        :param df: the mileage data frame, as returned by load_data.establish_relevant_columns
+        :param values: name of the column to aggregate
+        :param columns: name of the column whose values become the pivot table columns
+        """
+        self.df = df
+        self.values = values
+        self.columns = columns
+        # Fuel metrics are only derived alongside the mileage.
+        self.fuel_columns = load_data.fuel_columns(df) if values == 'Miles' else []
+        self._aggregated = {}
+        self._tables = {}
+
+    def aggregate(self, index):
+        """
+        Group the data by (index, columns) once and compute every statistic in AGGREGATIONS, and every table of
+        fuel_metrics.
+        :param index: name of the column whose values become the pivot table rows
+        :return: a pd.DataFrame with one row per non-empty (index, columns) group and one column per statistic
+        """
+        if index not in self._aggregated:
+            if pd.api.types.is_categorical_dtype(self.df[index]):
+                self._aggregated[index] = self._aggregate_cells(index)
+            else:
+                grouped = self.df.groupby([index, self.columns])
+                aggregated = grouped[self.values].agg(list(AGGREGATIONS.values()))
+                aggregated.columns = list(AGGREGATIONS.keys())
+                if self.fuel_columns:
+                    totals = grouped[[self.values] + self.fuel_columns].sum()
+                    for aggname, table in self._derive_metrics(totals).items():
+                        aggregated[aggname] = table
+                self._aggregated[index] = aggregated.dropna(how='all')
+        return self._aggregated[index]
+
+    def fuel_metrics(self):
+        """Return the names of the tables of FUEL_METRICS that the data frame has the columns for."""
+        return [aggname for aggname, (numerator, denominator) in FUEL_METRICS.items()
+                if {numerator, denominator or numerator} <= set([self.values] + self.fuel_columns)]
+
+    def _derive_metrics(self, totals):
+        """
+        Derive the fuel_metrics tables from per-cell totals.
+        :param totals: a mapping of {column name: per-cell totals}, with the mileage under self.values
+        :return: an OrderedDict of {table name: per-cell values}, NaN where the denominator is zero
+        """
+        metrics = OrderedDict()
+        for aggname in self.fuel_metrics():
+            numerator, denominator = FUEL_METRICS[aggname]
+            if denominator is None:
+                metrics[aggname] = totals[numerator]
+                continue
+            with np.errstate(invalid='ignore', divide='ignore'):
+                metrics[aggname] = totals[numerator] / totals[denominator]
+            metrics[aggname][totals[denominator] == 0] = np.nan
+        return metrics
+
+    def _aggregate_cells(self, index):
+        """
+        The NumPy version of aggregate, for a categorical index column. Only the non-empty cells are returned, as
+        pivot_table does.
+        """
+        labels = self.df[index].cat
+        ids, rows, col_labels = pivot_kernels.cell_ids(labels.codes.values, self.df[self.columns].values)
+        values = self.df[self.values].values
+        if rows is not None:
+            values = values[rows]
+        n_cells = len(labels.categories) * len(col_labels)
+        stats = pivot_kernels.aggregate(ids, values, n_cells)
+
+        filled = stats['count'].nonzero()[0]
+        row_codes, col_codes = divmod(filled, len(col_labels))
+        cells = pd.MultiIndex.from_arrays(
+            [pd.Categorical.from_codes(row_codes, labels.categories, ordered=labels.ordered), col_labels[col_codes]],
+            names=[index, self.columns])
+        tables = OrderedDict((aggname, stats[func][filled]) for aggname, func in AGGREGATIONS.items())
+
+        if self.fuel_columns:
+            # The fuel columns are totalled over the same cell ids; blank entries (eg., days without a fill-up) add 0.
+            totals = {self.values: stats['sum'][filled]}
+            for column in self.fuel_columns:
+                column_values = np.asarray(self.df[column].values, dtype=float)
+                if rows is not None:
+                    column_values = column_values[rows]
+                totals[column] = np.bincount(ids, weights=np.nan_to_num(column_values), minlength=n_cells)[filled]
+            tables.update(self._derive_metrics(totals))
+        return pd.DataFrame(tables, index=cells)
+
+    def pivot_table(self, index, aggname, fill_value=None):
+        """
+        Return one pivot table. Tables are memoized, so the same object is returned on every call with the same
+        arguments; treat it as read-only.
+        :param index: name of the column whose values become the pivot table rows (eg., 'Month')
+        :param aggname: name of the statistic, as in AGGREGATIONS (eg., 'Median')
+        :param fill_value: value for (index, year) cells that have no data, or None to leave them as NaN
+        :return: a pd.DataFrame with one row per index label and one column per year
+        """
+        key = (index, aggname, fill_value)
+        if key in self._tables:
+            _counters['hits'] += 1
+            return self._tables[key]
+
+        _counters['misses'] += 1
+        table = self.aggregate(index)[aggname].unstack(self.columns).sort_index(axis=1)
+        if fill_value is not None:
+            table = _downcast_integral(table.fillna(fill_value))
+        self._tables[key] = table.dropna(how='all', axis=1)
+        return self._tables[key]
+
+    def pivot_tables(self, index, fill_value=None):
+        """
+        Return every pivot table for one index.
+        :return: an OrderedDict of {statistic name: pd.DataFrame}, in the order of AGGREGATIONS
+        """
+        return OrderedDict((aggname, self.pivot_table(index, aggname, fill_value=fill_value))
+                           for aggname in AGGREGATIONS)
+
+
+def _downcast_integral(table):
+    """
+    Turn the float columns of a table that only hold whole numbers (eg., counts with their gaps filled) into integers.
+    pandas' fillna(downcast='infer') did this until it was removed.
+    :type table: pd.DataFrame
+    :return: a pd.DataFrame
+    """
+    integral = [column for column, values in table.items()
+                if values.dtype.kind == 'f' and np.isfinite(values.values).all()
+                and (values.values == np.floor(values.values)).all()]
+    if not integral:
+        return table
+    return table.astype({column: np.int64 for column in integral})
+
+
+def get_pivots(df, values='Miles', columns=PVT_COLUMNS):
+    """
+    Return the PivotResults for a data frame, reusing the one made by an earlier call for the same frame.
+
+    Frames are matched by identity and by a cheap version stamp (length, column names and the memory holding the values
+    column), so adding or replacing columns or rows gives a fresh result. Call clear_cache after changing values in
+    place.
+    :type df: pd.DataFrame
+    :param df: the mileage data frame, as returned by load_data.establish_relevant_columns
+    :param values: name of the column to aggregate
+    :param columns: name of the column whose values become the pivot table columns
+    :return: a PivotResults
+    """
+    key = (id(df), values, columns)
+    version = _frame_version(df, values)
+
+    entry = _registry.get(key)
+    if entry is not None and entry[1].df is df and entry[0] == version:
+        _registry.move_to_end(key)
+        return entry[1]
+
+    return register_pivots(PivotResults(df, values=values, columns=columns))
+
+
+def register_pivots(pivots):
+    """
+    Make get_pivots return the given results for their data frame, eg., ones answered from a precomputed cube.
+    :type pivots: PivotResults
+    :return: pivots
+    """
+    key = (id(pivots.df), pivots.values, pivots.columns)
+    _registry[key] = (_frame_version(pivots.df, pivots.values), pivots)
+    _registry.move_to_end(key)
+    while len(_registry) > MAX_CACHED_FRAMES:
+        _registry.popitem(last=False)
+    return pivots
+
+
+def cache_info():
+    """
+    Report how well pivot tables are being reused, in the style of functools.lru_cache.
+    :return: a CacheInfo of (hits, misses, maxsize, currsize), where hits and misses count pivot_table calls and
+        maxsize/currsize count data frames held by get_pivots
+    """
+    return CacheInfo(_counters['hits'], _counters['misses'], MAX_CACHED_FRAMES, len(_registry))
+
+
+def clear_cache():
+    """Forget every memoized pivot result and reset the hit/miss counters."""
+    _registry.clear()
+    _counters['hits'] = 0
+    _counters['misses'] = 0
+
+
+def _frame_version(df, values):
+    """A cheap stamp that changes when a frame's rows, columns or values block are replaced."""
+    return len(df), tuple(df.columns), df[values].values.__array_interface__['data'][0]
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+pivotKernels.py
+A small command-line tool to calculate mileage statistics for a personally-owned vehicle.
+
+Handles the NumPy kernels behind the pivot table reports.
+
+Each row's (index label, year) pair is turned into one flat integer cell id. Sums and counts per cell then come from
+np.bincount. A single argsort by cell id lays every cell out as a contiguous segment (skipped when the cell ids are
+already in order, eg., for the month tables of a date-ordered log within one year), from which the minimum and maximum
+of every cell come from np.minimum.reduceat / np.maximum.reduceat, and the median from a partial sort (np.partition) of
+each segment.
+"""
+
+import numpy as np
+
+
+def cell_ids(row_codes, col_values):
+    """
+    Number the cells of a (row, column) table.
+    :param row_codes: integer codes of each row's row label, from 0 to n_rows - 1, or -1 if missing
+    :param col_values: each row's column label (eg., its year); NaN if missing
+    :return: a tuple of (cell id of each usable row, indices of the usable rows or None if all rows are usable, column
+        labels); the cell id of (row code r, column label number c) is r * len(column labels) + c
+    """
+    row_codes = np.asarray(row_codes)
+    col_values = np.asarray(col_values)
+    usable = row_codes >= 0
+    if col_values.dtype.kind == 'f':
+        usable &= ~np.isnan(col_values)
+    rows = None if usable.all() else np.flatnonzero(usable)
+    if rows is not None:
+        row_codes, col_values = row_codes[rows], col_values[rows]
+
+    if col_values.dtype.kind in 'iu' and len(col_values):
+        # Integer labels (years) span a short range, so number them by offset instead of sorting them.
+        low = col_values.min()
+        col_labels = np.arange(low, col_values.max() + 1, dtype=col_values.dtype)
+        col_codes = col_values.astype(np.int64) - low
+    else:
+        col_labels, col_codes = np.unique(col_values, return_inverse=True)
+    ids = row_codes.astype(np.int64) * len(col_labels) + col_codes
+    return ids, rows, col_labels
+
+
+def aggregate(ids, values, n_cells):
+    """
+    Compute the count, sum, mean, median, maximum and minimum of the values in every cell.
+    :param ids: cell id of each value, from 0 to n_cells - 1
+    :param values: a 1-D float array containing no NaNs
+    :param n_cells: the number of cells
+    :return: a dict of {'count', 'sum', 'mean', 'median', 'max', 'min'}: 1-D arrays of length n_cells, NaN (or 0 for
+        counts and sums) in empty cells
+    """
+    values = np.asarray(values, dtype=float)
+    counts = np.bincount(ids, minlength=n_cells)
+    sums = np.bincount(ids, weights=values, minlength=n_cells)
+
+    # Lay each cell's values out in a contiguous segment.
+    if len(ids) > 1 and (ids[1:] < ids[:-1]).any():
+        values = values[np.argsort(ids)]
+    filled = counts.nonzero()[0]
+    starts = (np.cumsum(counts) - counts)[filled]
+    stops = starts + counts[filled]
+
+    stats = {'count': counts, 'sum': sums}
+    for name in ('mean', 'median', 'max', 'min'):
+        stats[name] = np.full(n_cells, np.nan)
+    if not len(filled):
+        return stats
+
+    stats['mean'][filled] = sums[filled] / counts[filled]
+    stats['min'][filled] = np.minimum.reduceat(values, starts)
+    stats['max'][filled] = np.maximum.reduceat(values, starts)
+    stats['median'][filled] = [segment_median(values[start:stop]) for start, stop in zip(starts, stops)]
+    return stats
+
+
+def segment_median(segment):
+    """
+    Median of one cell's values by partial sort, with the same convention as np.median: the two middle values are
+    averaged when the count is even.
+    """
+    middle = (len(segment) - 1) // 2
+    if len(segment) % 2:
+        return np.partition(segment, middle)[middle]
+    partitioned = np.partition(segment, [middle, middle + 1])
+    return (partitioned[middle] + partitioned[middle + 1]) / 2.0
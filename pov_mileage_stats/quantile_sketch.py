@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+quantileSketch.py
+A small command-line tool to calculate mileage statistics for a personally-owned vehicle.
+
+Handles approximate medians of unbounded streams of mileage values.
+
+KLLSketch is a mergeable quantile sketch (Karnin, Lang & Liberty, 2016). Values are kept in a stack of compactors;
+an item at level h stands for 2**h original values. When a level outgrows its capacity it is sorted and every other
+item (starting at a random offset) is promoted to the level above, halving its size. Capacities shrink geometrically
+towards the bottom of the stack, so a sketch holds O(k) items however many values it has seen, and two sketches merge
+by concatenating their levels and compacting again.
+"""
+
+import numpy as np
+
+# Global Options
+DEFAULT_K = 200
+MIN_CAPACITY = 2
+# Capacity ratio between neighbouring levels, as recommended by the KLL paper.
+COMPACTION_RATIO = 2.0 / 3.0
+# Empirical constant relating k to the normalized rank error: eps ~= ERROR_CONSTANT / k, with ~99% confidence.
+ERROR_CONSTANT = 3.3
+# Fixed seed, so that the same input always gives the same report.
+DEFAULT_SEED = 0
+
+
+def k_for_error(error):
+    """
+    Return the sketch size needed for a given normalized rank error.
+    :param error: the tolerated error in rank, as a fraction of the number of values (eg., 0.01 for 1%)
+    :return: an int k for KLLSketch
+
+    :raises
+    ValueError: if error is not between 0 and 0.5.
+    """
+    if not 0 < error < 0.5:
+        raise ValueError("The median error bound must be between 0 and 0.5, not {}.".format(error))
+    return max(MIN_CAPACITY, int(np.ceil(ERROR_CONSTANT / error)))
+
+
+class KLLSketch(object):
+    """
+    Approximate quantiles of a stream of values in O(k) memory.
+
+    The rank of any quantile returned is within about ERROR_CONSTANT / k of the true rank. Until the first compaction
+    every value is kept, and quantiles are exact.
+    """
+
+    def __init__(self, k=DEFAULT_K, seed=DEFAULT_SEED):
+        """
+        :param k: capacity of the top level. Larger is more accurate; see k_for_error.
+        :param seed: seed for the random compaction offsets
+        """
+        self.k = int(k)
+        self.count = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self.levels = [np.empty(0)]
+        self._rng = np.random.RandomState(seed)
+
+    def capacity(self, level):
+        """Number of items a level may hold before it is compacted."""
+        depth = len(self.levels) - level - 1
+        return max(MIN_CAPACITY, int(np.ceil(self.k * COMPACTION_RATIO ** depth)))
+
+    def update(self, values):
+        """
+        Fold an array of values into the sketch.
+        :param values: a 1-D array-like of floats containing no NaNs
+        :return:
+        """
+        values = np.asarray(values, dtype=float)
+        if len(values) == 0:
+            return
+        self.count += len(values)
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+
+    def merge(self, other):
+        """
+        Fold another KLLSketch into this one. The result is as accurate as a sketch of the combined stream.
+        :type other: KLLSketch
+        :return:
+        """
+        if not other.count:
+            return
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self._compress()
+
+    def _compress(self):
+        """Compact every level that is over capacity, from the bottom of the stack up."""
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self.capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                # Compact an even number of items, so that every promoted item stands for exactly two.
+                kept, items = items[len(items) - len(items) % 2:], items[:len(items) - len(items) % 2]
+                promoted = items[self._rng.randint(2)::2]
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+                self.levels[level] = kept
+            level += 1
+
+    def quantile(self, q):
+        """
+        Return the approximate q-quantile of the values seen so far.
+        :param q: a fraction between 0 and 1 (eg., 0.5 for the median)
+        :return: a float, or NaN if the sketch is empty
+        """
+        if not self.count:
+            return np.nan
+        if len(self.levels) == 1:
+            return float(np.percentile(self.levels[0], q * 100.0))
+
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 2 ** level) for level, items in enumerate(self.levels)])
+        order = np.argsort(values, kind='mergesort')
+        cumulative = np.cumsum(weights[order])
+        position = np.searchsorted(cumulative, q * cumulative[-1], side='left')
+        return float(values[order][min(position, len(values) - 1)])
+
+    @property
+    def median(self):
+        return self.quantile(0.5)
+
+    @property
+    def size(self):
+        """Number of items currently held by the sketch."""
+        return sum(len(items) for items in self.levels)
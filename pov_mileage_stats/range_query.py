@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+rangeQuery.py
+A small command-line tool to calculate mileage statistics for a personally-owned vehicle.
+
+Handles statistics of the mileage driven between two arbitrary dates.
+
+RangeQuery sorts the log by date once and builds a few indexes over it. A date range is turned into a slice of rows
+by binary search. The count, total and mean of the slice come from a prefix-sum array. The minimum and maximum come
+from per-block extremes, kept in a sparse table, plus a scan of the two partial blocks at the ends. The median comes
+from the blocks' sorted values, by binary search on the value whose rank in the slice is the middle one.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Global Options
+BLOCK_SIZE = 1024
+
+
+class RangeQuery(object):
+    """
+    Answers statistics queries over date ranges of a mileage log without rescanning it.
+    """
+
+    def __init__(self, df, block_size=BLOCK_SIZE):
+        """
+        :type df: pd.DataFrame
+        :param df: the mileage data frame, with 'Date' and 'Miles' columns and no missing mileage
+        :param block_size: number of rows per block of the min/max and median indexes
+        """
+        dates = df['Date'].values
+        miles = np.asarray(df['Miles'].values, dtype=float)
+        if not df['Date'].is_monotonic_increasing:
+            order = np.argsort(dates, kind='mergesort')
+            dates, miles = dates[order], miles[order]
+        self.dates = dates
+        self.miles = miles
+        self.block_size = block_size
+        self.prefix = np.concatenate([[0.0], np.cumsum(miles)])
+
+        # Pad the last block with NaNs (which nanmin and nanmax skip) so that the blocks form a 2-D array.
+        n_blocks = -(-len(miles) // block_size)
+        padded = np.full(n_blocks * block_size, np.nan)
+        padded[:len(miles)] = miles
+        blocks = padded.reshape(n_blocks, block_size)
+        self._min_table = _sparse_table(np.nanmin(blocks, axis=1) if n_blocks else np.zeros(0), np.minimum)
+        self._max_table = _sparse_table(np.nanmax(blocks, axis=1) if n_blocks else np.zeros(0), np.maximum)
+
+        # Ranks of the values among the distinct values, sorted within each block and offset by block number, so that
+        # one searchsorted over the flattened array counts the values below a rank in any run of whole blocks.
+        self.distinct = np.unique(miles)
+        ranks = np.searchsorted(self.distinct, miles)
+        block_of_row = np.arange(len(miles)) // block_size
+        self._rank_keys = np.sort(block_of_row * len(self.distinct) + ranks)
+
+    def bounds(self, start=None, end=None):
+        """
+        Find the rows dated within a range.
+        :param start: first day of the range (anything pd.Timestamp accepts), or None for the start of the log
+        :param end: last day of the range, inclusive, or None for the end of the log
+        :return: a (lo, hi) pair such that rows lo to hi - 1 fall in the range
+        """
+        lo = 0 if start is None else np.searchsorted(self.dates, pd.Timestamp(start).to_datetime64(), side='left')
+        hi = len(self.dates) if end is None else np.searchsorted(
+            self.dates, pd.Timestamp(end).to_datetime64(), side='right')
+        return int(lo), int(max(lo, hi))
+
+    def stats(self, start=None, end=None):
+        """
+        Compute statistics of the mileage driven within a date range.
+        :param start: first day of the range (anything pd.Timestamp accepts), or None for the start of the log
+        :param end: last day of the range, inclusive, or None for the end of the log
+        :return: an OrderedDict of 'count', 'total', 'mean', 'median', 'min' and 'max'. All but count and total are NaN
+            if no rows fall in the range.
+        """
+        lo, hi = self.bounds(start, end)
+        count = hi - lo
+        total = self.prefix[hi] - self.prefix[lo]
+        results = OrderedDict([('count', count), ('total', total)])
+        if not count:
+            results.update((name, np.nan) for name in ('mean', 'median', 'min', 'max'))
+            return results
+
+        results['mean'] = total / count
+        results['median'] = (self._kth(lo, hi, (count - 1) // 2) + self._kth(lo, hi, count // 2)) / 2.0
+        results['min'] = self._extreme(lo, hi, np.minimum, self._min_table)
+        results['max'] = self._extreme(lo, hi, np.maximum, self._max_table)
+        return results
+
+    def _whole_blocks(self, lo, hi):
+        """Return the range of blocks lying entirely within rows lo to hi - 1."""
+        first = -(-lo // self.block_size)
+        last = hi // self.block_size
+        return first, max(first, last)
+
+    def _extreme(self, lo, hi, ufunc, table):
+        """Minimum or maximum of rows lo to hi - 1, from the sparse table of whole blocks and a scan of the ends."""
+        first, last = self._whole_blocks(lo, hi)
+        if first == last:
+            return ufunc.reduce(self.miles[lo:hi])
+
+        level = int(np.log2(last - first))
+        extreme = ufunc(table[level][first], table[level][last - (1 << level)])
+        ends = np.concatenate([self.miles[lo:first * self.block_size], self.miles[last * self.block_size:hi]])
+        return ufunc(extreme, ufunc.reduce(ends)) if len(ends) else extreme
+
+    def _count_at_most(self, lo, hi, rank):
+        """Count the rows from lo to hi - 1 whose value is at most the rank-th distinct value."""
+        first, last = self._whole_blocks(lo, hi)
+        limit = self.distinct[rank]
+        if first == last:
+            return int((self.miles[lo:hi] <= limit).sum())
+
+        blocks = np.arange(first, last)
+        below = np.searchsorted(self._rank_keys, blocks * len(self.distinct) + rank, side='right')
+        count = int((below - blocks * self.block_size).sum())
+        count += int((self.miles[lo:first * self.block_size] <= limit).sum())
+        count += int((self.miles[last * self.block_size:hi] <= limit).sum())
+        return count
+
+    def _kth(self, lo, hi, k):
+        """The k-th smallest value (from 0) of rows lo to hi - 1, by binary search over the distinct values."""
+        low, high = 0, len(self.distinct) - 1
+        while low < high:
+            middle = (low + high) // 2
+            if self._count_at_most(lo, hi, middle) > k:
+                high = middle
+            else:
+                low = middle + 1
+        return self.distinct[low]
+
+
+def _sparse_table(values, ufunc):
+    """
+    Build a sparse table for range minimum (or maximum) queries: level j holds ufunc over every run of 2**j values.
+    """
+    table = [values]
+    width = 1
+    while 2 * width <= len(values):
+        previous = table[-1]
+        table.append(ufunc(previous[:-width], previous[width:]))
+        width *= 2
+    return table
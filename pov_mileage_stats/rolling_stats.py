@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+rollingStats.py
+A small command-line tool to calculate mileage statistics for a personally-owned vehicle.
+
+Handles trailing-window mileage statistics (eg., miles driven in the last 30 days), for lease monitoring.
+
+The log is first summed into a dense daily calendar, with zero miles on days that have no entries. One cumulative sum
+over that calendar then gives the total of any window as the difference of two entries, so every window is computed
+from the same single pass over the days.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Global Options
+WINDOWS = (7, 30, 90, 365)
+
+
+def daily_totals(dates, miles):
+    """
+    Sum a mileage log into a dense daily calendar.
+    :param dates: a datetime64 array-like (eg., the 'Date' column). Entries without a date are left out.
+    :param miles: the mileage of each entry. Missing mileage counts as zero.
+    :return: a tuple of (first day, as a np.datetime64 day, and an array of the total miles of each day from the first
+        to the last day of the log, with zeros on days without entries). If no entry has a date, the first day is None
+        and the array is empty.
+    """
+    days = np.asarray(dates, dtype='datetime64[ns]').astype('datetime64[D]')
+    miles = np.nan_to_num(np.asarray(miles, dtype=float))
+    dated = ~np.isnat(days)
+    if not dated.all():
+        days, miles = days[dated], miles[dated]
+    if not len(days):
+        return None, np.zeros(0)
+    first_day = days.min()
+    offsets = (days - first_day).astype(np.int64)
+    return first_day, np.bincount(offsets, weights=miles)
+
+
+def trailing_totals(daily, windows=WINDOWS):
+    """
+    Compute the total of each trailing window ending on every day of a dense daily calendar.
+    :param daily: total miles of each day, as returned by daily_totals
+    :param windows: window lengths, in days
+    :return: an OrderedDict of {window: array of the total miles of the window ending on each day}
+    """
+    cumulative = np.concatenate([[0.0], np.cumsum(daily)])
+    ends = np.arange(1, len(daily) + 1)
+    return OrderedDict((window, cumulative[ends] - cumulative[np.maximum(ends - window, 0)]) for window in windows)
+
+
+def rolling_frame(df, windows=WINDOWS):
+    """
+    Build a table of trailing-window totals and daily averages for every day of the log.
+    :type df: pd.DataFrame
+    :param df: the mileage data frame, with 'Date' and 'Miles' columns
+    :param windows: window lengths, in days
+    :return: a pd.DataFrame indexed by date, with 'N-Day Total' and 'N-Day Average' columns for each window N. Windows
+        reaching back before the first day are averaged over the days since the first day. Entries without a date are
+        left out.
+    """
+    first_day, daily = daily_totals(df['Date'], df['Miles'])
+    days_known = np.arange(1, len(daily) + 1)
+
+    columns = OrderedDict()
+    for window, totals in trailing_totals(daily, windows).items():
+        columns['{}-Day Total'.format(window)] = totals
+        columns['{}-Day Average'.format(window)] = totals / np.minimum(window, days_known)
+    if first_day is None:
+        index = pd.DatetimeIndex([], name='Date')
+    else:
+        index = pd.date_range(pd.Timestamp(first_day), periods=len(daily), freq='D', name='Date')
+    return pd.DataFrame(columns, index=index)
+
+
+def latest_windows(daily, history_days=None, windows=WINDOWS):
+    """
+    Compute the total and daily average of each trailing window ending on the last day of a dense daily calendar.
+    :param daily: total miles of each day, ending on the last day of the log
+    :param history_days: number of days since the first day of the log, if daily doesn't reach back that far
+    :param windows: window lengths, in days
+    :return: an OrderedDict of {window: (total miles, average miles per day)}
+    """
+    history_days = history_days or len(daily)
+    # Total of the last k days, for every k, from one cumulative sum taken backwards from the last day.
+    recent_totals = np.cumsum(daily[::-1])
+
+    results = OrderedDict()
+    for window in windows:
+        total = recent_totals[min(window, len(daily)) - 1] if len(daily) else 0.0
+        results[window] = (total, total / min(window, history_days) if history_days else np.nan)
+    return results
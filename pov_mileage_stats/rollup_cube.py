@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+rollupCube.py
+A small command-line tool to calculate mileage statistics for a personally-owned vehicle.
+
+Handles a precomputed cube of mileage aggregates at day, ISO week, month and year granularity.
+
+Each level of the cube has one cell per period with any mileage, holding the count, sum, sum of squares, minimum,
+maximum and median of the miles driven in it, plus a mergeable median sketch: the values themselves for small cells, or
+the items of a quantile_sketch.KLLSketch for large ones. The cube is built whenever the parsed data is written to the
+data cache, and stored alongside it. Reports are then answered from the coarsest level that matches them (eg., Month x
+Year pivots from the month cells) instead of from the rows; reports that cut across periods (eg., DayOfWeek x Year)
+merge the cells of a finer level.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import load_data
+import pivot_engine
+import pivot_kernels
+import quantile_sketch
+
+# Global Options
+LEVELS = ('day', 'week', 'month', 'year')
+# Rank error of the median sketches of large cells (eg., the year cells of a log with several entries a day).
+DEFAULT_MEDIAN_ERROR = 0.01
+
+# Bump this whenever the layout of the stored cube changes, so that stale cubes are rebuilt.
+CUBE_VERSION = 1
+
+# Aggregates kept in every cell
+STATS = ('count', 'sum', 'sumsq', 'min', 'max', 'median')
+
+# Reserved array names in the stored cube
+_PREFIX = 'cube::'
+
+
+def period_numbers(days, level):
+    """
+    Map day numbers (days since 1970-01-01) to period numbers of a cube level.
+    :param days: an int64 array of day numbers
+    :param level: one of LEVELS
+    :return: an int64 array of period numbers: days, Monday-based weeks, months or years since the start of 1970
+    """
+    if level == 'day':
+        return days
+    if level == 'week':
+        # 1970-01-01 was a Thursday, so ISO weeks (starting on Monday) are counted from 1969-12-29.
+        return (days + 3) // 7
+    unit = {'month': 'M', 'year': 'Y'}[level]
+    return days.astype('datetime64[D]').astype('datetime64[{}]'.format(unit)).astype(np.int64)
+
+
+def period_starts(periods, level):
+    """Return the first day of each period of a cube level, as a pd.DatetimeIndex."""
+    if level == 'day':
+        days = periods
+    elif level == 'week':
+        days = periods * 7 - 3
+    else:
+        unit = {'month': 'M', 'year': 'Y'}[level]
+        days = periods.astype('datetime64[{}]'.format(unit)).astype('datetime64[D]').astype(np.int64)
+    return pd.DatetimeIndex(days.astype('datetime64[D]'))
+
+
+class CubeLevel(object):
+    """
+    The cells of one granularity of the cube.
+    """
+
+    def __init__(self, periods, stats, offsets, values, weights):
+        """
+        :param periods: int64 period number of each cell, ascending
+        :param stats: a dict of {name in STATS: array with one entry per cell}
+        :param offsets: the median sketch of cell i is items offsets[i] to offsets[i + 1] - 1
+        :param values: value of each median sketch item
+        :param weights: number of original values each sketch item stands for
+        """
+        self.periods = periods
+        self.stats = stats
+        self.offsets = offsets
+        self.values = values
+        self.weights = weights
+
+    @classmethod
+    def build(cls, periods, values, k):
+        """
+        Aggregate values into cells.
+        :param periods: period number of each value, in ascending order
+        :param values: a 1-D float array
+        :param k: size of the KLLSketch kept for cells with more than k values
+        :return: a CubeLevel
+        """
+        starts = np.concatenate([[0], np.flatnonzero(np.diff(periods)) + 1]) if len(periods) else np.zeros(0, int)
+        cells = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(periods))))
+        kernel_stats = pivot_kernels.aggregate(cells, values, len(starts))
+
+        stats = {name: kernel_stats[name] for name in ('count', 'sum', 'min', 'max', 'median')}
+        stats['sumsq'] = np.bincount(cells, weights=values ** 2, minlength=len(starts))
+
+        # Small cells keep their values as they are; large ones are summarized by a sketch.
+        counts = kernel_stats['count']
+        offsets = np.append(starts, len(values))
+        weights = np.ones(len(values))
+        if (counts > k).any():
+            pieces = []
+            for cell, (start, stop) in enumerate(zip(offsets[:-1], offsets[1:])):
+                if counts[cell] <= k:
+                    pieces.append((values[start:stop], weights[start:stop]))
+                    continue
+                sketch = quantile_sketch.KLLSketch(k=k)
+                sketch.update(values[start:stop])
+                pieces.append((np.concatenate(sketch.levels),
+                               np.concatenate([np.full(len(items), 2.0 ** level)
+                                               for level, items in enumerate(sketch.levels)])))
+            offsets = np.append(0, np.cumsum([len(piece_values) for piece_values, _ in pieces]))
+            values = np.concatenate([piece_values for piece_values, _ in pieces])
+            weights = np.concatenate([piece_weights for _, piece_weights in pieces])
+
+        return cls(periods[starts], stats, offsets, values, weights)
+
+    def item_cells(self):
+        """Return the cell number of every median sketch item."""
+        return np.repeat(np.arange(len(self.periods)), np.diff(self.offsets))
+
+    def frame(self, level):
+        """
+        Return the cells as a table.
+        :param level: name of this level, one of LEVELS
+        :return: a pd.DataFrame indexed by the first day of each period, with count, total, mean, standard deviation,
+            median, minimum and maximum columns
+        """
+        count = self.stats['count']
+        mean = self.stats['sum'] / count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            variance = (self.stats['sumsq'] - count * mean ** 2) / (count - 1)
+        return pd.DataFrame(OrderedDict([
+            ('Count', count),
+            ('Total', self.stats['sum']),
+            ('Mean', mean),
+            ('Std', np.sqrt(np.maximum(variance, 0))),
+            ('Median', self.stats['median']),
+            ('Min', self.stats['min']),
+            ('Max', self.stats['max']),
+        ]), index=period_starts(self.periods, level).rename(level.title()))
+
+
+class RollupCube(object):
+    """
+    Aggregates of a mileage log at every level of LEVELS.
+    """
+
+    def __init__(self, levels, median_error=DEFAULT_MEDIAN_ERROR):
+        """
+        :param levels: a dict of {level name: CubeLevel}
+        :param median_error: rank error of the median sketches of large cells
+        """
+        self.levels = levels
+        self.median_error = median_error
+
+    @classmethod
+    def build(cls, df, median_error=DEFAULT_MEDIAN_ERROR):
+        """
+        Build the cube of a mileage log.
+        :type df: pd.DataFrame
+        :param df: the mileage data frame, with 'Date' and 'Miles' columns and no missing mileage
+        :param median_error: rank error of the median sketches of large cells
+        :return: a RollupCube
+        """
+        dates = df['Date'].values
+        values = np.asarray(df['Miles'].values, dtype=float)
+        usable = ~np.isnat(dates)
+        if not usable.all():
+            dates, values = dates[usable], values[usable]
+        days = dates.astype('datetime64[D]').astype(np.int64)
+        if len(days) > 1 and (days[1:] < days[:-1]).any():
+            order = np.argsort(days, kind='mergesort')
+            days, values = days[order], values[order]
+
+        k = quantile_sketch.k_for_error(median_error)
+        levels = OrderedDict((level, CubeLevel.build(period_numbers(days, level), values, k)) for level in LEVELS)
+        return cls(levels, median_error)
+
+    def frame(self, level):
+        """Return the cells of one level as a table; see CubeLevel.frame."""
+        return self.levels[level].frame(level)
+
+    def to_arrays(self):
+        """
+        Break the cube down into a dict of plain NumPy arrays that np.savez can store without pickling.
+        """
+        arrays = {_PREFIX + 'version': np.array(CUBE_VERSION), _PREFIX + 'median_error': np.array(self.median_error)}
+        for name, level in self.levels.items():
+            prefix = '{}{}::'.format(_PREFIX, name)
+            arrays[prefix + 'periods'] = level.periods
+            arrays[prefix + 'offsets'] = level.offsets
+            arrays[prefix + 'values'] = level.values
+            arrays[prefix + 'weights'] = level.weights
+            for stat in STATS:
+                arrays[prefix + stat] = level.stats[stat]
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        Rebuild a cube from the arrays produced by to_arrays.
+        :param arrays: a mapping of array names to np.ndarray objects
+        :return: a RollupCube, or None if the arrays hold no cube or one stored by an incompatible version
+        """
+        if _PREFIX + 'version' not in arrays or int(arrays[_PREFIX + 'version']) != CUBE_VERSION:
+            return None
+        levels = OrderedDict()
+        for name in LEVELS:
+            prefix = '{}{}::'.format(_PREFIX, name)
+            levels[name] = CubeLevel(arrays[prefix + 'periods'], {stat: arrays[prefix + stat] for stat in STATS},
+                                     arrays[prefix + 'offsets'], arrays[prefix + 'values'], arrays[prefix + 'weights'])
+        return cls(levels, float(arrays[_PREFIX + 'median_error']))
+
+
+class CubePivots(pivot_engine.PivotResults):
+    """
+    PivotResults answered from a RollupCube instead of the rows of the log, wherever a level of the cube matches.
+
+    Month x Year tables are read straight off the month cells. DayOfWeek x Year tables merge the day cells, since no
+    coarser period lines up with the days of the week. Any other index, and any log with fuel columns (whose totals the
+    cube doesn't keep), falls back to the rows.
+    """
+
+    def __init__(self, df, cube, values='Miles', columns=pivot_engine.PVT_COLUMNS):
+        """
+        :type df: pd.DataFrame
+        :param df: the mileage data frame the cube was built from
+        :type cube: RollupCube
+        """
+        super(CubePivots, self).__init__(df, values=values, columns=columns)
+        self.cube = cube
+
+    def aggregate(self, index):
+        if index in self._aggregated:
+            return self._aggregated[index]
+        if self.values != 'Miles' or self.columns != 'Year' or index not in ('Month', 'DayOfWeek') or \
+                self.fuel_columns:
+            return super(CubePivots, self).aggregate(index)
+
+        if index == 'Month':
+            level = self.cube.levels['month']
+            row_codes, years = level.periods % 12, level.periods // 12 + 1970
+            cell_stats = dict(level.stats, mean=level.stats['sum'] / level.stats['count'])
+            stats = OrderedDict((aggname, cell_stats[func]) for aggname, func in pivot_engine.AGGREGATIONS.items())
+            labels = load_data.MONTH_LABELS
+        else:
+            level = self.cube.levels['day']
+            if (level.weights != 1).any():
+                # Some days were sketched, so their values can't be regrouped exactly; use the rows instead.
+                return super(CubePivots, self).aggregate(index)
+            # 1970-01-01 was a Thursday, which is day 4 counting from Sunday as DAY_OF_WEEK_LABELS does.
+            day_codes = (level.periods + 4) % 7
+            day_years = level.periods.astype('datetime64[D]').astype('datetime64[Y]').astype(np.int64) + 1970
+            ids, _, col_labels = pivot_kernels.cell_ids(day_codes, day_years)
+            # Day cells hold every value with a weight of one, so the items can be aggregated directly.
+            items = level.item_cells()
+            merged = pivot_kernels.aggregate(ids[items], level.values, 7 * len(col_labels))
+            filled = merged['count'].nonzero()[0]
+            row_codes, col_codes = divmod(filled, len(col_labels))
+            years = col_labels[col_codes]
+            stats = OrderedDict((aggname, merged[func][filled])
+                                for aggname, func in pivot_engine.AGGREGATIONS.items())
+            labels = load_data.DAY_OF_WEEK_LABELS
+
+        cells = pd.MultiIndex.from_arrays(
+            [pd.Categorical.from_codes(row_codes, labels, ordered=True), years.astype(np.int64)],
+            names=[index, self.columns])
+        self._aggregated[index] = pd.DataFrame(stats, index=cells)
+        return self._aggregated[index]
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+"""
+streamStats.py
+A small command-line tool to calculate mileage statistics for a personally-owned vehicle.
+
+Handles bounded-memory statistics for very large mileage logs.
+
+Instead of loading the whole sheet into one DataFrame, the log is read in chunks of rows and each chunk is folded into
+a set of running aggregators: one for the whole log, and one per cell of the Month x Year and DayOfWeek x Year pivot
+tables. Only the aggregators are kept between chunks.
+
+Medians are exact by default. Given a median error bound, each aggregator keeps a mergeable quantile sketch instead, so
+that its memory stays fixed however many distinct values it sees.
+"""
+
+import os
+import zipfile
+import zlib
+from collections import Counter
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+
+import calculate_statistics
+import load_data
+import quantile_sketch
+import rolling_stats
+
+# Global Options
+DEFAULT_CHUNKSIZE = 100000
+
+# Row labels of the pivot tables that are aggregated while streaming
+PVT_INDEXES = ('Month', 'DayOfWeek')
+
+# Input formats (see load_data.FORMATS) that can be read in chunks
+STREAM_FORMATS = ('excel', 'csv', 'tsv')
+
+
+class RunningStats(object):
+    """
+    Running count, sum, minimum, maximum and median of a stream of mileage values.
+
+    By default the median is exact: it is computed from a tally of each distinct value seen, which stays small for
+    mileage logs because they are recorded to a fixed precision. With a median_error, a quantile_sketch.KLLSketch is
+    kept instead, and the median is approximate.
+    """
+
+    def __init__(self, median_error=None):
+        """
+        :param median_error: normalized rank error tolerated in the median (eg., 0.01), or None for an exact median
+        """
+        self.count = 0
+        self.total = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.value_counts = Counter()
+        self.sketch = None
+        if median_error is not None:
+            self.sketch = quantile_sketch.KLLSketch(k=quantile_sketch.k_for_error(median_error))
+
+    def update(self, values):
+        """
+        Fold an array of values into the running statistics.
+        :param values: a 1-D np.ndarray of floats containing no NaNs
+        :return:
+        """
+        if len(values) == 0:
+            return
+        self.count += len(values)
+        self.total += values.sum()
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        if self.sketch is not None:
+            self.sketch.update(values)
+            return
+        distinct, counts = np.unique(values, return_counts=True)
+        self.value_counts.update(dict(zip(distinct.tolist(), counts.tolist())))
+
+    def merge(self, other):
+        """
+        Fold another RunningStats object into this one. Both must have been made with the same median_error.
+        :type other: RunningStats
+        :return:
+        """
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        if self.sketch is not None:
+            self.sketch.merge(other.sketch)
+        else:
+            self.value_counts.update(other.value_counts)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else np.nan
+
+    @property
+    def median(self):
+        if not self.count:
+            return np.nan
+        if self.sketch is not None:
+            return self.sketch.median
+        values = np.array(sorted(self.value_counts))
+        cumulative = np.cumsum([self.value_counts[value] for value in values])
+        # Same convention as np.median: average the two middle values when the count is even.
+        lower = values[np.searchsorted(cumulative, (self.count - 1) // 2, side='right')]
+        upper = values[np.searchsorted(cumulative, self.count // 2, side='right')]
+        return (lower + upper) / 2.0
+
+    def get(self, aggname):
+        """
+        Look up a statistic by its name in calculate_statistics.PVT_TABLES (eg., 'Mean' or 'Median').
+        """
+        return {'Mean': self.mean, 'Median': self.median, 'Max': self.max, 'Min': self.min}[aggname]
+
+
+class StreamAggregator(object):
+    """
+    Accumulates the basic statistics and pivot tables of a mileage log one chunk at a time.
+
+    Memory use is proportional to the number of pivot cells and of days, not to the number of rows in the log.
+    """
+
+    def __init__(self, median_error=None):
+        """
+        :param median_error: normalized rank error tolerated in the medians (eg., 0.01), or None for exact medians
+        """
+        self.median_error = median_error
+        self.overall = RunningStats(median_error)
+        self.first_day = None
+        self.last_day = None
+        # Total miles of each day seen, keyed by day number, for the trailing-window statistics
+        self.daily = Counter()
+        self.cells = {index: {} for index in PVT_INDEXES}
+
+    def update(self, chunk):
+        """
+        Fold a chunk of the mileage log into the aggregators.
+        :type chunk: pd.DataFrame
+        :param chunk: a DataFrame with 'Date' and 'Miles' columns
+        :return:
+        """
+        chunk = load_data.establish_relevant_columns(chunk)
+        if chunk.empty:
+            return
+
+        self.overall.update(chunk['Miles'].values)
+
+        first_day, last_day = chunk['Date'].min(), chunk['Date'].max()
+        self.first_day = first_day if self.first_day is None else min(self.first_day, first_day)
+        self.last_day = last_day if self.last_day is None else max(self.last_day, last_day)
+
+        first, daily = rolling_stats.daily_totals(chunk['Date'], chunk['Miles'])
+        if first is not None:
+            days = first.astype(np.int64) + daily.nonzero()[0]
+            self.daily.update(dict(zip(days.tolist(), daily[daily.nonzero()[0]].tolist())))
+
+        for index in PVT_INDEXES:
+            cells = self.cells[index]
+            labels = chunk[index].cat.categories
+            # Group on the categorical codes, so that only the (label, year) pairs present in the chunk are visited.
+            for (code, year), values in chunk['Miles'].groupby([chunk[index].cat.codes.values, chunk['Year'].values]):
+                key = (labels[code], year)
+                if key not in cells:
+                    cells[key] = RunningStats(self.median_error)
+                cells[key].update(values.values)
+
+    def merge(self, other):
+        """
+        Fold another StreamAggregator (eg., of another file or of another part of the same log) into this one.
+        :type other: StreamAggregator
+        :return:
+        """
+        self.overall.merge(other.overall)
+        if other.first_day is not None:
+            self.first_day = other.first_day if self.first_day is None else min(self.first_day, other.first_day)
+            self.last_day = other.last_day if self.last_day is None else max(self.last_day, other.last_day)
+        self.daily.update(other.daily)
+        for index in PVT_INDEXES:
+            cells = self.cells[index]
+            for key, stats in other.cells[index].items():
+                if key not in cells:
+                    cells[key] = RunningStats(self.median_error)
+                cells[key].merge(stats)
+
+    def basic_stats(self):
+        """
+        Return the basic statistics in the same form as calculate_statistics.calculate_basic_stats.
+        """
+        return calculate_statistics.build_basic_stats(
+            mean_mileage=self.overall.mean,
+            med_mileage=self.overall.median,
+            first_day=self.first_day,
+            last_day=self.last_day,
+            record_low=self.overall.min,
+            record_high=self.overall.max,
+            rolling=rolling_stats.latest_windows(self.daily_calendar()),
+        )
+
+    def daily_calendar(self):
+        """Return the dense daily calendar of total miles, from the first to the last day seen."""
+        if self.first_day is None:
+            return np.zeros(0)
+        first, last = (np.datetime64(day, 'D').astype(np.int64) for day in (self.first_day, self.last_day))
+        daily = np.zeros(last - first + 1)
+        daily[np.array(list(self.daily), dtype=np.int64) - first] = list(self.daily.values())
+        return daily
+
+    def pivot_table(self, index, aggname, fill_value=None):
+        """
+        Return a pivot table of the streamed mileage, laid out like df.pivot_table(values='Miles', index=index,
+        columns='Year', aggfunc=..., fill_value=fill_value).
+        :param index: 'Month' or 'DayOfWeek'
+        :param aggname: name of the statistic, as in calculate_statistics.PVT_TABLES (eg., 'Median')
+        :param fill_value: value for cells that have no data, or None to leave them as NaN
+        :return: a pd.DataFrame with one row per index label and one column per year
+        """
+        cells = self.cells[index]
+        values = pd.Series({key: stats.get(aggname) for key, stats in cells.items()})
+        table = values.unstack(fill_value=fill_value).sort_index()
+        table.index.name = index
+        table.columns.name = 'Year'
+        return table
+
+
+def iter_excel_chunks(path, skiprows=0, usecols="A:B", chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Read the first worksheet of an .xlsx workbook in chunks of rows, without ever holding the whole sheet in memory.
+    :param path: The (relative) path to an .xlsx workbook.
+    :param skiprows: Number of rows to skip before the header row.
+    :param usecols: A:B-style range of columns to include.
+    :param chunksize: Number of rows per chunk.
+    :return: a generator of pd.DataFrame chunks, with columns named after the header row
+
+    :raises
+    zlib.error: if the workbook is corrupt.
+    """
+    positions = load_data.usecols_to_positions(usecols)
+    first_col, last_col = min(positions) + 1, max(positions) + 1
+
+    workbook = load_data.open_zipped_workbook(path, read_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(min_row=int(skiprows) + 1, min_col=first_col, max_col=last_col)
+        header = [cell.value for cell in next(rows)]
+        while True:
+            block = [[cell.value for cell in row] for row in islice(rows, chunksize)]
+            if not block:
+                break
+            chunk = pd.DataFrame(block, columns=header)
+            chunk['Miles'] = pd.to_numeric(chunk['Miles'])
+            yield chunk
+    except zipfile.BadZipFile as e:
+        raise zlib.error("{} is not a valid workbook: {}".format(path, e))
+    finally:
+        workbook.close()
+
+
+def iter_csv_chunks(path, sep=',', skiprows=0, usecols="A:B", date_format=None, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Read a delimited text file in chunks of rows with pandas' C parser.
+    :param path: The (relative) path to the delimited text file.
+    :param sep: The field delimiter.
+    :param skiprows: Number of rows to skip before the header row.
+    :param usecols: A:B-style range of columns to include.
+    :param date_format: strftime-style format of the 'Date' column. Defaults to load_data.DEFAULT_DATE_FORMAT.
+    :param chunksize: Number of rows per chunk.
+    :return: a generator of pd.DataFrame chunks with 'Date' and 'Miles' columns
+    """
+    date_format = date_format or load_data.DEFAULT_DATE_FORMAT
+    reader = pd.read_csv(os.path.abspath(path), sep=sep, skiprows=int(skiprows),
+                         usecols=load_data.usecols_to_positions(usecols),
+                         dtype={'Date': str, 'Miles': load_data.MILES_DTYPE}, engine='c', chunksize=chunksize)
+    for chunk in reader:
+        chunk['Date'] = pd.to_datetime(chunk['Date'], format=date_format)
+        yield chunk
+
+
+def iter_chunks(path, fmt=None, skiprows=0, usecols="A:B", date_format=None, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Read a mileage log in chunks of rows, choosing the reader from the input format.
+    :param path: The (relative) path to the input file.
+    :param fmt: The input format (one of the keys of load_data.FORMATS), or None to pick it from the file extension.
+    :return: a generator of pd.DataFrame chunks with 'Date' and 'Miles' columns
+
+    :raises
+    ValueError: if the format (or, for Excel, the .xls file type) can't be streamed.
+    """
+    if not streamable(path, fmt):
+        if path.lower().endswith('.xls'):
+            raise ValueError("Streaming mode reads .xlsx and .xlsm workbooks only. Please save {} in one of those "
+                             "formats, or run the program without --stream.".format(path))
+        raise ValueError("Streaming is not supported for the {} format.".format(load_data.detect_format(path, fmt)))
+
+    fmt = load_data.detect_format(path, fmt)
+    if fmt == 'excel':
+        return iter_excel_chunks(path, skiprows=skiprows, usecols=usecols, chunksize=chunksize)
+    return iter_csv_chunks(path, sep=',' if fmt == 'csv' else '\t', skiprows=skiprows, usecols=usecols,
+                           date_format=date_format, chunksize=chunksize)
+
+
+def streamable(path, fmt=None):
+    """
+    Tell whether an input file can be read in chunks.
+    :param path: The (relative) path to the input file.
+    :param fmt: The input format (one of the keys of load_data.FORMATS), or None to pick it from the file extension.
+    :return: True if iter_chunks can read the file. Of the Excel formats, only the zipped ones (.xlsx and .xlsm) can be
+        read in chunks.
+    """
+    fmt = load_data.detect_format(path, fmt)
+    return fmt in STREAM_FORMATS and not (fmt == 'excel' and path.lower().endswith('.xls'))
+
+
+def aggregate_chunks(chunks, median_error=None):
+    """
+    Fold an iterable of DataFrame chunks into a StreamAggregator.
+    :param chunks: an iterable of pd.DataFrame objects with 'Date' and 'Miles' columns
+    :param median_error: normalized rank error tolerated in the medians, or None for exact medians
+    :return: the populated StreamAggregator
+    """
+    aggregator = StreamAggregator(median_error)
+    for chunk in chunks:
+        aggregator.update(chunk)
+    return aggregator
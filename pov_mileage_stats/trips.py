@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+trips.py
+A small command-line tool to calculate mileage statistics for a personally-owned vehicle.
+
+Handles logs with one row per trip (eg., a telematics export), collapsing them into the daily 'Date'/'Miles' log that
+the rest of the program expects, with the number of trips taken each day alongside.
+
+Trips are grouped by their integer day number without sorting: each day number, counted from the first day, indexes
+its own slot of the totals, so that np.bincount sums the miles (and counts the trips) of every day in one linear pass.
+When the days spanned far outnumber the trips (eg., a stray date decades off), the day numbers are compacted with
+np.unique first, so that memory stays proportional to the trips rather than to the span.
+"""
+
+import numpy as np
+import pandas as pd
+
+import load_data
+
+
+def trips_to_daily(df):
+    """
+    Collapse a log of trips into a log of the miles driven each day.
+    :type df: pd.DataFrame
+    :param df: a DataFrame with 'Date' (the day or time of each trip) and 'Miles' columns, and optionally any of
+        load_data.FUEL_COLUMNS
+    :return: a pd.DataFrame with one row per day with trips, in date order, and 'Date', 'Miles' and 'Trips' columns
+        (plus the fuel columns of df, also totalled per day). Trips without a date or a mileage are left out.
+    """
+    fuel_columns = load_data.fuel_columns(df)
+    columns = ['Date', 'Miles', load_data.TRIPS_COLUMN] + fuel_columns
+    dates = df['Date'].values
+    miles = np.asarray(df['Miles'].values, dtype=float)
+    usable = ~np.isnat(dates) & ~np.isnan(miles)
+    rows = None if usable.all() else np.flatnonzero(usable)
+    days = (dates if rows is None else dates[rows]).astype('datetime64[D]').astype(np.int64)
+    if rows is not None:
+        miles = miles[rows]
+    if not len(days):
+        return pd.DataFrame(dict({'Date': pd.to_datetime([]), load_data.TRIPS_COLUMN: np.zeros(0, np.int64)},
+                                 **{column: np.zeros(0) for column in ['Miles'] + fuel_columns}), columns=columns)
+
+    first = days.min()
+    slots = days - first
+    n_slots = slots.max() + 1
+    if n_slots > 2 * len(days) + 366:
+        # np.unique sorts, but only runs for degenerate spans.
+        unique_days, slots = np.unique(days, return_inverse=True)
+        n_slots = len(unique_days)
+    else:
+        unique_days = None
+
+    counts = np.bincount(slots, minlength=n_slots)
+    filled = counts.nonzero()[0]
+    trip_days = first + filled if unique_days is None else unique_days
+    daily = {'Date': trip_days.astype('datetime64[D]').astype('datetime64[ns]'),
+             'Miles': np.bincount(slots, weights=miles, minlength=n_slots)[filled],
+             load_data.TRIPS_COLUMN: counts[filled]}
+    for column in fuel_columns:
+        values = np.asarray(df[column].values, dtype=float)
+        if rows is not None:
+            values = values[rows]
+        daily[column] = np.bincount(slots, weights=np.nan_to_num(values), minlength=n_slots)[filled]
+    return pd.DataFrame(daily, columns=columns)
@@ -13,11 +13,32 @@ from contextlib import contextmanager
 from io import StringIO
 import shutil
 import time
+import tempfile
+import tracemalloc
+import zipfile
+
+import numpy as np
+import pandas as pd
 
 import gen_mileage_stats
 import load_data
 import calculate_statistics
+import data_cache
+import daily_calendar
+import forecasting
+import bootstrap
+import anomaly_detection
+import stream_stats
+import trips
+import pivot_engine
+import pivot_kernels
+import rolling_stats
+import range_query
+import rollup_cube
+import incremental_stats
+import odometer
 import make_plots
+import memory_budget
 import results_export
 import html_template_render
 
@@ -28,6 +49,9 @@ TEST_DATA_DIR = os.path.join(CURRENT_DIR, 'test_data')
 PROJ_DIR = os.path.join(MAIN_DIR, 'arthritis_proj')
 DATA_DIR = os.path.join(PROJ_DIR, 'data')
 SAMPLE_DATA_FILE = os.path.join(TEST_DATA_DIR, "test_data.xlsx")
+SAMPLE_CSV_FILE = os.path.join(TEST_DATA_DIR, "test_data.csv")
+SAMPLE_NDJSON_FILE = os.path.join(TEST_DATA_DIR, "test_data.ndjson")
+SAMPLE_MULTISHEET_FILE = os.path.join(TEST_DATA_DIR, "test_data_multisheet.xlsx")
 
 # Debug switches
 logging.basicConfig(level=logging.WARNING)
@@ -47,7 +71,7 @@ class GeneralCommandLineUse(unittest.TestCase):
         :return:
         """
 
-        args = ['-i', SAMPLE_DATA_FILE, '-b', '-H']
+        args = ['-i', SAMPLE_DATA_FILE, '-b', '-H', '--no-cache']
 
         if logger.isEnabledFor(logging.DEBUG):
             gen_mileage_stats.main(args)
@@ -70,7 +94,7 @@ class GeneralCommandLineUse(unittest.TestCase):
         See if the program correctly outputs pivot tables to STDOUT
         :return:
         """
-        args = ['-i', SAMPLE_DATA_FILE, '-v', '-H']
+        args = ['-i', SAMPLE_DATA_FILE, '-v', '-H', '--no-cache']
         if logger.isEnabledFor(logging.DEBUG):
             gen_mileage_stats.main(args)
         with capture_stdout(gen_mileage_stats.main, args) as output:
@@ -85,7 +109,7 @@ class GeneralCommandLineUse(unittest.TestCase):
         Test by running the -P option only to see if the program warns the user to unsuppress plot generation.
         :return:
         """
-        args = ['-i', SAMPLE_DATA_FILE, '-P']
+        args = ['-i', SAMPLE_DATA_FILE, '-P', '--no-cache']
         if logger.isEnabledFor(logging.DEBUG):
             gen_mileage_stats.main(args)
 
@@ -104,7 +128,7 @@ class LoadDataTests(unittest.TestCase):
         Trigger an FileNotFountError by passing an invalid path to the function
         :return:
         """
-        args = ["-i", os.path.join(TEST_DATA_DIR, 'non-existent-file.xlsx'), '-H']
+        args = ["-i", os.path.join(TEST_DATA_DIR, 'non-existent-file.xlsx'), '-H', '--no-cache']
         if logger.isEnabledFor(logging.DEBUG):
             gen_mileage_stats.main(args)
         with capture_stderr(gen_mileage_stats.main, args) as output:
@@ -115,24 +139,1156 @@ class LoadDataTests(unittest.TestCase):
         Trigger a zlib.error by passing a file that is corrupt (eg., that can't be unzipped).
         :return:
         """
-        args = ["-i", os.path.join(TEST_DATA_DIR, 'test_data_corrupted.xlsx'), '-H']
+        args = ["-i", os.path.join(TEST_DATA_DIR, 'test_data_corrupted.xlsx'), '-H', '--no-cache']
         if logger.isEnabledFor(logging.DEBUG):
             gen_mileage_stats.main(args)
         with capture_stderr(gen_mileage_stats.main, args) as output:
             self.assertTrue("Excel file appears to be corrupt." in output)
 
+    def test_pass_truncated_file(self):
+        """
+        A workbook whose zip archive is cut short should be reported as corrupt before it reaches the parser.
+        :return:
+        """
+        tmp_dir = tempfile.mkdtemp()
+        truncated_file = os.path.join(tmp_dir, 'test_data_truncated.xlsx')
+        with open(SAMPLE_DATA_FILE, 'rb') as in_file, open(truncated_file, 'wb') as out_file:
+            out_file.write(in_file.read()[:1024])
+
+        args = ["-i", truncated_file, '-H', '--no-cache']
+        try:
+            with capture_stderr(gen_mileage_stats.main, args) as output:
+                self.assertTrue("Excel file appears to be corrupt." in output)
+        finally:
+            silent_remove(tmp_dir)
+
+    def test_zipped_workbook_engine(self):
+        """
+        Zipped workbooks should be read with openpyxl wherever pandas supports it, and with xlrd otherwise.
+        :return:
+        """
+        workbook = load_data.open_workbook(SAMPLE_DATA_FILE)
+        try:
+            expected = 'openpyxl' if load_data.PANDAS_READS_OPENPYXL else 'xlrd'
+            self.assertEqual(load_data.excel_engine(workbook), expected)
+            self.assertTrue(load_data.workbook_sheet_names(workbook))
+        finally:
+            load_data.close_workbook(workbook)
+
+    def test_text_formats_match_excel(self):
+        """
+        CSV and NDJSON copies of the sample workbook should produce the same reports as the workbook itself.
+        :return:
+        """
+        args = ['-i', SAMPLE_DATA_FILE, '-b', '-v', '-P', '-H', '--no-cache']
+        with capture_stdout(gen_mileage_stats.main, args) as output:
+            excel_output = output
+
+        for path in (SAMPLE_CSV_FILE, SAMPLE_NDJSON_FILE):
+            args = ['-i', path, '-b', '-v', '-P', '-H', '--no-cache']
+            with capture_stdout(gen_mileage_stats.main, args) as output:
+                self.assertEqual(output, excel_output)
+
+    def test_format_option_overrides_extension(self):
+        """
+        The --format option should pick the parser even when the file extension doesn't match.
+        :return:
+        """
+        tmp_dir = tempfile.mkdtemp()
+        renamed_file = os.path.join(tmp_dir, 'mileage.txt')
+        shutil.copy(SAMPLE_CSV_FILE, renamed_file)
+        try:
+            self.assertEqual(load_data.detect_format(renamed_file), 'excel')
+            data, _ = load_data.import_data(renamed_file, fmt='csv')
+            self.assertEqual(list(data.columns), ['Date', 'Miles'])
+            self.assertEqual(str(data['Date'].dtype), 'datetime64[ns]')
+        finally:
+            silent_remove(tmp_dir)
+
+    def test_all_sheets_option(self):
+        """
+        A workbook split into one sheet per year (in reverse order) should report the same as the single-sheet original
+        when read with -a, and its combined data should be in date order.
+        :return:
+        """
+        args = ['-i', SAMPLE_DATA_FILE, '-b', '-v', '-P', '-H', '--no-cache']
+        with capture_stdout(gen_mileage_stats.main, args) as output:
+            single_sheet_output = output
+
+        args = ['-i', SAMPLE_MULTISHEET_FILE, '-a', '-b', '-v', '-P', '-H', '--no-cache']
+        with capture_stdout(gen_mileage_stats.main, args) as output:
+            self.assertEqual(output, single_sheet_output)
+
+        data, _ = load_data.import_data(SAMPLE_MULTISHEET_FILE, all_sheets=True)
+        self.assertTrue(data['Date'].is_monotonic_increasing)
+
+    def test_all_sheets_validates_each_sheet(self):
+        """
+        With -a, a sheet with text in its date column should be reported by name.
+        :return:
+        """
+        args = ["-i", os.path.join(TEST_DATA_DIR, 'test_data_invaliddata.xlsx'), '-a', '-H', '--no-cache']
+        with capture_stderr(gen_mileage_stats.main, args) as output:
+            self.assertTrue("Workbook contains invalid data" in output)
+            self.assertTrue("Sheet 'Sheet1'" in output)
+
+    def test_pivot_columns_are_compact(self):
+        """
+        The day-of-week and month columns should be ordered categoricals holding the usual "(03): March"-style labels.
+        :return:
+        """
+        data, _ = load_data.import_data(SAMPLE_DATA_FILE)
+        data = load_data.establish_relevant_columns(data)
+
+        self.assertTrue(pd.api.types.is_categorical_dtype(data['Month']))
+        self.assertTrue(data['Month'].cat.ordered)
+        self.assertEqual(list(data['Month'].cat.categories), load_data.MONTH_LABELS)
+        self.assertEqual(data['Year'].dtype, load_data.YEAR_DTYPE)
+
+        # The labels must be exactly what strftime would have produced for every row.
+        self.assertEqual(list(data['DayOfWeek'].astype(str)), list(data['Date'].dt.strftime('(%w): %A')))
+        self.assertEqual(list(data['Month'].astype(str)), list(data['Date'].dt.strftime('(%m): %B')))
+
     def test_pass_invalid_data_file(self):
         """
         Trigger a AttributeError by passing a datafile that has text in one of the date cells.
         :return:
         """
-        args = ["-i", os.path.join(TEST_DATA_DIR, 'test_data_invaliddata.xlsx'), '-H']
+        args = ["-i", os.path.join(TEST_DATA_DIR, 'test_data_invaliddata.xlsx'), '-H', '--no-cache']
         if logger.isEnabledFor(logging.DEBUG):
             gen_mileage_stats.main(args)
         with capture_stderr(gen_mileage_stats.main, args) as output:
             self.assertTrue("Workbook contains invalid data" in output)
 
 
+# Tests for the parsed-data cache
+class DataCacheTests(unittest.TestCase):
+    """
+    These tests ensure that parsed mileage data is cached and reused correctly.
+    """
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        silent_remove(self.cache_dir)
+
+    def test_repeat_run_uses_cache(self):
+        """
+        A second run on the same file should read the cached data and report the same statistics.
+        :return:
+        """
+        args = ['-i', SAMPLE_DATA_FILE, '-b', '-P', '-H', '--cache-dir', self.cache_dir]
+        with capture_stdout(gen_mileage_stats.main, args) as output:
+            first_output = output
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+        with capture_stdout(gen_mileage_stats.main, args) as output:
+            self.assertEqual(output, first_output)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+    def test_no_cache_option(self):
+        """
+        Test that specifying --no-cache does not write anything to the cache directory.
+        :return:
+        """
+        args = ['-i', SAMPLE_DATA_FILE, '-b', '-P', '-H', '--no-cache', '--cache-dir', self.cache_dir]
+        with capture_stdout(gen_mileage_stats.main, args) as output:
+            self.assertTrue("Mean Mileage" in output)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_round_trip_and_eviction(self):
+        """
+        Cached frames should read back unchanged, and old entries should be evicted once the size limit is exceeded.
+        :return:
+        """
+        data, _ = load_data.import_excel_data(SAMPLE_DATA_FILE)
+        data = load_data.establish_relevant_columns(data)
+
+        old_path = data_cache.store('old', data, cache_dir=self.cache_dir)
+        pd.testing.assert_frame_equal(data_cache.load('old', cache_dir=self.cache_dir), data)
+        os.utime(old_path, (0, 0))  # Make this entry the least recently used.
+
+        data_cache.store('new', data, cache_dir=self.cache_dir, max_bytes=os.path.getsize(old_path))
+        self.assertIsNone(data_cache.load('old', cache_dir=self.cache_dir))
+        self.assertIsNotNone(data_cache.load('new', cache_dir=self.cache_dir))
+
+
+# Tests for odometer-reading input
+class OdometerTests(unittest.TestCase):
+    """
+    These tests ensure that odometer readings are turned into the same daily log that they were taken from.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        days = pd.date_range('2018-01-01', periods=60, freq='D')
+        self.daily = pd.DataFrame({'Date': days, 'Miles': np.arange(60) % 7 * 10.0})
+        self.readings = pd.DataFrame({'Date': days, 'Odometer': (99500 + self.daily['Miles'].cumsum()) % 100000})
+
+    def tearDown(self):
+        silent_remove(self.temp_dir)
+
+    def test_daily_miles_from_readings(self):
+        """
+        Daily readings should give back the daily miles across a rollover, sparse readings should keep the total, and
+        the days across a reset should be left out.
+        :return:
+        """
+        daily, info = odometer.readings_to_daily(self.readings.sample(frac=1, random_state=0))
+        self.assertEqual(info, {'readings': 60, 'rollovers': 1, 'resets': 0})
+        pd.testing.assert_frame_equal(daily, self.daily.iloc[1:].reset_index(drop=True))
+
+        sparse = self.readings.iloc[::5]
+        for spread in odometer.SPREADS:
+            daily, _ = odometer.readings_to_daily(sparse, spread=spread)
+            self.assertEqual(len(daily), 55)
+            self.assertAlmostEqual(daily['Miles'].sum(), self.daily['Miles'].iloc[1:56].sum())
+
+        reset = self.readings.copy()
+        reset.loc[30:, 'Odometer'] -= 5000
+        daily, info = odometer.readings_to_daily(reset)
+        self.assertEqual(info['resets'], 1)
+        self.assertNotIn(pd.Timestamp('2018-01-31'), set(daily['Date']))
+        self.assertEqual(len(daily), 58)
+
+    def test_odometer_option(self):
+        """
+        --odometer should report on a CSV file of odometer readings.
+        :return:
+        """
+        path = os.path.join(self.temp_dir, 'odometer.csv')
+        self.readings.to_csv(path, index=False, date_format=load_data.DEFAULT_DATE_FORMAT)
+        args = ['-i', path, '-b', '-P', '-H', '--no-cache', '--odometer']
+        with capture_stdout(gen_mileage_stats.main, args) as output:
+            self.assertTrue("First Day of Recorded Mileage: 02 Jan 2018" in output)
+            self.assertTrue("Record High Miles Driven: 60.0 miles" in output)
+
+
+# Tests for dense daily calendar resampling
+class DailyCalendarTests(unittest.TestCase):
+    """
+    These tests ensure that logs with gaps are resampled onto a dense calendar according to the missing-day policy.
+    """
+
+    def test_missing_day_policies(self):
+        """
+        Gaps should be filled by each policy, entries on the same day summed, and dense logs passed through uncopied.
+        :return:
+        """
+        log = pd.DataFrame({'Date': pd.to_datetime(['2018-01-04', '2018-01-01', '2018-01-04', '2018-01-05', None]),
+                            'Miles': [10.0, 20.0, 30.0, 50.0, 5.0]})
+        expected = {'zero': [20.0, 0.0, 0.0, 40.0, 50.0], 'nan': [20.0, np.nan, np.nan, 40.0, 50.0],
+                    'interpolate': [20.0, 26.666667, 33.333333, 40.0, 50.0]}
+        for policy, miles in expected.items():
+            dense = daily_calendar.resample_daily(log, policy=policy)
+            self.assertEqual(list(dense['Date']), list(pd.date_range('2018-01-01', '2018-01-05')))
+            np.testing.assert_allclose(dense['Miles'], miles, rtol=1e-6)
+            self.assertEqual(list(dense['Recorded']), [True, False, False, True, True])
+
+        dense = daily_calendar.resample_daily(log)[['Date', 'Miles']]
+        self.assertIs(daily_calendar.resample_daily(dense), dense)
+
+        table, recorded_days, calendar_days = daily_calendar.coverage(
+            load_data.establish_relevant_columns(daily_calendar.resample_daily(log)))
+        self.assertEqual((recorded_days, calendar_days), (3, 5))
+        self.assertAlmostEqual(table.loc[load_data.MONTH_LABELS[0], 2018], 0.6)
+
+    def test_missing_days_option(self):
+        """
+        --missing-days should report the coverage, and count the missing day in the statistics.
+        :return:
+        """
+        args = ['-i', SAMPLE_DATA_FILE, '-b', '-v', '-P', '-H', '--no-cache', '--missing-days', 'zero']
+        with capture_stdout(gen_mileage_stats.main, args) as output:
+            self.assertTrue("Days with Recorded Mileage: 846 of 847 (99.9%)" in output)
+            self.assertTrue("Days with Recorded Mileage (%)" in output)
+
+
+# Tests for trip-level input
+class TripsTests(unittest.TestCase):
+    """
+    These tests ensure that logs with one row per trip are collapsed into the daily log they add up to.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        data, _ = load_data.import_data(SAMPLE_DATA_FILE)
+        data = data.dropna().reset_index(drop=True)
+        self.daily = data
+        # Split every day into one to three trips at different times of day, and shuffle them.
+        per_day = np.arange(len(data)) % 3 + 1
+        rows = np.repeat(np.arange(len(data)), per_day)
+        trip_numbers = np.arange(len(rows)) - np.repeat(np.cumsum(per_day) - per_day, per_day)
+        self.trips = pd.DataFrame({'Date': data['Date'].values[rows] + pd.to_timedelta(8 + 4 * trip_numbers, unit='h'),
+                                   'Miles': data['Miles'].values[rows] / per_day[rows]}).sample(frac=1, random_state=0)
+        self.per_day = per_day
+
+    def tearDown(self):
+        silent_remove(self.temp_dir)
+
+    def test_trips_to_daily(self):
+        """
+        Trips should be totalled and counted per day, in date order, skipping trips without a date or mileage.
+        :return:
+        """
+        daily = trips.trips_to_daily(self.trips)
+        np.testing.assert_allclose(daily['Miles'], self.daily['Miles'])
+        self.assertEqual(list(daily['Date']), list(self.daily['Date']))
+        self.assertEqual(list(daily['Trips']), list(self.per_day))
+
+        broken = self.trips.copy()
+        broken.iloc[:2, 1] = np.nan
+        broken.iloc[2:4, 0] = pd.NaT
+        self.assertEqual(trips.trips_to_daily(broken)['Trips'].sum(), self.per_day.sum() - 4)
+
+    def test_trips_option(self):
+        """
+        --trips should report the daily statistics of the log the trips add up to, plus the trips per day.
+        :return:
+        """
+        path = os.path.join(self.temp_dir, 'trips.csv')
+        self.trips.to_csv(path, index=False, date_format='%Y-%m-%d %H:%M')
+        args = ['-i', path, '-b', '-v', '-P', '-H', '--no-cache', '--trips', '--date-format', '%Y-%m-%d %H:%M']
+        with capture_stdout(gen_mileage_stats.main, args) as output:
+            self.assertTrue("Median Mileage: 28.9 miles" in output)
+            self.assertTrue("Mean Trips per Day: 2.0 trips" in output)
+            self.assertTrue("Mean Trips per Day\n==============" in output)
+
+
+# Tests for the shared pivot table engine
+class PivotEngineTests(unittest.TestCase):
+    """
+    These tests ensure that the pivot engine reproduces DataFrame.pivot_table while grouping only once.
+    """
+
+    def setUp(self):
+        data, _ = load_data.import_data(SAMPLE_DATA_FILE)
+        self.data = load_data.establish_relevant_columns(data)
+
+    def test_matches_pivot_table(self):
+        """
+        Every statistic should match pivot_table with the corresponding numpy aggfunc, with and without a fill value.
+        :return:
+        """
+        aggfuncs = {'Mean': np.mean, 'Median': np.median, 'Max': np.max, 'Min': np.min}
+        pivots = pivot_engine.PivotResults(self.data)
+        for index in ('Month', 'DayOfWeek'):
+            for aggname, aggfunc in aggfuncs.items():
+                for fill_value in (0, None):
+                    expected = self.data.pivot_table(values='Miles', index=index, columns='Year', aggfunc=aggfunc,
+                                                     fill_value=fill_value)
+                    pd.testing.assert_frame_equal(pivots.pivot_table(index, aggname, fill_value=fill_value), expected)
+
+    def test_groups_once_per_index(self):
+        """
+        All the statistics for an index should come from a single stored grouping.
+        :return:
+        """
+        pivots = pivot_engine.PivotResults(self.data)
+        aggregated = pivots.aggregate('Month')
+        pivots.pivot_tables('Month')
+        self.assertIs(pivots.aggregate('Month'), aggregated)
+        self.assertEqual(list(aggregated.columns), list(pivot_engine.AGGREGATIONS))
+
+    def test_kernels_skip_unusable_rows(self):
+        """
+        The NumPy kernels should ignore rows with a missing label or year, and match a groupby of the rest.
+        :return:
+        """
+        row_codes = np.array([0, 1, -1, 1, 0, 2, 1])
+        years = np.array([2018, 2018, 2018, np.nan, 2019, 2019, 2018])
+        values = np.array([1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 8.0])
+        ids, rows, col_labels = pivot_kernels.cell_ids(row_codes, years)
+        stats = pivot_kernels.aggregate(ids, values[rows], 3 * len(col_labels))
+
+        self.assertEqual(list(col_labels), [2018.0, 2019.0])
+        expected = pd.Series(values).groupby([row_codes, years]).agg(['median', 'min', 'max']).drop(-1, level=0)
+        filled = stats['count'].nonzero()[0]
+        self.assertEqual(list(stats['median'][filled]), list(expected['median']))
+        self.assertEqual(list(stats['min'][filled]), list(expected['min']))
+        self.assertEqual(list(stats['max'][filled]), list(expected['max']))
+
+    def test_memoized_between_reports(self):
+        """
+        Asking for the same frame's pivots again should reuse every table, and changing the frame should not.
+        :return:
+        """
+        pivot_engine.clear_cache()
+        pivots = pivot_engine.get_pivots(self.data)
+        with capture_stdout(calculate_statistics.gen_pvt_table_stdout_reports, pivots):
+            pass
+        self.assertEqual(pivot_engine.cache_info().misses, len(pivot_engine.AGGREGATIONS))
+
+        self.assertIs(pivot_engine.get_pivots(self.data), pivots)
+        median = pivot_engine.get_pivots(self.data).pivot_table('Month', 'Median', fill_value=0)
+        self.assertIs(median, pivots.pivot_table('Month', 'Median', fill_value=0))
+        self.assertEqual(pivot_engine.cache_info().hits, 2)
+        self.assertEqual(pivot_engine.cache_info().currsize, 1)
+
+        self.data['Extra'] = 0.0
+        self.assertIsNot(pivot_engine.get_pivots(self.data), pivots)
+        pivot_engine.clear_cache()
+        self.assertEqual(pivot_engine.cache_info(), (0, 0, pivot_engine.MAX_CACHED_FRAMES, 0))
+
+
+# Tests for the fuel economy and cost metrics
+class FuelMetricsTests(unittest.TestCase):
+    """
+    These tests ensure that the optional Gallons and Cost columns are picked up and reported on.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        data, _ = load_data.import_data(SAMPLE_DATA_FILE)
+        filled = np.arange(len(data)) % 7 == 3
+        data['Gallons'] = np.where(filled, 10.0, np.nan)
+        data['Cost'] = np.where(filled, 30.0, np.nan)
+        self.path = os.path.join(self.temp_dir, 'fuel.csv')
+        data.to_csv(self.path, index=False, date_format=load_data.DEFAULT_DATE_FORMAT)
+
+    def tearDown(self):
+        silent_remove(self.temp_dir)
+
+    def test_metrics_match_pivot_table(self):
+        """
+        The fuel tables should match ratios of pivot_table sums, and come from the same grouping as the mileage.
+        :return:
+        """
+        data, _ = load_data.import_data(self.path, usecols="A:D")
+        data = load_data.establish_relevant_columns(data)
+        self.assertEqual(load_data.fuel_columns(data), ['Gallons', 'Cost'])
+        pivots = pivot_engine.PivotResults(data)
+        self.assertEqual(pivots.fuel_metrics(), list(pivot_engine.FUEL_METRICS))
+        self.assertEqual(list(pivots.aggregate('Month').columns),
+                         list(pivot_engine.AGGREGATIONS) + list(pivot_engine.FUEL_METRICS))
+
+        totals = data.pivot_table(values=['Miles', 'Gallons', 'Cost'], index='DayOfWeek', columns='Year',
+                                  aggfunc='sum')
+        pd.testing.assert_frame_equal(pivots.pivot_table('DayOfWeek', 'MPG'),
+                                      totals['Miles'] / totals['Gallons'].replace(0, np.nan))
+        pd.testing.assert_frame_equal(pivots.pivot_table('DayOfWeek', 'Cost per Mile'),
+                                      totals['Cost'] / totals['Miles'])
+        pd.testing.assert_frame_equal(pivots.pivot_table('DayOfWeek', 'Spend'), totals['Cost'])
+
+        self.assertEqual(pivot_engine.PivotResults(data[['Date', 'Miles', 'Month', 'Year']]).fuel_metrics(), [])
+
+    def test_fuel_reports(self):
+        """
+        The basic statistics, pivot table reports and plots should include the fuel metrics.
+        :return:
+        """
+        args = ['-i', self.path, '-c', 'A:D', '-b', '-v', '-P', '-H', '--no-cache']
+        with capture_stdout(gen_mileage_stats.main, args) as output:
+            self.assertTrue("Fuel Economy: 26.6 miles/gallon" in output)
+            self.assertTrue("Average Monthly Spend: 125.17" in output)
+            self.assertTrue("Monthly Spend\n==============" in output)
+
+        data, _ = load_data.import_data(self.path, usecols="A:D")
+        plot_config = make_plots.plots_for(pivot_engine.PivotResults(load_data.establish_relevant_columns(data)))
+        self.assertTrue(set(make_plots.fuel_plot_info) <= set(plot_config))
+
+
+# Tests for the precomputed rollup cube
+class RollupCubeTests(unittest.TestCase):
+    """
+    These tests ensure that reports answered from the rollup cube match those computed from the rows.
+    """
+
+    def setUp(self):
+        data, _ = load_data.import_data(SAMPLE_DATA_FILE)
+        self.data = load_data.establish_relevant_columns(data)
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        silent_remove(self.cache_dir)
+
+    def test_cube_pivots_match_rows(self):
+        """
+        Month x Year and DayOfWeek x Year tables read from the cube should equal the ones grouped from the rows.
+        :return:
+        """
+        cube_pivots = rollup_cube.CubePivots(self.data, rollup_cube.RollupCube.build(self.data))
+        row_pivots = pivot_engine.PivotResults(self.data)
+        for index in ('Month', 'DayOfWeek'):
+            for aggname in pivot_engine.AGGREGATIONS:
+                for fill_value in (0, None):
+                    pd.testing.assert_frame_equal(cube_pivots.pivot_table(index, aggname, fill_value=fill_value),
+                                                  row_pivots.pivot_table(index, aggname, fill_value=fill_value))
+
+    def test_cube_is_cached_with_data(self):
+        """
+        The cube should read back from the data cache unchanged, and its month cells should match a groupby.
+        :return:
+        """
+        cube = rollup_cube.RollupCube.build(self.data)
+        data_cache.store('cube', self.data, cache_dir=self.cache_dir, extras=cube.to_arrays())
+        data, arrays = data_cache.load('cube', cache_dir=self.cache_dir, with_arrays=True)
+        pd.testing.assert_frame_equal(data, self.data)
+
+        months = rollup_cube.RollupCube.from_arrays(arrays).frame('month')
+        pd.testing.assert_frame_equal(months, cube.frame('month'))
+        expected = self.data.groupby(self.data['Date'].dt.to_period('M'))['Miles'].agg(['count', 'sum', 'median'])
+        self.assertEqual(list(months['Count']), list(expected['count']))
+        np.testing.assert_allclose(months['Total'], expected['sum'])
+        np.testing.assert_allclose(months['Median'], expected['median'])
+        self.assertIsNone(rollup_cube.RollupCube.from_arrays(data_cache.frame_to_arrays(self.data)))
+
+    def test_cube_built_only_when_cached(self):
+        """
+        Runs that skip the data cache should group their pivot tables from the rows rather than build a cube for them.
+        :return:
+        """
+        for extra_args, cube_expected in ((['--no-cache'], False), (['--cache-dir', self.cache_dir], True)):
+            args, _ = gen_mileage_stats.parse_cmdline(['-i', SAMPLE_DATA_FILE] + extra_args)
+            data, ret = gen_mileage_stats._load_input(args, SAMPLE_DATA_FILE)
+            self.assertEqual(ret, gen_mileage_stats.RETVAL.SUCCESS)
+            pivots = pivot_engine.get_pivots(data)
+            self.assertEqual(isinstance(pivots, rollup_cube.CubePivots), cube_expected)
+
+
+# Tests for trailing-window statistics
+class RollingStatsTests(unittest.TestCase):
+    """
+    These tests ensure that the cumulative-sum windows match pandas' rolling sums over a daily calendar.
+    """
+
+    def setUp(self):
+        data, _ = load_data.import_data(SAMPLE_DATA_FILE)
+        self.data = load_data.establish_relevant_columns(data)
+
+    def test_matches_pandas_rolling(self):
+        """
+        Every window's totals and averages should match .rolling() on the log resampled to one row per day.
+        :return:
+        """
+        rolling = rolling_stats.rolling_frame(self.data)
+        daily = self.data.set_index('Date')['Miles'].resample('D').sum()
+        for window in rolling_stats.WINDOWS:
+            totals = daily.rolling(window, min_periods=1).sum()
+            averages = daily.rolling(window, min_periods=1).mean()
+            np.testing.assert_allclose(rolling['{}-Day Total'.format(window)].values, totals.values, atol=1e-9)
+            np.testing.assert_allclose(rolling['{}-Day Average'.format(window)].values, averages.values, atol=1e-9)
+
+    def test_basic_stats_report_latest_windows(self):
+        """
+        The basic statistics should include the windows ending on the last day of the log.
+        :return:
+        """
+        basic_stats = calculate_statistics.calculate_basic_stats(self.data)
+        latest = rolling_stats.rolling_frame(self.data).iloc[-1]
+        for window in rolling_stats.WINDOWS:
+            self.assertEqual(basic_stats['total_{}d'.format(window)]['data'],
+                             "{:.1f}".format(latest['{}-Day Total'.format(window)]))
+            self.assertEqual(basic_stats['average_{}d'.format(window)]['data'],
+                             "{:.1f}".format(latest['{}-Day Average'.format(window)]))
+
+    def test_blank_dates_are_skipped(self):
+        """
+        Entries without a date should be left out of the windows rather than break the basic statistics.
+        :return:
+        """
+        tmp_dir = tempfile.mkdtemp()
+        input_file = os.path.join(tmp_dir, 'blank_dates.csv')
+        try:
+            with open(input_file, 'w') as csv_file:
+                csv_file.write("Date,Miles\n2018-01-01,10\n,5\n2018-01-03,20\n")
+            with capture_stdout(gen_mileage_stats.main, ['-i', input_file, '-b', '-P', '-H', '--no-cache']) as output:
+                self.assertTrue("Miles Driven in the Last 7 Days: 30.0 miles" in output)
+                self.assertTrue("Average Daily Miles over the Last 7 Days: 10.0 miles/day" in output)
+        finally:
+            silent_remove(tmp_dir)
+
+        first_day, daily = rolling_stats.daily_totals(pd.to_datetime([None, None]), [1.0, 2.0])
+        self.assertIsNone(first_day)
+        self.assertEqual(len(daily), 0)
+
+
+# Tests for the on-demand basic statistics
+class LazyStatsTests(unittest.TestCase):
+    """
+    These tests ensure that basic statistics are only computed when they are read, and then only once.
+    """
+
+    def setUp(self):
+        data, _ = load_data.import_data(SAMPLE_DATA_FILE)
+        self.data = load_data.establish_relevant_columns(data)
+
+    def test_computed_on_first_read(self):
+        """
+        Nothing should be computed up front, and reading one statistic should compute only that one.
+        :return:
+        """
+        basic_stats = calculate_statistics.calculate_basic_stats(self.data)
+        self.assertEqual(basic_stats.pending(), len(basic_stats))
+        self.assertTrue('med_mileage' in basic_stats)
+        self.assertEqual(basic_stats.pending(), len(basic_stats))
+
+        self.assertEqual(basic_stats['med_mileage']['data'], "28.9")
+        self.assertEqual(basic_stats.pending(), len(basic_stats) - 1)
+
+        daily = rolling_stats.daily_totals(self.data['Date'], self.data['Miles'])[1]
+        expected = calculate_statistics.build_basic_stats(
+            mean_mileage=self.data['Miles'].mean(), med_mileage=self.data['Miles'].median(),
+            first_day=self.data['Date'].min(), last_day=self.data['Date'].max(), record_low=self.data['Miles'].min(),
+            record_high=self.data['Miles'].max(), rolling=rolling_stats.latest_windows(daily))
+        self.assertEqual(dict(basic_stats.items()), expected)
+        self.assertEqual(list(basic_stats), list(expected))
+        self.assertEqual(basic_stats.pending(), 0)
+
+    def test_groups_computed_once(self):
+        """
+        A group should be computed once, when any of its entries is read, and keep its place in the report order.
+        :return:
+        """
+        calls = []
+
+        def group():
+            calls.append(1)
+            return {'b': {'Name': 'B', 'units': '', 'data': "2"}, 'c': {'Name': 'C', 'units': '', 'data': "3"}}
+
+        extra = calculate_statistics.LazyStats()
+        extra.add_lazy_group(group)
+        stats = calculate_statistics.LazyStats({'a': {'Name': 'A', 'units': '', 'data': "1"}})
+        stats.update(extra)
+        stats['d'] = {'Name': 'D', 'units': '', 'data': "4"}
+        self.assertEqual(calls, [])
+
+        self.assertEqual(stats['c']['data'], "3")
+        self.assertEqual(list(stats), ['a', 'b', 'c', 'd'])
+        with capture_stdout(calculate_statistics.print_basic_stats, stats) as output:
+            self.assertTrue("B: 2" in output)
+        self.assertEqual(calls, [1])
+
+
+# Tests for date-range queries
+class RangeQueryTests(unittest.TestCase):
+    """
+    These tests ensure that indexed date-range statistics match a direct computation on the filtered log.
+    """
+
+    def setUp(self):
+        data, _ = load_data.import_data(SAMPLE_DATA_FILE)
+        self.data = load_data.establish_relevant_columns(data)
+
+    def test_matches_filtered_log(self):
+        """
+        Ranges inside single blocks, across several blocks and beyond the log should all match the filtered rows.
+        :return:
+        """
+        query = range_query.RangeQuery(self.data.sample(frac=1, random_state=0), block_size=16)
+        for start, end in [('2016-01-01', '2030-01-01'), ('2017-03-05', '2017-03-20'), ('2016-08-01', '2018-02-14'),
+                           ('2018-12-25', '2018-12-24'), (None, '2017-01-01')]:
+            in_range = self.data['Date'] <= pd.Timestamp(end)
+            if start is not None:
+                in_range &= self.data['Date'] >= pd.Timestamp(start)
+            miles = self.data.loc[in_range, 'Miles']
+
+            stats = query.stats(start, end)
+            self.assertEqual(stats['count'], len(miles))
+            self.assertAlmostEqual(stats['total'], miles.sum())
+            for name, expected in (('median', miles.median()), ('min', miles.min()), ('max', miles.max())):
+                if len(miles):
+                    self.assertEqual(stats[name], expected)
+                else:
+                    self.assertTrue(np.isnan(stats[name]))
+
+    def test_since_until_options(self):
+        """
+        --since and --until should print the statistics of the given date range.
+        :return:
+        """
+        args = ['-i', SAMPLE_DATA_FILE, '-P', '-H', '--since', '2018-01-01', '--until', '2018-06-30', '--no-cache']
+        with capture_stdout(gen_mileage_stats.main, args) as output:
+            self.assertTrue("Statistics from 01 Jan 2018 to 30 Jun 2018" in output)
+            self.assertTrue("Mileage Entries: 181" in output)
+
+        args = ['-i', SAMPLE_DATA_FILE, '-P', '-H', '--since', 'last tuesday', '--no-cache']
+        with capture_stderr(gen_mileage_stats.main, args) as output:
+            self.assertTrue("Could not read the --since or --until date" in output)
+
+
+# Tests for bootstrap confidence intervals
+class BootstrapTests(unittest.TestCase):
+    """
+    These tests ensure that bootstrap confidence intervals are reproducible and bracket the statistics they describe.
+    """
+
+    def setUp(self):
+        data, _ = load_data.import_data(SAMPLE_DATA_FILE)
+        self.data = load_data.establish_relevant_columns(data)
+
+    def test_seeded_intervals_are_reproducible(self):
+        """
+        A seed should fix the intervals regardless of the batch size, and the intervals should bracket the statistics.
+        :return:
+        """
+        samples = {'all': self.data['Miles'].values}
+        intervals = bootstrap.confidence_intervals(samples, n_resamples=2500, seed=7, jobs=1)['all']
+        self.assertLess(intervals['Mean'][0], self.data['Miles'].mean())
+        self.assertGreater(intervals['Mean'][1], self.data['Miles'].mean())
+        self.assertLessEqual(intervals['Median'][0], self.data['Miles'].median())
+        self.assertGreaterEqual(intervals['Median'][1], self.data['Miles'].median())
+
+        batch_values = bootstrap.MAX_BATCH_VALUES
+        bootstrap.MAX_BATCH_VALUES = 10 * len(self.data)
+        try:
+            self.assertEqual(bootstrap.confidence_intervals(samples, n_resamples=2500, seed=7, jobs=1)['all'],
+                             intervals)
+        finally:
+            bootstrap.MAX_BATCH_VALUES = batch_values
+
+        cells = bootstrap.pivot_intervals(self.data, 'Month', n_resamples=200, seed=7, jobs=1)
+        self.assertEqual(len(cells), self.data.groupby(['Month', 'Year'])['Miles'].count().gt(0).sum())
+        self.assertTrue((cells['Mean Low'] <= cells['Mean High']).all())
+
+    def test_bootstrap_option(self):
+        """
+        --bootstrap should add the intervals to the basic statistics, and reject invalid settings.
+        :return:
+        """
+        args = ['-i', SAMPLE_DATA_FILE, '-b', '-P', '-H', '--bootstrap', '500', '--seed', '1', '--no-cache']
+        with capture_stdout(gen_mileage_stats.main, args) as output:
+            self.assertTrue("Mean Mileage 95% Confidence Interval" in output)
+            self.assertTrue("Median Mileage 95% Confidence Interval" in output)
+
+        args = ['-i', SAMPLE_DATA_FILE, '-b', '-P', '-H', '--bootstrap', '500', '--confidence', '95', '--no-cache']
+        with capture_stderr(gen_mileage_stats.main, args) as output:
+            self.assertTrue("The confidence level must be between 0 and 1" in output)
+
+
+# Tests for anomalous entry detection
+class AnomalyDetectionTests(unittest.TestCase):
+    """
+    These tests ensure that entries far from the usual mileage of their month and day of the week are flagged.
+    """
+
+    def setUp(self):
+        data, _ = load_data.import_data(SAMPLE_DATA_FILE)
+        self.data = load_data.establish_relevant_columns(data)
+
+    def test_scores_match_grouped_median_and_mad(self):
+        """
+        The scores should match a groupby of the median and MAD, and a mistyped entry should be flagged.
+        :return:
+        """
+        self.data.loc[100, 'Miles'] = 1500.0
+        scores, baselines = anomaly_detection.robust_scores(self.data)
+
+        groups = self.data.groupby(['Month', 'DayOfWeek'])['Miles']
+        medians = groups.transform('median')
+        mads = (self.data['Miles'] - medians).abs().groupby([self.data['Month'], self.data['DayOfWeek']]).transform(
+            'median')
+        np.testing.assert_allclose(baselines, medians)
+        usable = mads.values > 0
+        np.testing.assert_allclose(scores[usable],
+                                   (anomaly_detection.MAD_SCALE * (self.data['Miles'] - medians) / mads)[usable])
+
+        flagged, flags = anomaly_detection.flag_anomalies(self.data)
+        self.assertTrue(flags[100])
+        self.assertEqual(flagged.loc[100, 'Miles'], 1500.0)
+        self.assertEqual(len(flagged), flags.sum())
+
+    def test_anomaly_options(self):
+        """
+        --anomalies should print the flagged entries, and --exclude-anomalies should leave them out of the statistics.
+        :return:
+        """
+        args = ['-i', SAMPLE_DATA_FILE, '-b', '-P', '-H', '--no-cache', '--anomalies', '--anomaly-threshold', '50']
+        with capture_stdout(gen_mileage_stats.main, args) as output:
+            self.assertTrue("Anomalous Entries" in output)
+            self.assertTrue("2018-06-14  213.7" in output)
+            self.assertTrue("Record High Miles Driven: 214.3 miles" in output)
+
+        args = ['-i', SAMPLE_DATA_FILE, '-b', '-P', '-H', '--no-cache', '--exclude-anomalies']
+        with capture_stdout(gen_mileage_stats.main, args) as output:
+            self.assertFalse("Anomalous Entries" in output)
+            self.assertTrue("Record High Miles Driven: 148.5 miles" in output)
+
+
+# Tests for year-end and lease-cap projections
+class ForecastingTests(unittest.TestCase):
+    """
+    These tests ensure that the seasonal model recovers known effects and projects sensible totals and cap dates.
+    """
+
+    def test_recovers_seasonal_model(self):
+        """
+        A noiseless log built from known weekday and month effects should be projected exactly.
+        :return:
+        """
+        days = pd.date_range('2016-01-01', '2018-06-30', freq='D')
+        miles = 20.0 + 10.0 * (days.dayofweek == 5) + 5.0 * (days.month == 12)
+        log = pd.DataFrame({'Date': days, 'Miles': miles})
+        results = forecasting.forecast(log, cap=5000)
+
+        rest_of_year = pd.date_range('2018-07-01', '2018-12-31', freq='D')
+        expected = miles[days.year == 2018].sum() + (20.0 + 10.0 * (rest_of_year.dayofweek == 5) +
+                                                     5.0 * (rest_of_year.month == 12)).sum()
+        self.assertAlmostEqual(results['projected'], expected, places=6)
+        self.assertAlmostEqual(results['low'], results['high'], places=6)
+        self.assertEqual(results['year_end'], pd.Timestamp('2018-12-31'))
+
+        cumulative = np.cumsum(np.concatenate([miles[days.year == 2018], 20.0 + 10.0 * (rest_of_year.dayofweek == 5) +
+                                               5.0 * (rest_of_year.month == 12)]))
+        self.assertEqual(results['cap_day'], pd.Timestamp('2018-01-01') + pd.Timedelta(
+            days=int(np.searchsorted(cumulative, 5000))))
+
+        start, end = forecasting.cap_year(pd.Timestamp('2018-06-30'), year_start='2015-09-15')
+        self.assertEqual((start, end), (pd.Timestamp('2017-09-15'), pd.Timestamp('2018-09-15')))
+
+    def test_forecast_options(self):
+        """
+        --mileage-cap should add the projection and the cap date to the basic statistics.
+        :return:
+        """
+        args = ['-i', SAMPLE_DATA_FILE, '-b', '-P', '-H', '--no-cache', '--mileage-cap', '12000',
+                '--lease-start', '2016-07-16']
+        with capture_stdout(gen_mileage_stats.main, args) as output:
+            self.assertTrue("Projected Miles Driven from 16 Jul 2018 to 15 Jul 2019" in output)
+            self.assertTrue("Projected Date of Reaching the 12000-Mile Cap" in output)
+
+        args = ['-i', SAMPLE_DATA_FILE, '-b', '-P', '-H', '--lease-start', 'someday', '--no-cache']
+        with capture_stderr(gen_mileage_stats.main, args) as output:
+            self.assertTrue("Could not read the --lease-start date" in output)
+
+
+# Tests for bounded-memory streaming mode
+class StreamingTests(unittest.TestCase):
+    """
+    These tests ensure that streaming mode reports the same statistics as the in-memory pipeline.
+    """
+
+    def test_stream_matches_in_memory_reports(self):
+        """
+        Streaming the sample file in small chunks should print the same basic statistics and pivot values.
+        :return:
+        """
+        args = ['-i', SAMPLE_DATA_FILE, '-b', '-P', '-H', '--no-cache']
+        with capture_stdout(gen_mileage_stats.main, args) as output:
+            in_memory_output = output
+
+        args = ['-i', SAMPLE_DATA_FILE, '-b', '-v', '-P', '-H', '--stream', '--chunksize', '100', '--no-cache']
+        with capture_stdout(gen_mileage_stats.main, args) as output:
+            self.assertTrue(in_memory_output.strip() in output)
+            self.assertTrue("50.970968" in output)
+            self.assertTrue("56.922581" in output)
+
+    def test_stream_requires_text_only_output(self):
+        """
+        Streaming mode can't produce plots, so it should refuse to run without -P and -H.
+        :return:
+        """
+        args = ['-i', SAMPLE_DATA_FILE, '--stream', '--no-cache']
+        with capture_stderr(gen_mileage_stats.main, args) as output:
+            self.assertTrue("Streaming mode only produces text reports" in output)
+
+    def test_stream_rejects_corrupt_and_xls_workbooks(self):
+        """
+        A corrupt workbook should get the usual corrupt-file warning, and an .xls workbook should be refused up front.
+        :return:
+        """
+        tmp_dir = tempfile.mkdtemp()
+        not_a_zip, empty_zip = os.path.join(tmp_dir, 'not_a_zip.xlsx'), os.path.join(tmp_dir, 'empty_zip.xlsx')
+        try:
+            with open(not_a_zip, 'wb') as out_file:
+                out_file.write(b'not a workbook')
+            with zipfile.ZipFile(empty_zip, 'w') as archive:
+                archive.writestr('readme.txt', 'no workbook parts here')
+
+            for path in (os.path.join(TEST_DATA_DIR, 'test_data_corrupted.xlsx'), not_a_zip, empty_zip):
+                args = ['-i', path, '-b', '-P', '-H', '--stream', '--no-cache']
+                with capture_stderr(gen_mileage_stats.main, args) as output:
+                    self.assertTrue("Excel file appears to be corrupt." in output)
+                    self.assertFalse("Workbook contains invalid data" in output)
+        finally:
+            silent_remove(tmp_dir)
+
+        with self.assertRaises(ValueError):
+            stream_stats.iter_chunks('mileage.xls')
+        self.assertFalse(stream_stats.streamable('mileage.xls'))
+        self.assertTrue(stream_stats.streamable('mileage.xlsx'))
+
+    def test_running_median(self):
+        """
+        The running median should match np.median regardless of how the values are split into chunks.
+        :return:
+        """
+        values = np.array([3.0, 1.0, 4.0, 1.0, 5.0, 9.0, 2.0, 6.0])
+        stats = stream_stats.RunningStats()
+        stats.update(values[:3])
+        stats.update(values[3:])
+        self.assertEqual(stats.median, np.median(values))
+        stats.update(np.array([5.0]))
+        self.assertEqual(stats.median, np.median(np.append(values, 5.0)))
+
+    def test_approximate_median_within_error(self):
+        """
+        A sketched median should be within its rank error bound, whether the values arrive in chunks or are split
+        between sketches that are merged afterwards.
+        :return:
+        """
+        values = np.round(np.random.RandomState(0).gamma(2.0, 20.0, size=200000), 1)
+        error = 0.01
+
+        chunked = stream_stats.RunningStats(median_error=error)
+        for chunk in np.array_split(values, 17):
+            chunked.update(chunk)
+
+        merged = stream_stats.RunningStats(median_error=error)
+        for part in np.array_split(values, 3):
+            stats = stream_stats.RunningStats(median_error=error)
+            stats.update(part)
+            merged.merge(stats)
+
+        for stats in (chunked, merged):
+            self.assertEqual(stats.count, len(values))
+            self.assertLess(abs((values < stats.median).mean() - 0.5), error)
+            self.assertLess(stats.sketch.size, len(values) // 100)
+
+    def test_approximate_median_requires_stream(self):
+        """
+        --approx-median only applies to streaming mode, and its error bound must be a sensible fraction.
+        :return:
+        """
+        args = ['-i', SAMPLE_DATA_FILE, '-b', '-P', '-H', '--approx-median', '0.01', '--no-cache']
+        with capture_stderr(gen_mileage_stats.main, args) as output:
+            self.assertTrue("Approximate medians are only available in streaming or incremental mode" in output)
+
+        args = ['-i', SAMPLE_DATA_FILE, '-b', '-P', '-H', '--stream', '--approx-median', '2', '--no-cache']
+        with capture_stderr(gen_mileage_stats.main, args) as output:
+            self.assertTrue("must be between 0 and 0.5" in output)
+
+        args = ['-i', SAMPLE_DATA_FILE, '-b', '-v', '-P', '-H', '--stream', '--approx-median', '0.01', '--no-cache']
+        with capture_stdout(gen_mileage_stats.main, args) as output:
+            self.assertTrue("Median Mileage" in output)
+
+
+# Tests for the memory budget and the per-stage memory report
+class MemoryBudgetTests(unittest.TestCase):
+    """
+    These tests ensure that a run projected to exceed its memory budget is streamed when it can be, and that memory is
+    reported by stage.
+    """
+
+    def test_budget_switches_to_streaming(self):
+        """
+        A budget smaller than the projected peak should stream the input, and report the same statistics.
+        :return:
+        """
+        self.assertEqual(memory_budget.projected_peak([SAMPLE_CSV_FILE]),
+                         os.path.getsize(SAMPLE_CSV_FILE) * memory_budget.PEAK_BYTES_PER_INPUT_BYTE['csv'])
+
+        args = ['-i', SAMPLE_CSV_FILE, '-b', '-P', '-H', '--no-cache']
+        with capture_stdout(gen_mileage_stats.main, args) as output:
+            in_memory_output = output
+
+        args = ['-i', SAMPLE_CSV_FILE, '-b', '--memory-budget', '0.01', '--no-cache']
+        with capture_stderr(gen_mileage_stats.main, args) as errors:
+            self.assertTrue("Streaming it instead" in errors)
+        with capture_stdout(gen_mileage_stats.main, args) as output:
+            self.assertTrue(in_memory_output.strip() in output)
+
+        args = ['-i', SAMPLE_CSV_FILE, '-b', '-P', '-H', '--no-cache', '--memory-budget', '0.01', '--anomalies']
+        with capture_stderr(gen_mileage_stats.main, args) as errors:
+            self.assertTrue("It can't be streamed with --anomalies, so it is loaded whole anyway." in errors)
+            self.assertFalse("Streaming mode" in errors)
+
+    def test_budget_loads_unstreamable_input_whole(self):
+        """
+        Input that streaming mode can't read (NDJSON, or a fleet of files) should be loaded whole despite the budget.
+        :return:
+        """
+        fleet_dir = tempfile.mkdtemp()
+        try:
+            shutil.copy(SAMPLE_CSV_FILE, os.path.join(fleet_dir, 'car_a.csv'))
+            shutil.copy(SAMPLE_CSV_FILE, os.path.join(fleet_dir, 'car_b.csv'))
+            for input_file, blocker in ((SAMPLE_NDJSON_FILE, "ndjson input"), (fleet_dir, "several input files")):
+                args = ['-i', input_file, '-b', '-P', '-H', '--no-cache', '-j', '1']
+                with capture_stdout(gen_mileage_stats.main, args) as output:
+                    in_memory_output = output
+
+                args += ['--memory-budget', '0.01']
+                with capture_stderr(gen_mileage_stats.main, args) as errors:
+                    self.assertTrue("It can't be streamed with {}".format(blocker) in errors)
+                with capture_stdout(gen_mileage_stats.main, args) as output:
+                    self.assertEqual(output, in_memory_output)
+                self.assertEqual(gen_mileage_stats.main(args), gen_mileage_stats.RETVAL.SUCCESS)
+        finally:
+            silent_remove(fleet_dir)
+
+    def test_memory_report(self):
+        """
+        --memory-report should print the peak memory of every stage, and the tracker should see a stage's allocations.
+        :return:
+        """
+        args = ['-i', SAMPLE_DATA_FILE, '-b', '-P', '-H', '--no-cache', '--memory-report']
+        with capture_stdout(gen_mileage_stats.main, args) as output:
+            self.assertTrue("Peak Memory by Stage" in output)
+            for stage in ("Load", "Statistics", "Text Reports"):
+                self.assertTrue("\n{}: ".format(stage) in output)
+
+        tracker = memory_budget.StageTracker()
+        tracker.start_stage("Small")
+        small = np.ones(1000)
+        tracker.start_stage("Large")
+        large = np.ones(2 ** 20)
+        stages = tracker.finish()
+        self.assertEqual(list(stages), ["Small", "Large"])
+        self.assertGreater(stages["Large"], large.nbytes)
+        self.assertLess(stages["Small"], large.nbytes)
+        del small, large
+
+    def test_failed_run_stops_tracing(self):
+        """
+        A run that fails after its first stage has started should still stop tracemalloc.
+        :return:
+        """
+        args = ['-i', os.path.join(TEST_DATA_DIR, 'test_data_corrupted.xlsx'), '-P', '-H', '--no-cache',
+                '--memory-report']
+        with capture_stderr(gen_mileage_stats.main, args) as output:
+            self.assertTrue("Excel file appears to be corrupt." in output)
+        self.assertFalse(tracemalloc.is_tracing())
+
+
+# Tests for incremental basic statistics
+class IncrementalStatsTests(unittest.TestCase):
+    """
+    These tests ensure that saved basic statistics are extended with new rows only, and match a full recomputation.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.input_file = os.path.join(self.tmp_dir, 'mileage.csv')
+        shutil.copy(SAMPLE_CSV_FILE, self.input_file)
+
+    def tearDown(self):
+        silent_remove(self.tmp_dir)
+
+    def test_incremental_matches_full_report(self):
+        """
+        Running twice with --incremental should print the same basic statistics as a normal run, from saved state.
+        :return:
+        """
+        args = ['-i', self.input_file, '-b', '-P', '-H', '--no-cache']
+        with capture_stdout(gen_mileage_stats.main, args) as output:
+            full_output = output
+
+        for _ in range(2):
+            with capture_stdout(gen_mileage_stats.main, args + ['--incremental']) as output:
+                self.assertEqual(output, full_output)
+        self.assertTrue(os.path.isfile(incremental_stats.state_path(self.input_file)))
+
+    def test_refresh_folds_in_new_rows_only(self):
+        """
+        Only rows after the watermark should be folded in, and a changed history should trigger a rebuild.
+        :return:
+        """
+        data, _ = load_data.import_data(self.input_file)
+        data = load_data.establish_relevant_columns(data)
+        old, new = data.iloc[:-30], data.iloc[-30:]
+
+        _, folded = incremental_stats.refresh(self.input_file, old)
+        self.assertEqual(folded, len(old))
+        stats, folded = incremental_stats.refresh(self.input_file, data)
+        self.assertEqual(folded, len(new))
+
+        self.assertEqual(stats.count, len(data))
+        self.assertAlmostEqual(stats.mean, data['Miles'].mean())
+        self.assertAlmostEqual(stats.variance, data['Miles'].var())
+        self.assertEqual(stats.median, data['Miles'].median())
+        self.assertEqual(stats.last_day, data['Date'].max())
+        full = calculate_statistics.calculate_basic_stats(data)
+        for window in rolling_stats.WINDOWS:
+            self.assertEqual(stats.basic_stats()['total_{}d'.format(window)], full['total_{}d'.format(window)])
+
+        _, folded = incremental_stats.refresh(self.input_file, data.iloc[1:])
+        self.assertEqual(folded, len(data) - 1)
+
+    def test_edited_history_is_rebuilt(self):
+        """
+        Editing an entry before the watermark should rebuild the statistics rather than keep the stale ones.
+        :return:
+        """
+        data, _ = load_data.import_data(self.input_file)
+        data = load_data.establish_relevant_columns(data)
+        incremental_stats.refresh(self.input_file, data)
+
+        self.assertEqual(incremental_stats.refresh(self.input_file, data)[1], 0)
+
+        edited = data.copy()
+        for row in (0, len(data) // 2):
+            edited.iloc[row, edited.columns.get_loc('Miles')] = 9999.0
+            stats, folded = incremental_stats.refresh(self.input_file, edited)
+            self.assertEqual(folded, len(edited))
+            self.assertEqual(stats.max, 9999.0)
+            self.assertAlmostEqual(stats.mean, edited['Miles'].mean())
+
+
+# Tests for fleet (multi-file) loading
+class FleetTests(unittest.TestCase):
+    """
+    These tests ensure that several input files can be loaded together, one per vehicle.
+    """
+
+    def setUp(self):
+        self.fleet_dir = tempfile.mkdtemp()
+        shutil.copy(SAMPLE_DATA_FILE, os.path.join(self.fleet_dir, 'car_a.xlsx'))
+        shutil.copy(SAMPLE_CSV_FILE, os.path.join(self.fleet_dir, 'car_b.csv'))
+        shutil.copy(os.path.join(TEST_DATA_DIR, 'test_data_corrupted.xlsx'),
+                    os.path.join(self.fleet_dir, 'car_c.xlsx'))
+
+    def tearDown(self):
+        silent_remove(self.fleet_dir)
+
+    def test_expand_input_paths(self):
+        """
+        Directories and glob patterns should expand to the input files they contain, without duplicates.
+        :return:
+        """
+        paths = load_data.expand_input_paths([self.fleet_dir, os.path.join(self.fleet_dir, '*.csv')])
+        self.assertEqual([os.path.basename(path) for path in paths], ['car_a.xlsx', 'car_b.csv', 'car_c.xlsx'])
+        self.assertEqual(load_data.vehicle_name(paths[0]), 'car_a')
+
+    def test_bad_file_does_not_stop_batch(self):
+        """
+        A corrupt file in a fleet directory should be reported and skipped while the other vehicles are still loaded.
+        :return:
+        """
+        args = ['-i', self.fleet_dir, '-b', '-P', '-H', '--no-cache', '-j', '2']
+        with capture_stderr(gen_mileage_stats.main, args) as output:
+            self.assertTrue("Excel file appears to be corrupt." in output)
+            self.assertTrue("Skipping" in output and 'car_c.xlsx' in output)
+
+        parsed_args, _ = gen_mileage_stats.parse_cmdline(args)
+        data, ret = gen_mileage_stats._load_fleet(parsed_args, load_data.expand_input_paths(parsed_args.input_file))
+        self.assertEqual(ret, gen_mileage_stats.RETVAL.SUCCESS)
+        self.assertEqual(sorted(data['Vehicle'].unique()), ['car_a', 'car_b'])
+
+    def test_workers_share_cache(self):
+        """
+        Workers writing, reading and evicting entries of one cache directory at once should not fail any vehicle.
+        :return:
+        """
+        os.remove(os.path.join(self.fleet_dir, 'car_c.xlsx'))
+        names = ['car_{}'.format(number) for number in range(8)]
+        for name in names:
+            shutil.copy(SAMPLE_CSV_FILE, os.path.join(self.fleet_dir, name + '.csv'))
+        cache_dir = os.path.join(self.fleet_dir, 'cache')
+
+        # A cache too small for even one entry makes every worker evict the others' entries as it stores its own.
+        args = ['-i', os.path.join(self.fleet_dir, 'car_*.csv'), '-P', '-H', '--cache-dir', cache_dir,
+                '--cache-size', '0.001', '-j', '4']
+        for _ in range(2):
+            parsed_args, _ = gen_mileage_stats.parse_cmdline(args)
+            with capture_stderr(gen_mileage_stats._load_fleet, parsed_args,
+                                load_data.expand_input_paths(parsed_args.input_file)) as output:
+                self.assertFalse("Skipping" in output)
+        data, ret = gen_mileage_stats._load_fleet(parsed_args, load_data.expand_input_paths(parsed_args.input_file))
+        self.assertEqual(ret, gen_mileage_stats.RETVAL.SUCCESS)
+        self.assertEqual(sorted(data['Vehicle'].unique()), sorted(names + ['car_b']))
+
+
 # Tests for plotting
 class PlottingTests(unittest.TestCase):
     """
@@ -145,7 +1301,7 @@ class PlottingTests(unittest.TestCase):
         # First, silently remove the image output directory to see if the program can produce it.
         silent_remove(make_plots.IMG_DIR, DISABLE_REMOVE)
 
-        args = ['-i', SAMPLE_DATA_FILE, '-H']
+        args = ['-i', SAMPLE_DATA_FILE, '-H', '--no-cache']
         with capture_stdout(gen_mileage_stats.main, args) as output:
             self.assertTrue("Plots saved to" in output)
 
@@ -168,7 +1324,7 @@ class PlottingTests(unittest.TestCase):
         # First, silently remove the image output directory to ensure we're not polluting our test.
         silent_remove(make_plots.IMG_DIR, DISABLE_REMOVE)
 
-        args = ['-i', SAMPLE_DATA_FILE, '-P', '-H']
+        args = ['-i', SAMPLE_DATA_FILE, '-P', '-H', '--no-cache']
         with capture_stdout(gen_mileage_stats.main, args) as output:
             self.assertFalse("Plots saved to" in output)
 
@@ -193,7 +1349,7 @@ class HTMLRenderTests(unittest.TestCase):
         Test the Jinja2 wrapper function
         :return:
         """
-        args = ['-i', SAMPLE_DATA_FILE]
+        args = ['-i', SAMPLE_DATA_FILE, '--no-cache']
         try:
             with capture_stdout(gen_mileage_stats.main, args) as output:
                 self.assertTrue("HTML report rendered to" in output)
@@ -212,7 +1368,7 @@ class HTMLRenderTests(unittest.TestCase):
         silent_remove(make_plots.IMG_DIR, DISABLE_REMOVE)
         silent_remove(gen_mileage_stats.HTML_OUT_PATH)
 
-        args = ['-i', SAMPLE_DATA_FILE, '-H']
+        args = ['-i', SAMPLE_DATA_FILE, '-H', '--no-cache']
         with capture_stdout(gen_mileage_stats.main, args) as output:
             self.assertFalse(os.path.isfile(gen_mileage_stats.HTML_OUT_PATH))
 